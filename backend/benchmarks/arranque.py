@@ -0,0 +1,170 @@
+"""
+StyleMatch — Benchmark de arranque en frío
+
+Cada corrida es un proceso Python nuevo que importa lambda_function desde un
+directorio limpio y atiende un primer /analizar con fixtures (clientes stub,
+como bench.py). Mide el import/init del módulo y la primera invocación, y
+compara el p99 del total contra un presupuesto.
+
+El presupuesto es el del build con bytecode (empaquetar.py build +
+lambda_precompilado=true): el modo fuente compila el módulo en cada
+arranque y se reporta solo como referencia, sin presupuesto.
+
+Uso (desde backend/):
+    python benchmarks/arranque.py                        # 20 corridas, modo fuente y pyc
+    python benchmarks/arranque.py --corridas 50 --presupuesto-ms 120
+    python benchmarks/arranque.py --modos pyc --estricto # exit 1 si el p99 de pyc supera el presupuesto
+
+Modos:
+    fuente  solo lambda_function.py: cada arranque compila el módulo (deploy clásico)
+    pyc     con __pycache__ unchecked-hash, como lo arma empaquetar.py build
+
+El costo de boto3 (import + cliente) se reporta aparte si está instalado:
+los clientes stub no lo incluyen.
+"""
+
+import argparse
+import json
+import os
+import py_compile
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+AQUI    = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.dirname(AQUI)
+MODOS   = ("fuente", "pyc")
+MODOS_CON_PRESUPUESTO = ("pyc",)   # el artefacto para el que vale el presupuesto
+
+
+def _hijo(directorio: str):
+    """Corre dentro del proceso nuevo: import + primer request, imprime JSON."""
+    t0 = time.perf_counter()
+    sys.path.insert(0, AQUI)
+    import bench   # stubs de boto3 y SerpAPI
+    bench._instalar_boto3_stub()
+    os.environ["SERPAPI_KEY"]          = "bench"
+    os.environ["CACHE_SHARED_BACKEND"] = ""
+    os.environ["SERPAPI_CACHE_DIR"]    = os.path.join(directorio, "cache")
+    os.environ["INDICE_PATH"]          = os.path.join(directorio, "indice.db")
+    os.environ["LOG_LEVEL"]            = "ERROR"
+    os.environ["METRICS_SAMPLE_RATE"]  = "0"
+    sys.path.insert(0, directorio)
+    t_import = time.perf_counter()
+    import lambda_function as lf
+    t_init = time.perf_counter()
+
+    fixture = bench._cargar_fixture("rekognition_una_prenda.json")
+    bench._preparar_stubs(lf, json.dumps(bench._cargar_fixture("serpapi_shopping.json")))
+    lf._rekognition().respuestas["detect_labels"] = fixture["detect_labels"]
+    evento = {"body": json.dumps({
+        "imagen_base64": lf.base64.b64encode(bench.IMAGEN_JPEG).decode(),
+        "genero":        fixture["genero"],
+    })}
+    t_req = time.perf_counter()
+    respuesta = lf.lambda_handler(evento, bench._ContextoStub())
+    t_fin = time.perf_counter()
+    assert respuesta["statusCode"] == 200, respuesta["body"][:200]
+
+    print(json.dumps({
+        "harness_ms":  (t_import - t0) * 1000,
+        "import_ms":   (t_init - t_import) * 1000,
+        "init_ms":     lf._INIT_MS,
+        "primera_ms":  (t_fin - t_req) * 1000,
+        "total_ms":    (t_init - t_import + t_fin - t_req) * 1000,
+    }))
+
+
+def _preparar_directorio(modo: str) -> str:
+    directorio = tempfile.mkdtemp(prefix=f"stylematch-arranque-{modo}-")
+    destino = os.path.join(directorio, "lambda_function.py")
+    shutil.copy2(os.path.join(BACKEND, "lambda_function.py"), destino)
+    if modo == "pyc":
+        py_compile.compile(destino, doraise=True,
+                           invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+    return directorio
+
+
+def _corridas(modo: str, n: int) -> list:
+    directorio = _preparar_directorio(modo)
+    entorno = dict(os.environ)
+    if modo == "fuente":
+        entorno["PYTHONDONTWRITEBYTECODE"] = "1"   # que ningún arranque deje pyc al siguiente
+    try:
+        resultados = []
+        for _ in range(n):
+            salida = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--hijo", directorio],
+                capture_output=True, text=True, env=entorno, check=True,
+            ).stdout
+            resultados.append(json.loads(salida.strip().splitlines()[-1]))
+        return resultados
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def _costo_boto3():
+    """Import de boto3 + creación de un cliente en un proceso nuevo, si boto3 está instalado."""
+    codigo = (
+        "import time; t=time.perf_counter(); import boto3; t1=time.perf_counter(); "
+        "boto3.client('s3', region_name='us-east-1'); t2=time.perf_counter(); "
+        "print((t1-t)*1000, (t2-t1)*1000)"
+    )
+    r = subprocess.run([sys.executable, "-c", codigo], capture_output=True, text=True)
+    if r.returncode != 0:
+        return None
+    importar, cliente = map(float, r.stdout.split())
+    return {"import_ms": round(importar, 1), "cliente_ms": round(cliente, 1)}
+
+
+def _percentil(valores: list, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de arranque en frío del Lambda")
+    parser.add_argument("--hijo", help=argparse.SUPPRESS)
+    parser.add_argument("--modos", nargs="+", choices=MODOS, default=list(MODOS))
+    parser.add_argument("--corridas", type=int, default=20)
+    parser.add_argument("--presupuesto-ms", type=float, default=150.0,
+                        help="p99 máximo de import + primera invocación del build pyc")
+    parser.add_argument("--estricto", action="store_true", help="exit 1 si el build pyc supera el presupuesto")
+    args = parser.parse_args(argv)
+
+    if args.hijo:
+        _hijo(args.hijo)
+        return 0
+
+    excedidos = []
+    print(f"{'modo':<8}{'métrica':<12}{'p50 ms':>10}{'p99 ms':>10}{'máx ms':>10}")
+    print("─" * 50)
+    for modo in args.modos:
+        corridas = _corridas(modo, args.corridas)
+        for metrica in ("import_ms", "init_ms", "primera_ms", "total_ms"):
+            valores = [c[metrica] for c in corridas]
+            print(f"{modo:<8}{metrica[:-3]:<12}{statistics.median(valores):>10.1f}"
+                  f"{_percentil(valores, 99):>10.1f}{max(valores):>10.1f}")
+        p99 = _percentil([c["total_ms"] for c in corridas], 99)
+        if modo in MODOS_CON_PRESUPUESTO and p99 > args.presupuesto_ms:
+            excedidos.append(f"{modo} ({p99:.1f} ms)")
+
+    boto3 = _costo_boto3()
+    if boto3:
+        print(f"\nboto3 (no incluido arriba): import {boto3['import_ms']} ms · cliente {boto3['cliente_ms']} ms")
+    else:
+        print("\nboto3 no instalado: el costo de import y de cliente no está medido")
+
+    print(f"Presupuesto p99 total: {args.presupuesto_ms:.0f} ms, solo para {', '.join(MODOS_CON_PRESUPUESTO)}"
+          " (fuente compila en cada arranque: es referencia)")
+    if excedidos:
+        print(f"Excedido en: {', '.join(excedidos)}")
+        return 1 if args.estricto else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
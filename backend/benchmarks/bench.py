@@ -0,0 +1,339 @@
+"""
+StyleMatch — Micro-benchmarks offline del pipeline de análisis
+
+Maneja `lambda_handler` y sus etapas con payloads grabados de Rekognition
+(detect_labels) y de SerpAPI (shopping_results) a través de clientes stub:
+no hace falta red, credenciales ni boto3 instalado.
+
+Uso (desde backend/):
+    python benchmarks/bench.py                    # corre y compara con la baseline si existe
+    python benchmarks/bench.py --guardar          # corre y guarda la baseline
+    python benchmarks/bench.py --casos outfit --iteraciones 500
+    python benchmarks/bench.py --estricto         # exit 1 si alguna etapa empeora más que --umbral
+
+Por etapa reporta mediana y p95 (µs), memoria asignada en el pico de una
+llamada (tracemalloc) y bloques que quedan vivos; al final, el pico de RSS
+del proceso.
+"""
+
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+AQUI     = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(AQUI, "fixtures")
+BASELINE = os.path.join(AQUI, "baseline.json")
+CASOS    = ("una_prenda", "outfit", "muchos_labels", "sin_prenda")
+
+# JPEG mínimo: pasa el sniff de formato y queda bajo NORMALIZAR_DESDE_BYTES,
+# así el benchmark no depende de Pillow
+IMAGEN_JPEG = b"\xff\xd8\xff\xe0" + bytes(range(256)) * 8
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Clientes stub
+# ─────────────────────────────────────────────────────────────────────────────
+
+class _ClienteStub:
+    """Cliente boto3 falso: cada operación responde desde `respuestas`."""
+
+    def __init__(self, servicio: str):
+        self.servicio   = servicio
+        self.respuestas = {}
+        self.llamadas   = 0
+
+    def __getattr__(self, operacion):
+        if operacion.startswith("_"):
+            raise AttributeError(operacion)
+
+        def llamar(**kwargs):
+            self.llamadas += 1
+            respuesta = self.respuestas.get(operacion)
+            return respuesta(**kwargs) if callable(respuesta) else (respuesta or {})
+        return llamar
+
+
+_CLIENTES = {}
+
+
+class _ContextoStub:
+    """Lo mínimo del context de Lambda que usa el handler."""
+    function_name = "stylematch-bench"
+
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+
+def _instalar_boto3_stub():
+    """
+    Reemplaza boto3 en sys.modules antes de importar lambda_function: ningún
+    cliente puede salir a la red aunque boto3 esté instalado.
+    """
+    modulo = types.ModuleType("boto3")
+    modulo.client = lambda servicio, **_: _CLIENTES.setdefault(servicio, _ClienteStub(servicio))
+    sys.modules["boto3"] = modulo
+
+
+def _cargar_fixture(nombre: str) -> dict:
+    with open(os.path.join(FIXTURES, nombre), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _importar_lambda(cache_dir: str):
+    os.environ["SERPAPI_KEY"]          = "bench"
+    os.environ["SERPAPI_CACHE_DIR"]    = cache_dir
+    os.environ["CACHE_SHARED_BACKEND"] = ""
+    os.environ["INDICE_PATH"]          = os.path.join(cache_dir, "indice.db")
+    os.environ.pop("AWS_LAMBDA_FUNCTION_NAME", None)
+    _instalar_boto3_stub()
+    sys.path.insert(0, os.path.dirname(AQUI))
+    import lambda_function
+    return lambda_function
+
+
+def _preparar_stubs(lf, shopping_json: str):
+    # SerpAPI: el texto grabado se decodifica en cada llamada, como la respuesta real
+    def serpapi_stub(query, hl="en", gl="us"):
+        return json.loads(shopping_json)["shopping_results"]
+    lf._fetch_serpapi_remote = serpapi_stub
+    lf._s3().respuestas["put_object"] = {}
+
+
+def _reiniciar_caches(lf, cache_dir: str):
+    """Estado de contenedor frío: sin cache de SerpAPI ni de visión."""
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    lf._serp_cache   = None
+    lf._vision_cache = None
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Medición
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _medir(fn, iteraciones: int, preparar=None) -> dict:
+    """
+    Tiempos por llamada (µs) y asignaciones de una llamada representativa.
+    `preparar` corre fuera de la medición antes de cada llamada.
+    """
+    silencio = io.StringIO()
+    tiempos  = []
+    with contextlib.redirect_stdout(silencio):
+        for _ in range(min(3, iteraciones)):   # calentamiento
+            if preparar:
+                preparar()
+            fn()
+        for _ in range(iteraciones):
+            if preparar:
+                preparar()
+            t0 = time.perf_counter()
+            fn()
+            tiempos.append((time.perf_counter() - t0) * 1e6)
+            silencio.seek(0)
+            silencio.truncate()
+
+        if preparar:
+            preparar()
+        tracemalloc.start()
+        antes = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        fn()
+        actual, pico = tracemalloc.get_traced_memory()
+        despues = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+    vivos = sum(d.count_diff for d in despues.compare_to(antes, "filename") if d.count_diff > 0)
+    tiempos.sort()
+    return {
+        "iteraciones": iteraciones,
+        "mediana_us":  round(statistics.median(tiempos), 1),
+        "p95_us":      round(tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))], 1),
+        "media_us":    round(statistics.fmean(tiempos), 1),
+        "pico_kb":     round((pico - base) / 1024, 1),
+        "retenido_kb": round((actual - base) / 1024, 1),
+        "bloques_vivos": vivos,
+    }
+
+
+def _etapas_caso(lf, caso: str, cache_dir: str, shopping: list, iteraciones: int) -> dict:
+    fixture  = _cargar_fixture(f"rekognition_{caso}.json")
+    genero   = fixture["genero"]
+    payload  = fixture["detect_labels"]
+    lf._rekognition().respuestas["detect_labels"] = lambda **_: copy.deepcopy(payload)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        vision    = lf._parse_rekognition(copy.deepcopy(payload))
+        deteccion = lf._detectar_prendas(vision, genero)
+    resultados_serp = {q: shopping for q in lf._queries_busqueda(deteccion)}
+    prendas = lf._armar_prendas(deteccion, resultados_serp)
+    cuerpo  = {"success": True, "genero": genero, "es_outfit": deteccion["es_outfit"], "prendas": prendas}
+
+    # Cada iteración del handler manda una imagen distinta para no pegarle
+    # al cache de visión por hash
+    contador = [0]
+
+    def evento():
+        contador[0] += 1
+        imagen = IMAGEN_JPEG + contador[0].to_bytes(8, "big")
+        return {"body": json.dumps({
+            "imagen_base64": lf.base64.b64encode(imagen).decode(),
+            "genero":        genero,
+        })}
+
+    eventos = {}
+
+    def preparar_frio():
+        _reiniciar_caches(lf, cache_dir)
+        eventos["frio"] = evento()
+
+    def preparar_caliente():
+        eventos["caliente"] = evento()
+
+    def handler(modo):
+        respuesta = lf.lambda_handler(eventos[modo], _ContextoStub())
+        assert respuesta["statusCode"] == 200, respuesta["body"][:200]
+
+    etapas = {
+        "parse_rekognition": _medir(lambda: lf._parse_rekognition(payload), iteraciones),
+        "detectar_prendas":  _medir(lambda: lf._detectar_prendas(vision, genero), iteraciones),
+        "armar_prendas":     _medir(lambda: lf._armar_prendas(deteccion, resultados_serp), iteraciones),
+        "response":          _medir(lambda: lf._response(200, cuerpo), iteraciones),
+        "handler_frio":      _medir(lambda: handler("frio"), max(1, iteraciones // 10), preparar_frio),
+    }
+    _reiniciar_caches(lf, cache_dir)
+    etapas["handler_caliente"] = _medir(lambda: handler("caliente"), max(1, iteraciones // 4), preparar_caliente)
+    return etapas
+
+
+def _etapas_micro(lf, iteraciones: int) -> dict:
+    rnd     = random.Random(18)
+    colores = [(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)) for _ in range(256)]
+    labels  = []
+    for caso in CASOS:
+        labels += [l["Name"] for l in _cargar_fixture(f"rekognition_{caso}.json")["detect_labels"]["Labels"]]
+
+    def colores_exactos():
+        for r, g, b in colores:
+            lf._rgb_to_color_name(r, g, b)
+
+    def clasificar_frio():
+        lf._clasificar_texto.cache_clear()
+        for nombre in labels:
+            lf._clasificar_texto(nombre)
+
+    return {
+        "rgb_to_color_name_x256": _medir(colores_exactos, iteraciones),
+        "clasificar_texto_frio":  _medir(clasificar_frio, iteraciones),
+    }
+
+
+def correr(casos, iteraciones: int) -> dict:
+    cache_dir = tempfile.mkdtemp(prefix="stylematch-bench-")
+    try:
+        lf       = _importar_lambda(cache_dir)
+        shopping_json = json.dumps(_cargar_fixture("serpapi_shopping.json"))
+        _preparar_stubs(lf, shopping_json)
+        shopping = json.loads(shopping_json)["shopping_results"]
+
+        resultados = {}
+        for caso in casos:
+            for etapa, m in _etapas_caso(lf, caso, cache_dir, shopping, iteraciones).items():
+                resultados[f"{caso}/{etapa}"] = m
+        for etapa, m in _etapas_micro(lf, iteraciones).items():
+            resultados[f"micro/{etapa}"] = m
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    return {
+        "python":      sys.version.split()[0],
+        "fecha":       time.strftime("%Y-%m-%d %H:%M:%S"),
+        "iteraciones": iteraciones,
+        "pico_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "etapas":      resultados,
+    }
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Reporte y baseline
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _delta(actual: float, base: float) -> float:
+    return (actual - base) / base * 100 if base else 0.0
+
+
+def reportar(resultado: dict, baseline: dict = None, umbral: float = 15.0) -> list:
+    """Imprime la tabla y retorna las etapas que empeoraron más que `umbral` %."""
+    base_etapas = (baseline or {}).get("etapas", {})
+    regresiones = []
+    ancho = max(len(n) for n in resultado["etapas"]) + 2
+    encabezado = f"{'etapa':<{ancho}}{'mediana µs':>12}{'p95 µs':>12}{'pico KB':>10}{'vivos':>8}"
+    if baseline:
+        encabezado += f"{'Δ mediana':>12}{'Δ pico':>10}"
+    print(encabezado)
+    print("─" * len(encabezado))
+
+    for nombre, m in resultado["etapas"].items():
+        fila = f"{nombre:<{ancho}}{m['mediana_us']:>12.1f}{m['p95_us']:>12.1f}{m['pico_kb']:>10.1f}{m['bloques_vivos']:>8}"
+        b = base_etapas.get(nombre)
+        if b:
+            dt = _delta(m["mediana_us"], b["mediana_us"])
+            dm = _delta(m["pico_kb"], b["pico_kb"])
+            marca = ""
+            if dt > umbral:
+                marca = "  ← más lento"
+                regresiones.append(nombre)
+            elif dt < -umbral:
+                marca = "  ← más rápido"
+            fila += f"{dt:>+11.1f}%{dm:>+9.1f}%{marca}"
+        elif baseline:
+            fila += f"{'nuevo':>12}"
+        print(fila)
+
+    print(f"\nPico RSS del proceso: {resultado['pico_rss_mb']} MB · Python {resultado['python']}")
+    if baseline:
+        print(f"Baseline: {baseline.get('fecha', '?')} · umbral ±{umbral:.0f}%")
+    return regresiones
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks offline del pipeline de StyleMatch")
+    parser.add_argument("--casos", nargs="+", choices=CASOS, default=list(CASOS))
+    parser.add_argument("--iteraciones", type=int, default=200)
+    parser.add_argument("--baseline", default=BASELINE, help="archivo JSON de la baseline")
+    parser.add_argument("--guardar", action="store_true", help="guarda este resultado como baseline")
+    parser.add_argument("--umbral", type=float, default=15.0, help="%% de empeoramiento tolerado en la mediana")
+    parser.add_argument("--estricto", action="store_true", help="exit 1 si hay regresiones")
+    args = parser.parse_args(argv)
+
+    resultado = correr(args.casos, args.iteraciones)
+
+    baseline = None
+    if not args.guardar and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    regresiones = reportar(resultado, baseline, args.umbral)
+
+    if args.guardar:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=1, ensure_ascii=False)
+        print(f"Baseline guardada en {args.baseline}")
+    if regresiones:
+        print(f"Regresiones: {', '.join(regresiones)}")
+        return 1 if args.estricto else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+StyleMatch — Empaquetado del Lambda optimizado para arranque en frío
+
+Pasos:
+
+  catalogos  Regenera en lambda_function.py la tabla RGB → color
+             precompilada (bloque "Precompilado por empaquetar.py"). Correr
+             después de tocar COLORES o _rgb_to_color_name; si se olvida, el
+             Lambda detecta la tabla vieja y la arma en runtime (~60 ms).
+  build      Arma backend/dist/ con lambda_function.py y su bytecode
+             (__pycache__, modo unchecked-hash) para que el cold start no
+             compile el módulo. Requiere el mismo Python que el runtime (3.11).
+  capa       Arma backend/capa/python/ con las dependencias opcionales que el
+             runtime no trae (CAPA_PAQUETES), en wheels binarios para el
+             runtime del Lambda: terraform las sube como layer. Es el único
+             paso que sale a la red (PyPI); no corre por defecto.
+
+Uso (desde backend/):
+    python empaquetar.py              # catalogos + build
+    python empaquetar.py catalogos
+    python empaquetar.py build
+    python empaquetar.py capa         # antes de terraform apply
+
+Con dist/ armado, `terraform apply -var lambda_precompilado=true` sube ese
+directorio en vez de lambda_function.py suelto. Sin capa/, terraform falla
+salvo con `-var capa_dependencias=false` (el Lambda funciona igual, sin
+normalizar HEIC/WebP ni imágenes grandes).
+"""
+
+import argparse
+import base64
+import os
+import py_compile
+import shutil
+import subprocess
+import sys
+import zlib
+
+AQUI    = os.path.dirname(os.path.abspath(__file__))
+FUENTE  = os.path.join(AQUI, "lambda_function.py")
+DIST    = os.path.join(AQUI, "dist")
+RUNTIME = (3, 11)   # runtime del Lambda en terraform/lambda.tf
+CAPA    = os.path.join(AQUI, "capa")
+PASOS   = ("catalogos", "build", "capa")
+
+# Opcionales de requirements.txt que el runtime no trae. manylinux2014
+# (glibc 2.17) corre en el Amazon Linux 2 del runtime python3.11; los
+# wheels más nuevos (manylinux_2_28) no.
+CAPA_PAQUETES   = ("Pillow>=10.0", "pillow-heif>=0.13", "numpy>=1.24")
+CAPA_PLATAFORMA = "manylinux2014_x86_64"
+CAPA_MARCA      = "paquetes.txt"   # terraform exige que exista antes de subir la layer
+
+INICIO_BLOQUE = "# ── Precompilado por empaquetar.py (no editar a mano) ──\n"
+FIN_BLOQUE    = "# ── fin precompilado ──\n"
+
+
+def precompilar_catalogos():
+    sys.path.insert(0, AQUI)
+    import lambda_function as lf
+
+    lut  = lf._construir_color_lut()
+    blob = base64.b64encode(zlib.compress(bytes(lut), 9)).decode("ascii")
+    lineas = [blob[i:i + 76] for i in range(0, len(blob), 76)]
+
+    bloque = (
+        INICIO_BLOQUE
+        + f"_COLOR_LUT_PRECOMPILADA_NOMBRES = {lf._COLOR_NOMBRES!r}\n"
+        + "_COLOR_LUT_PRECOMPILADA = (\n"
+        + "".join(f'    "{linea}"\n' for linea in lineas)
+        + ")\n"
+        + FIN_BLOQUE
+    )
+
+    with open(FUENTE, encoding="utf-8") as f:
+        texto = f.read()
+    inicio = texto.index(INICIO_BLOQUE)
+    fin    = texto.index(FIN_BLOQUE, inicio) + len(FIN_BLOQUE)
+    with open(FUENTE, "w", encoding="utf-8") as f:
+        f.write(texto[:inicio] + bloque + texto[fin:])
+    print(f"Tabla de colores: {len(lut)} celdas → {len(blob)} B en base64")
+
+
+def build():
+    if sys.version_info[:2] != RUNTIME:
+        sys.exit(
+            f"build necesita Python {RUNTIME[0]}.{RUNTIME[1]} (el del runtime); "
+            f"este es {sys.version_info[0]}.{sys.version_info[1]} y el Lambda ignoraría el bytecode"
+        )
+    shutil.rmtree(DIST, ignore_errors=True)
+    os.makedirs(DIST)
+    destino = os.path.join(DIST, "lambda_function.py")
+    shutil.copy2(FUENTE, destino)
+    # unchecked-hash: el import no compara mtime con la fuente (el zip no lo preserva)
+    pyc = py_compile.compile(
+        destino, doraise=True, optimize=0,
+        invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+    )
+    print(f"dist/ listo: {os.path.relpath(destino, AQUI)} + {os.path.relpath(pyc, AQUI)}")
+
+
+def capa():
+    shutil.rmtree(CAPA, ignore_errors=True)
+    destino = os.path.join(CAPA, "python")   # el runtime agrega /opt/python al sys.path
+    subprocess.run([
+        sys.executable, "-m", "pip", "install", "--quiet", "--target", destino,
+        "--platform", CAPA_PLATAFORMA, "--python-version", f"{RUNTIME[0]}.{RUNTIME[1]}",
+        "--only-binary=:all:", *CAPA_PAQUETES,
+    ], check=True)
+    # Lo que el Lambda nunca importa: scripts, tests y bytecode del host (los
+    # conftest.py además los recogería pytest corrido desde la raíz del repo)
+    shutil.rmtree(os.path.join(destino, "bin"), ignore_errors=True)
+    for raiz, dirs, archivos in os.walk(destino):
+        for d in [d for d in dirs if d in ("tests", "__pycache__")]:
+            shutil.rmtree(os.path.join(raiz, d))
+            dirs.remove(d)
+        if "conftest.py" in archivos:
+            os.remove(os.path.join(raiz, "conftest.py"))
+    with open(os.path.join(CAPA, CAPA_MARCA), "w", encoding="utf-8") as f:
+        f.write("\n".join(CAPA_PAQUETES) + "\n")
+    tamano = sum(os.path.getsize(os.path.join(r, a)) for r, _, archivos in os.walk(CAPA) for a in archivos)
+    print(f"capa/ lista: {', '.join(CAPA_PAQUETES)} ({tamano / 2**20:.0f} MB sin comprimir, máx 250 MB)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Empaquetado del Lambda de StyleMatch")
+    parser.add_argument("pasos", nargs="*", metavar="{catalogos,build,capa}",
+                        help="por defecto, catalogos y build")
+    pasos = parser.parse_args(argv).pasos or ["catalogos", "build"]
+    for paso in pasos:
+        if paso not in PASOS:
+            parser.error(f"paso desconocido: {paso}")
+    if "catalogos" in pasos:
+        precompilar_catalogos()
+    if "build" in pasos:
+        build()
+    if "capa" in pasos:
+        capa()
+
+
+if __name__ == "__main__":
+    main()
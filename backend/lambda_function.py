@@ -4,22 +4,396 @@ Analiza fotos de ropa con Rekognition (labels + colores dominantes) y
 construye queries ricas para Google Shopping global.
 """
 
+import time
+_T0_MODULO = time.perf_counter()   # para medir el init en frío (import + catálogos)
+
+# Solo stdlib liviana al importar: boto3, urllib.request y concurrent.futures
+# se importan en el primer uso (ver _cliente, _fetch_serpapi_remote, _pool)
 import json
-import boto3
 import base64
+import binascii
+import re
 import uuid
 import os
-import urllib.request
-import urllib.parse
-from datetime import datetime
-
-# Clients AWS
-s3_client          = boto3.client("s3")
-rekognition_client = boto3.client("rekognition")
+import hashlib
+import heapq
+import random
+import struct
+import threading
+import zlib
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache, wraps
 
 BUCKET_NAME = os.environ.get("S3_BUCKET_NAME", "")
 SERPAPI_KEY = os.environ.get("SERPAPI_KEY", "")
 
+# Búsquedas en paralelo: tamaño del pool y si la query de variante se lanza
+# junto a las demás (especulativa) o solo cuando faltan resultados. Por
+# defecto, solo cuando faltan: la especulativa es una llamada paga más por
+# request, que se desperdicia cada vez que principal + amplia ya alcanzan.
+SERPAPI_MAX_WORKERS      = int(os.environ.get("SERPAPI_MAX_WORKERS", "4"))
+SERPAPI_VARIANTE_PARALELA = os.environ.get("SERPAPI_VARIANTE_PARALELA", "0") == "1"
+
+# Conexiones HTTPS keep-alive a serpapi.com: como máximo una ociosa por worker;
+# las que pasan SERPAPI_CONEXION_IDLE segundos sin uso se descartan.
+SERPAPI_HOST          = "serpapi.com"
+SERPAPI_TIMEOUT       = 12
+SERPAPI_CONEXION_IDLE = float(os.environ.get("SERPAPI_CONEXION_IDLE", "30"))
+
+# Presupuesto de la etapa de búsqueda: lo que quede del timeout del Lambda
+# (o del de API Gateway, 29 s, si es menor) menos un margen para armar la
+# respuesta. Al vencer se responde con lo que haya, marcado "parcial".
+# Una query que tarda más que el percentil HEDGE_PERCENTIL de las últimas
+# latencias recibe un duplicado; gana el primero que responde.
+API_GATEWAY_TIMEOUT_MS = 29000
+BUSQUEDA_MARGEN_MS     = int(os.environ.get("BUSQUEDA_MARGEN_MS", "1500"))
+HEDGE_PERCENTIL        = float(os.environ.get("HEDGE_PERCENTIL", "90"))   # 0 desactiva el hedge
+HEDGE_INICIAL_MS       = int(os.environ.get("HEDGE_INICIAL_MS", "3000"))  # umbral hasta tener muestras
+HEDGE_MIN_MUESTRAS     = 20
+
+# Circuit breaker de SerpAPI: con CIRCUITO_MIN_LLAMADAS o más en la ventana
+# y una tasa de fallas (error o más lenta que CIRCUITO_LENTA_MS) de al menos
+# CIRCUITO_UMBRAL, se abre y las queries sin cache van directo al fallback.
+# Tras CIRCUITO_ABIERTO_S deja pasar una sonda: si responde bien se cierra.
+# CIRCUITO_COMPARTIDO ("s3" o "memoria") publica las aperturas para que los
+# demás contenedores no tengan que descubrir el incidente por su cuenta.
+CIRCUITO_UMBRAL       = float(os.environ.get("CIRCUITO_UMBRAL", "0.5"))
+CIRCUITO_MIN_LLAMADAS = int(os.environ.get("CIRCUITO_MIN_LLAMADAS", "8"))
+CIRCUITO_VENTANA_S    = float(os.environ.get("CIRCUITO_VENTANA_S", "60"))
+CIRCUITO_LENTA_MS     = float(os.environ.get("CIRCUITO_LENTA_MS", "8000"))
+CIRCUITO_ABIERTO_S    = float(os.environ.get("CIRCUITO_ABIERTO_S", "30"))
+CIRCUITO_COMPARTIDO   = os.environ.get("CIRCUITO_COMPARTIDO", "")
+CIRCUITO_SYNC_S       = 5   # cada cuánto se relee el estado compartido con el circuito cerrado
+
+# Cuota de SerpAPI: token bucket delante de las llamadas remotas (los hits de
+# cache no gastan). Se recarga a SERPAPI_CUOTA_POR_MIN tokens por minuto hasta
+# SERPAPI_CUOTA_RAFAGA (por defecto, un minuto de cuota); 0 lo desactiva. Con
+# el balance bajo ceden primero las queries menos valiosas: la variante
+# necesita que quede más de CUOTA_RESERVA["variante"] del bucket, la amplia
+# más de CUOTA_RESERVA["amplia"]; la principal pasa mientras haya un token.
+# Una query sin token se sirve del cache o cae al fallback. CUOTA_COMPARTIDA
+# ("s3" o "memoria") lleva el balance a un store común: cada contenedor
+# descuenta ahí lo que gastó cada CUOTA_SYNC_S y adopta el balance global.
+SERPAPI_CUOTA_POR_MIN = float(os.environ.get("SERPAPI_CUOTA_POR_MIN", "0"))
+SERPAPI_CUOTA_RAFAGA  = float(os.environ.get("SERPAPI_CUOTA_RAFAGA", "0")) or SERPAPI_CUOTA_POR_MIN
+CUOTA_RESERVA         = {"principal": 0.0, "amplia": 0.1, "variante": 0.4}
+_PRIORIDAD_ORDEN      = {"principal": 0, "amplia": 1, "variante": 2}
+CUOTA_COMPARTIDA      = os.environ.get("CUOTA_COMPARTIDA", "")
+CUOTA_SYNC_S          = 5
+
+# Cache de resultados SerpAPI: LRU en memoria → disco en /tmp → tier compartido
+# ("s3" usa el bucket bajo cache/, vacío lo desactiva).
+SERPAPI_CACHE_TTL      = int(os.environ.get("SERPAPI_CACHE_TTL", "21600"))   # 6 h
+SERPAPI_CACHE_MAX      = int(os.environ.get("SERPAPI_CACHE_MAX", "512"))     # entradas en memoria
+SERPAPI_CACHE_DISK_MAX = int(os.environ.get("SERPAPI_CACHE_DISK_MAX", "4096"))
+SERPAPI_CACHE_DIR      = os.environ.get("SERPAPI_CACHE_DIR", "/tmp/stylematch-cache")
+CACHE_SHARED_BACKEND   = os.environ.get("CACHE_SHARED_BACKEND", "")
+CACHE_SHARED_MAX_BYTES = int(os.environ.get("CACHE_SHARED_MAX_BYTES", "262144"))
+
+# Índice local de productos (SQLite en /tmp, full-text sobre los títulos):
+# cada prenda × color × género ya buscada se responde desde el índice sin
+# llamar a SerpAPI. Pasado INDICE_TTL se sigue sirviendo pero se refresca en
+# background; pasado INDICE_MAX_EDAD ya no se sirve. INDICE_S3_SYNC=1 baja el
+# índice del bucket al arrancar y sube una copia cada INDICE_SYNC_CADA combinaciones.
+INDICE_PRODUCTOS = os.environ.get("INDICE_PRODUCTOS", "1") == "1"
+INDICE_PATH      = os.environ.get("INDICE_PATH", "/tmp/stylematch-indice.db")
+INDICE_TTL       = int(os.environ.get("INDICE_TTL", "21600"))        # 6 h
+INDICE_MAX_EDAD  = int(os.environ.get("INDICE_MAX_EDAD", "604800"))  # 7 días
+INDICE_S3_SYNC   = os.environ.get("INDICE_S3_SYNC", "") == "1"
+INDICE_S3_KEY    = "indice/productos.db"
+INDICE_SYNC_CADA = 25
+INDICE_ITEMS_MAX = 60   # items guardados por combinación
+
+# Snapshot de precarga generado offline por precargar.py: queries frecuentes
+# de prenda × color × género ya resueltas, consultado como tier del cache de
+# SerpAPI (mmap, lookup O(1)). PRECARGA_S3=1 lo baja en background de
+# precarga/v{SNAPSHOT_FORMATO}.bin al primer uso; también sirve un archivo ya
+# presente en PRECARGA_PATH. Un snapshot más viejo que PRECARGA_MAX_EDAD se ignora.
+PRECARGA_S3       = os.environ.get("PRECARGA_S3", "") == "1"
+PRECARGA_PATH     = os.environ.get("PRECARGA_PATH", "/tmp/stylematch-precarga.bin")
+PRECARGA_MAX_EDAD = int(os.environ.get("PRECARGA_MAX_EDAD", "604800"))   # 7 días
+
+# Origen de la imagen para Rekognition: "bytes" la manda en el request y
+# archiva en S3 en paralelo; "s3" mantiene el flujo put_object → S3Object.
+REKOGNITION_IMAGE_SOURCE = os.environ.get("REKOGNITION_IMAGE_SOURCE", "bytes")
+REKOGNITION_MAX_BYTES    = 5 * 1024 * 1024   # límite de Image.Bytes en detect_labels
+REKOGNITION_MAX_S3_BYTES = 15 * 1024 * 1024  # límite de Image.S3Object
+
+# Ingesta: tope duro de tamaño y, por encima de NORMALIZAR_DESDE_BYTES (o si
+# el formato no es JPEG/PNG), reducción a IMAGEN_MAX_LADO y re-codificado JPEG
+MAX_IMAGE_BYTES        = int(os.environ.get("MAX_IMAGE_BYTES", str(15 * 1024 * 1024)))
+NORMALIZAR_DESDE_BYTES = int(os.environ.get("NORMALIZAR_DESDE_BYTES", str(1536 * 1024)))
+IMAGEN_MAX_LADO        = int(os.environ.get("IMAGEN_MAX_LADO", "1600"))
+IMAGEN_CALIDAD         = int(os.environ.get("IMAGEN_CALIDAD", "85"))
+IMAGEN_EXTENSIONES     = {"jpeg": "jpg", "png": "png"}   # formatos que Rekognition lee
+
+# Colores dominantes: con numpy y Pillow disponibles se calculan en el proceso
+# (k-means sobre una copia reducida) en paralelo con un detect_labels solo de
+# labels. Sin esas dependencias, o si el cálculo falla, los da IMAGE_PROPERTIES.
+COLORES_LOCALES      = os.environ.get("COLORES_LOCALES", "1") == "1"
+COLORES_LADO         = int(os.environ.get("COLORES_LADO", "96"))   # lado mayor de la copia analizada
+COLORES_K            = 5     # clusters de la imagen y del foreground
+COLORES_K_INSTANCIA  = 3     # clusters por bounding box (Rekognition da 3 por instancia)
+COLORES_ITERACIONES  = 8
+COLORES_FUSION       = 24    # distancia RGB bajo la cual dos centros son el mismo color
+COLORES_TIMEOUT_S    = 5
+
+# Casi-duplicados: dHash de 64 bits de cada imagen analizada, en un BK-tree
+# por género. Una foto nueva a distancia de Hamming ≤ PHASH_DISTANCIA de una
+# ya analizada (re-guardada, recomprimida, captura de pantalla) reutiliza su
+# visión sin llamar a Rekognition; 0 lo desactiva. Requiere Pillow.
+# PHASH_COMPARTIDO ("s3" o "memoria") persiste el índice junto a las
+# subidas (uploads/_phash/index.json) para todos los contenedores.
+PHASH_DISTANCIA    = int(os.environ.get("PHASH_DISTANCIA", "6"))
+PHASH_COMPARTIDO   = os.environ.get("PHASH_COMPARTIDO", "")
+PHASH_MAX_ENTRADAS = int(os.environ.get("PHASH_MAX_ENTRADAS", "5000"))
+PHASH_SYNC_S       = 60   # cada cuánto se relee el índice compartido
+
+# Lote (POST /analizar-lote): máximo de fotos y llamadas a Rekognition simultáneas
+LOTE_MAX_IMAGENES = int(os.environ.get("LOTE_MAX_IMAGENES", "20"))
+VISION_MAX_WORKERS = int(os.environ.get("VISION_MAX_WORKERS", "4"))
+
+# Concurrencia por upstream: llamadas simultáneas que admite cada uno. Es el
+# único lugar donde se fija; cada entrada es un pool (ver _pool) y el
+# pipeline asíncrono corre ahí las llamadas bloqueantes.
+_LIMITES = {
+    "vision":        VISION_MAX_WORKERS,    # decode/sniff en S3 y detect_labels de una imagen
+    "colores":       VISION_MAX_WORKERS,    # colores locales, en paralelo con detect_labels
+    "s3":            2,                     # archivo de imágenes en background
+    "serpapi":       SERPAPI_MAX_WORKERS,
+    "serpapi_hedge": SERPAPI_MAX_WORKERS,   # aparte: un duplicado no espera detrás del original
+    "indice":        1,                     # SQLite: un solo escritor
+}
+
+# Subida directa a S3 con URL prefirmada (POST /subir)
+UPLOAD_URL_TTL       = int(os.environ.get("UPLOAD_URL_TTL", "300"))
+UPLOAD_CONTENT_TYPES = {"image/jpeg": "jpg", "image/png": "png"}
+UPLOAD_KEY_RE        = re.compile(r"^uploads/(hombre|mujer)/directo/[0-9a-f]{32}\.(jpg|png)$")
+
+# Búsqueda progresiva (/analizar con "progresivo": true): el estado de cada
+# job vive en S3 bajo jobs/ y lo llena una invocación asíncrona del Lambda.
+LAMBDA_FUNCTION_NAME = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "")
+JOB_ID_RE            = re.compile(r"^[0-9a-f]{32}$")
+
+# Análisis por hash de imagen. Debe ser menor que la lifecycle de uploads/
+# (7 días) para que un hit implique que el objeto sigue en S3, y menor que
+# la de cache/ (terraform la deriva de var.vision_cache_ttl).
+VISION_CACHE_TTL       = int(os.environ.get("VISION_CACHE_TTL", "259200"))   # 3 días
+VISION_FORMATO         = 2
+
+# Clientes AWS, tabla de colores y matcher de labels se crean en el primer
+# uso. PRECALENTAR=1 los crea durante el init (útil con provisioned
+# concurrency, donde el init no está en el camino del request).
+PRECALENTAR = os.environ.get("PRECALENTAR", "") == "1"
+
+# Respuesta: el header X-Formato-Respuesta: compacto pide el formato compacto
+# (ver _compactar) y, si el cliente manda Accept-Encoding, los cuerpos desde
+# COMPRIMIR_DESDE_BYTES salen comprimidos (br si está el módulo brotli, si no gzip).
+COMPRIMIR_DESDE_BYTES = int(os.environ.get("COMPRIMIR_DESDE_BYTES", "1024"))
+GZIP_NIVEL            = 5   # casi el tamaño de 9 con una fracción del CPU
+
+# Observabilidad: nivel de log, fracción de requests que emiten las métricas
+# EMF (spans por etapa) y fracción que loguea en DEBUG aunque LOG_LEVEL no lo pida
+LOG_LEVEL           = os.environ.get("LOG_LEVEL", "INFO").upper()
+METRICS_SAMPLE_RATE = float(os.environ.get("METRICS_SAMPLE_RATE", "1"))
+DEBUG_SAMPLE_RATE   = float(os.environ.get("DEBUG_SAMPLE_RATE", "0"))
+METRICS_NAMESPACE   = os.environ.get("METRICS_NAMESPACE", "StyleMatch")
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Clientes AWS y pools — creados en el primer uso, reutilizados en warm
+# ─────────────────────────────────────────────────────────────────────────────
+
+_clientes      = {}
+_clientes_lock = threading.Lock()   # boto3 no crea clientes de forma thread-safe
+
+
+def _cliente(servicio: str):
+    cliente = _clientes.get(servicio)
+    if cliente is None:
+        with _clientes_lock:
+            cliente = _clientes.get(servicio)
+            if cliente is None:
+                import boto3   # ~100 ms de import: fuera del init si no se usa
+                cliente = _clientes[servicio] = boto3.client(servicio)
+    return cliente
+
+
+def _s3():
+    return _cliente("s3")
+
+
+def _rekognition():
+    return _cliente("rekognition")
+
+
+def _nuevo_pool(max_workers: int, prefijo: str):
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=prefijo)
+
+
+_pools      = {}
+_pools_lock = threading.Lock()
+
+
+def _pool(upstream: str):
+    """Pool del upstream con _LIMITES[upstream] workers — se reutiliza entre invocaciones warm."""
+    pool = _pools.get(upstream)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(upstream)
+            if pool is None:
+                pool = _pools[upstream] = _nuevo_pool(_LIMITES[upstream], upstream)
+    return pool
+
+
+async def _en_upstream(upstream: str, fn, *args):
+    """
+    Corre la llamada bloqueante fn(*args) en el pool del upstream sin frenar
+    el event loop. No usa asyncio.to_thread: su executor es por loop, sin
+    límite por upstream, y asyncio.run espera sus threads al cerrar.
+    """
+    import asyncio
+    return await asyncio.get_running_loop().run_in_executor(_pool(upstream), fn, *args)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Observabilidad — logs por nivel, spans por etapa y métricas EMF
+# ─────────────────────────────────────────────────────────────────────────────
+
+_LOG_NIVELES = {"DEBUG": 10, "INFO": 20, "WARN": 30, "ERROR": 40}
+_LOG_NIVEL   = _LOG_NIVELES.get(LOG_LEVEL, 20)
+_EMF_MAX_VALORES = 100   # límite de valores por métrica en un registro EMF
+
+
+class _Traza:
+    """Spans de una invocación: nombre → duraciones en ms (un span puede repetirse)."""
+
+    def __init__(self, operacion: str, request_id: str = ""):
+        self.operacion  = operacion
+        self.request_id = request_id
+        self.muestreada = random.random() < METRICS_SAMPLE_RATE
+        self.debug      = random.random() < DEBUG_SAMPLE_RATE
+        self.inicio     = time.perf_counter()
+        self.spans      = {}
+        self.contadores = {}
+        self.medidas    = {}
+        self._lock      = threading.Lock()   # los spans llegan también desde los pools
+
+    def registrar(self, nombre: str, ms: float):
+        with self._lock:
+            self.spans.setdefault(nombre, []).append(ms)
+
+    def contar(self, nombre: str, n: int = 1):
+        with self._lock:
+            self.contadores[nombre] = self.contadores.get(nombre, 0) + n
+
+    def medir(self, nombre: str, valor: float):
+        """Gauge: queda el último valor de la invocación."""
+        with self._lock:
+            self.medidas[nombre] = valor
+
+    def emf(self, status) -> dict:
+        """Registro en formato EMF: CloudWatch lo convierte en métricas sin llamadas a la API."""
+        registro = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace":  METRICS_NAMESPACE,
+                    "Dimensions": [["Operacion"]],
+                    "Metrics":    [{"Name": f"{n}_ms", "Unit": "Milliseconds"} for n in [*self.spans, "total"]]
+                                + [{"Name": n, "Unit": "Count"} for n in self.contadores]
+                                + [{"Name": n, "Unit": "None"} for n in self.medidas],
+                }],
+            },
+            "Operacion":  self.operacion,
+            "status":     status,
+            "request_id": self.request_id,
+            "total_ms":   round((time.perf_counter() - self.inicio) * 1000, 2),
+        }
+        with self._lock:
+            for nombre, valores in self.spans.items():
+                valores = [round(v, 2) for v in valores[:_EMF_MAX_VALORES]]
+                registro[f"{nombre}_ms"] = valores if len(valores) > 1 else valores[0]
+            registro.update(self.contadores)
+            registro.update(self.medidas)
+        return registro
+
+
+# Una invocación a la vez por contenedor: la traza en curso es global para
+# que los threads de los pools también registren sus spans en ella
+_traza = None
+
+
+_arranque_frio = True
+
+
+def _iniciar_traza(operacion: str, context) -> _Traza:
+    global _traza, _arranque_frio
+    _traza = _Traza(operacion, getattr(context, "aws_request_id", "") or "")
+    if _arranque_frio:
+        # Primera invocación del contenedor: el init del módulo va como span
+        _arranque_frio = False
+        _traza.registrar("init", _INIT_MS)
+    return _traza
+
+
+def _cerrar_traza(traza: _Traza, respuesta):
+    global _traza
+    if _traza is traza:
+        _traza = None
+    if traza.muestreada:
+        status = respuesta.get("statusCode") if isinstance(respuesta, dict) else None
+        print(json.dumps(traza.emf(status)))
+
+
+@contextmanager
+def _span(nombre: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        traza = _traza
+        if traza is not None:
+            traza.registrar(nombre, (time.perf_counter() - t0) * 1000)
+
+
+def _contar(nombre: str, n: int = 1):
+    traza = _traza
+    if traza is not None:
+        traza.contar(nombre, n)
+
+
+def _medir(nombre: str, valor: float):
+    traza = _traza
+    if traza is not None:
+        traza.medir(nombre, valor)
+
+
+def _trazado(nombre: str):
+    """Decorador: cada llamada a la función es un span."""
+    def decorador(fn):
+        @wraps(fn)
+        def envuelta(*args, **kwargs):
+            with _span(nombre):
+                return fn(*args, **kwargs)
+        return envuelta
+    return decorador
+
+
+def _log_activo(nivel: str) -> bool:
+    """Para proteger dumps costosos: si el nivel está apagado no se arma nada."""
+    traza = _traza
+    minimo = _LOG_NIVELES["DEBUG"] if traza is not None and traza.debug else _LOG_NIVEL
+    return _LOG_NIVELES[nivel] >= minimo
+
+
+def _log(nivel: str, mensaje: str, *args):
+    """Log con formato diferido (%s): los argumentos solo se formatean si el nivel está activo."""
+    if _log_activo(nivel):
+        print(f"[{nivel}] " + (mensaje % args if args else mensaje))
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Catálogos
 # ─────────────────────────────────────────────────────────────────────────────
@@ -256,527 +630,1484 @@ CUANDO_USAR = {
 # ─────────────────────────────────────────────────────────────────────────────
 
 def lambda_handler(event, context):
+    ruta = event.get("resource") or event.get("path") or ""
+    _negociar_respuesta(event)
+    if not _decodificar_body(event):
+        operacion, handler = "body_invalido", lambda: _response(400, {
+            "success": False, "error": "Body inválido: base64 o UTF-8 mal formado"})
+    # Invocación asíncrona interna (fase 2 de /analizar progresivo)
+    elif event.get("tarea") == "buscar_tiendas":
+        operacion, handler = "buscar_tiendas", lambda: _handle_job_busqueda(event, context)
+    elif "/resultados/" in ruta:
+        operacion, handler = "resultados", lambda: _handle_resultados(event)
+    elif ruta.endswith("/subir"):
+        operacion, handler = "subir", lambda: _handle_subir(event)
+    elif ruta.endswith("/analizar-lote"):
+        operacion, handler = "analizar_lote", lambda: _handle_analizar_lote(event, context)
+    else:
+        operacion, handler = "analizar", lambda: _handle_analizar(event, context)
+
+    traza     = _iniciar_traza(operacion, context)
+    respuesta = None
     try:
-        body          = json.loads(event.get("body", "{}"))
-        imagen_base64 = body.get("imagen_base64", "")
-        genero        = body.get("genero", "").lower()
+        respuesta = handler()
+        return respuesta
+    finally:
+        _cerrar_traza(traza, respuesta)
 
-        if not imagen_base64:
-            return _response(400, {"success": False, "error": "Falta imagen_base64"})
-        if genero not in ("hombre", "mujer"):
-            return _response(400, {"success": False, "error": "genero debe ser 'hombre' o 'mujer'"})
 
-        # ── PASO 1: Subir imagen a S3 ──────────────────────────────────────
-        if "," in imagen_base64:
-            imagen_base64 = imagen_base64.split(",", 1)[1]
-        image_bytes = base64.b64decode(imagen_base64)
-        timestamp   = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename    = f"{uuid.uuid4().hex}_{timestamp}.jpg"
-        s3_key      = f"uploads/{genero}/{filename}"
+def _handle_subir(event):
+    """
+    POST /subir — entrega una URL prefirmada para que el cliente suba la foto
+    directo a S3 (bytes crudos, sin base64) y luego llame a /analizar con la key.
+    """
+    try:
+        body         = json.loads(event.get("body") or "{}")
+        genero       = body.get("genero", "").lower()
+        content_type = body.get("content_type", "image/jpeg").lower()
 
-        s3_client.put_object(
-            Bucket=BUCKET_NAME, Key=s3_key,
-            Body=image_bytes, ContentType="image/jpeg",
-        )
+        if genero not in ("hombre", "mujer"):
+            return _response(400, {"success": False, "error": "genero debe ser 'hombre' o 'mujer'"})
+        if content_type not in UPLOAD_CONTENT_TYPES:
+            return _response(400, {"success": False, "error": "content_type debe ser image/jpeg o image/png"})
 
-        # ── PASO 2: Rekognition — labels + colores dominantes ────────────
-        reko_labels = rekognition_client.detect_labels(
-            Image={"S3Object": {"Bucket": BUCKET_NAME, "Name": s3_key}},
-            MaxLabels=40,
-            MinConfidence=50,
-            Features=["GENERAL_LABELS", "IMAGE_PROPERTIES"],
+        s3_key = f"uploads/{genero}/directo/{uuid.uuid4().hex}.{UPLOAD_CONTENT_TYPES[content_type]}"
+        upload_url = _s3().generate_presigned_url(
+            "put_object",
+            Params={"Bucket": BUCKET_NAME, "Key": s3_key, "ContentType": content_type},
+            ExpiresIn=UPLOAD_URL_TTL,
         )
-        labels = reko_labels.get("Labels", [])
-        # Debug: mostrar colores de instancias con RGB
-        for lbl in labels:
-            if lbl.get("Instances"):
-                info = []
-                for inst in lbl["Instances"]:
-                    for ic in inst.get("DominantColors", [])[:2]:
-                        css = ic.get("CSSColor","?")
-                        rgb = (ic.get("Red",0), ic.get("Green",0), ic.get("Blue",0))
-                        info.append(f"{css}{rgb}")
-                if info:
-                    print(f"[DEBUG] {lbl['Name']} → {info}")
-
-        # ── PASO 3: Extraer colores dominantes de ImageProperties ────────
-        dom_colors_list = []
-        dom_colors = reko_labels.get("ImageProperties", {}).get("DominantColors", [])
-        for dc in dom_colors[:8]:
-            css  = dc.get("CSSColor", "").lower().strip()
-            simp = dc.get("SimplifiedColor", "").lower().strip()
-            pct  = dc.get("PixelPercent", 0)
-            r, g, b = dc.get("Red", 0), dc.get("Green", 0), dc.get("Blue", 0)
-            mapped = COLOR_CSS_MAP.get(css) or COLOR_CSS_MAP.get(simp)
-            if not mapped and (r or g or b):
-                mapped = _rgb_to_color_name(r, g, b)
-            if mapped and mapped in COLORES:
-                if not dom_colors_list or dom_colors_list[-1]["en"] != mapped:
-                    dom_colors_list.append({
-                        "en": mapped, "es": COLORES[mapped], "confianza": round(pct, 1),
-                    })
-        color_from_image = dom_colors_list[0] if dom_colors_list else None
-
-        # Foreground colors — más específicos para ropa que la imagen completa
-        fg_colors_list = []
-        fg_dom = reko_labels.get("ImageProperties", {}).get("Foreground", {}).get("DominantColors", [])
-        for dc in fg_dom[:8]:
-            css  = dc.get("CSSColor", "").lower().strip()
-            simp = dc.get("SimplifiedColor", "").lower().strip()
-            pct  = dc.get("PixelPercent", 0)
-            r, g, b = dc.get("Red", 0), dc.get("Green", 0), dc.get("Blue", 0)
-            mapped = COLOR_CSS_MAP.get(css) or COLOR_CSS_MAP.get(simp)
-            if not mapped and (r or g or b):
-                mapped = _rgb_to_color_name(r, g, b)
-            if mapped and mapped in COLORES:
-                if not fg_colors_list or fg_colors_list[-1]["en"] != mapped:
-                    fg_colors_list.append({"en": mapped, "es": COLORES[mapped], "confianza": round(pct, 1)})
-
-        if fg_colors_list:
-            print(f"[DEBUG] Foreground colors: {[(c['en'], c['confianza']) for c in fg_colors_list[:4]]}")
-
-        # Preferir foreground si tiene datos, sino usar lista global
-        best_colors_list = fg_colors_list if fg_colors_list else dom_colors_list
-        color_from_image = best_colors_list[0] if best_colors_list else color_from_image
-
-        # ── PASO 4: Procesar labels ───────────────────────────────────────
-        prendas_dict = PRENDAS_HOMBRE if genero == "hombre" else PRENDAS_MUJER
-
-        prendas_por_categoria = {}   # categoria → mejor prenda en esa categoría
-        color_label           = None    # color detectado vía labels
-        estilo_detectado  = None
-        descriptores      = []
-        etiquetas_detalle = []
-        all_label_names   = []
-        patrones_detectados = []
-
-        for label in labels:
-            nombre    = label["Name"]
-            confianza = label["Confidence"]
-
-            if nombre in LABELS_IGNORAR:
-                continue
-
-            etiquetas_detalle.append({"nombre": nombre, "confianza": round(confianza, 1)})
-            all_label_names.append(nombre)
-
-            # Prenda — track por categoría, con color específico de la instancia detectada
-            if nombre in prendas_dict:
-                cat = CATEGORIA_PRENDA.get(nombre, "other")
-                prev = prendas_por_categoria.get(cat)
-                prenda_color_hint = None
-
-                # 1. DominantColors de la instancia del label (color del objeto específico)
-                for instance in label.get("Instances", []):
-                    for ic in instance.get("DominantColors", [])[:3]:
-                        css  = ic.get("CSSColor", "").lower().strip()
-                        simp = ic.get("SimplifiedColor", "").lower().strip()
-                        ir, ig, ib = ic.get("Red", 0), ic.get("Green", 0), ic.get("Blue", 0)
-                        mapped = COLOR_CSS_MAP.get(css) or COLOR_CSS_MAP.get(simp)
-                        if not mapped and (ir or ig or ib):
-                            mapped = _rgb_to_color_name(ir, ig, ib)
-                        if mapped and mapped in COLORES:
-                            prenda_color_hint = {"en": mapped, "es": COLORES[mapped], "confianza": ic.get("PixelPercent", 0)}
-                            break
-                    if prenda_color_hint:
-                        break
+        return _response(200, {
+            "success":    True,
+            "upload_url": upload_url,
+            "s3_key":     s3_key,
+            "headers":    {"Content-Type": content_type},
+            "expira_en":  UPLOAD_URL_TTL,
+        })
 
-                # 2. Color en el nombre del label (ej: "Blue Denim Jeans")
-                if not prenda_color_hint:
-                    label_text = nombre.lower()
-                    for alias in label.get("Aliases", []):
-                        label_text += " " + alias.get("Name", "").lower()
-                    for color_en, color_es in COLORES.items():
-                        if color_en.lower() in label_text:
-                            prenda_color_hint = {"en": color_en, "es": color_es, "confianza": confianza}
-                            break
-
-                # 3. Color en Parents del label
-                if not prenda_color_hint:
-                    for parent in label.get("Parents", []):
-                        pn = parent.get("Name", "")
-                        if pn in COLORES:
-                            prenda_color_hint = {"en": pn, "es": COLORES[pn], "confianza": confianza * 0.8}
-                            break
-
-                if prev is None or confianza > prev["confianza"]:
-                    prendas_por_categoria[cat] = {
-                        "en": nombre, "es": prendas_dict[nombre],
-                        "confianza": confianza, "color": prenda_color_hint,
-                    }
-
-            # Color vía label
-            if nombre in COLORES:
-                if color_label is None or confianza > color_label["confianza"]:
-                    color_label = {"en": nombre, "es": COLORES[nombre], "confianza": confianza}
-            else:
-                # Buscar color dentro de nombre compuesto
-                for color_en, color_es in COLORES.items():
-                    if color_en.lower() in nombre.lower():
-                        if color_label is None:
-                            color_label = {"en": color_en, "es": color_es, "confianza": confianza * 0.85}
-                        break
-                # Color en Parents
-                if color_label is None:
-                    for parent in label.get("Parents", []):
-                        pn = parent.get("Name", "")
-                        if pn in COLORES:
-                            color_label = {"en": pn, "es": COLORES[pn], "confianza": confianza * 0.8}
-                            break
-
-            # Estilo
-            if nombre in ESTILOS:
-                if estilo_detectado is None or confianza > estilo_detectado["confianza"]:
-                    estilo_detectado = {"en": nombre, "es": ESTILOS[nombre], "confianza": confianza}
-            else:
-                for est_en, est_es in ESTILOS.items():
-                    if est_en.lower() in nombre.lower():
-                        if estilo_detectado is None:
-                            estilo_detectado = {"en": est_en, "es": est_es, "confianza": confianza * 0.85}
-                        break
+    except Exception as e:
+        _log("ERROR", "%s", e)
+        return _response(500, {"success": False, "error": f"Error interno: {str(e)}"})
 
-            # Descriptores
-            if nombre in DESCRIPTORES_UTILES and nombre not in descriptores:
-                descriptores.append(nombre)
-            for desc in DESCRIPTORES_UTILES:
-                if desc.lower() in nombre.lower() and desc not in descriptores:
-                    descriptores.append(desc)
 
-            # Patrón de la prenda
-            if nombre in PATRONES and nombre not in [pt["en"] for pt in patrones_detectados]:
-                patrones_detectados.append({"en": nombre, "es": PATRONES[nombre], "confianza": confianza})
-            else:
-                for pat_en, pat_es in PATRONES.items():
-                    if pat_en.lower() in nombre.lower() and pat_en not in [pt["en"] for pt in patrones_detectados]:
-                        patrones_detectados.append({"en": pat_en, "es": pat_es, "confianza": confianza * 0.85})
-                        break
+def _handle_analizar(event, context):
+    try:
+        body          = json.loads(event.get("body", "{}"))
+        imagen_base64 = body.get("imagen_base64", "")
+        s3_key_subida = body.get("s3_key", "")
+        genero        = body.get("genero", "").lower()
 
-        patrones_detectados.sort(key=lambda x: x["confianza"], reverse=True)
+        if not imagen_base64 and not s3_key_subida:
+            return _response(400, {"success": False, "error": "Falta imagen_base64 o s3_key"})
+        if genero not in ("hombre", "mujer"):
+            return _response(400, {"success": False, "error": "genero debe ser 'hombre' o 'mujer'"})
 
-        # Resolución de color: preferimos color real de imagen, luego label
-        color_detectado = color_from_image or color_label
+        # ── PASOS 1-6b: pipeline asíncrono ───────────────────────────────
+        # Decode y hash → Rekognition (archivo en S3 en paralelo) → colores,
+        # labels y queries → búsqueda por prenda. En modo progresivo la
+        # búsqueda la hace el job.
+        import asyncio
+        progresivo = bool(body.get("progresivo")) and bool(SERPAPI_KEY)
+        deadline   = _deadline_busqueda(context)
+        salida = asyncio.run(_pipeline(
+            [None], lambda _: _preparar_imagen(genero, imagen_base64, s3_key_subida),
+            deadline, buscar=bool(SERPAPI_KEY) and not progresivo,
+        ))
+        if isinstance(salida.detecciones[0], Exception):
+            raise salida.detecciones[0]
+        deteccion, info_imagen = salida.detecciones[0]
+        resultados_serp = salida.resultados if SERPAPI_KEY else {}
 
-        # Resolver lista de prendas candidatas
-        prendas_candidatas = sorted(
-            prendas_por_categoria.values(),
-            key=lambda x: x["confianza"], reverse=True
-        )
-        prendas_candidatas = [p for p in prendas_candidatas if p["confianza"] >= 55][:3]
-
-        # Si alguna categoría "full" (vestido, traje), no dividir
-        if any(CATEGORIA_PRENDA.get(p["en"]) == "full" for p in prendas_candidatas):
-            prendas_candidatas = prendas_candidatas[:1]
-
-        # Fallback si no se detectó ninguna
-        if not prendas_candidatas:
-            prenda_fallback = None
-            for lname in all_label_names:
-                for prenda_en, prenda_es in prendas_dict.items():
-                    if prenda_en.lower() in lname.lower():
-                        prenda_fallback = {"en": prenda_en, "es": prenda_es, "confianza": 55}
-                        break
-                if prenda_fallback:
-                    break
-            if prenda_fallback is None:
-                prenda_fallback = {"en": "Clothing", "es": "Prenda", "confianza": 0}
-            prendas_candidatas = [prenda_fallback]
-
-        es_outfit = len(prendas_candidatas) >= 2
-        prenda_detectada = prendas_candidatas[0]  # backward compat para queries
-
-        if color_detectado is None:
-            color_detectado = {"en": "", "es": "No detectado", "confianza": 0}
-        if estilo_detectado is None:
-            estilo_detectado = {"en": "Casual", "es": "Casual", "confianza": 0}
-
-        estilo_es = estilo_detectado["es"]
-
-        # ── PASO 5: Query inteligente ─────────────────────────────────────
-        query_principal = _build_smart_query(
-            prenda_en   = prenda_detectada["en"],
-            color_en    = color_detectado["en"],
-            estilo_en   = estilo_detectado["en"],
-            descriptores= descriptores,
-            genero      = genero,
-        )
-        # Query alternativa más amplia (segunda búsqueda siempre)
-        query_amplia = _build_broad_query(
-            prenda_en = prenda_detectada["en"],
-            color_en  = color_detectado["en"],
-            genero    = genero,
-        )
-        # Query de variante por estilo (tercer nivel, solo si pocas tiendas)
-        query_variante = _build_style_query(
-            prenda_en = prenda_detectada["en"],
-            estilo_en = estilo_detectado["en"],
-            genero    = genero,
-        )
+        # Modo progresivo: se responde ya con las prendas y un job_id; las
+        # tiendas las llena una invocación asíncrona y se leen en /resultados
+        if progresivo:
+            job_id = _iniciar_job_busqueda(deteccion)
+            if job_id:
+                resultado = {
+                    "success":   True,
+                    "genero":    genero,
+                    "es_outfit": deteccion["es_outfit"],
+                    "prendas":   [_prenda_resultado(deteccion, plan, None) for plan in deteccion["planes"]],
+                    "job_id":    job_id,
+                    "estado":    "buscando",
+                }
+                if info_imagen:
+                    resultado["imagen"] = info_imagen
+                return _response(200, resultado)
+            # Sin job: búsqueda en línea, con el tiempo que le queda al request
+            resultados_serp = _buscar_tiendas([deteccion], deadline)
 
-        print(f"[INFO] Query principal : {query_principal}")
-        print(f"[INFO] Query amplia    : {query_amplia}")
-        print(f"[INFO] Query variante  : {query_variante}")
-
-        # ── PASO 6: Búsqueda por cada prenda ─────────────────────────────
-        prendas_resultado = []
-        for idx_p, prenda in enumerate(prendas_candidatas):
-            # Color específico por prenda:
-            # 1. Color extraído del nombre del label (más fiable)
-            # 2. Color dominante por índice (cada prenda usa un color distinto)
-            # 3. Color global detectado (fallback)
-            color_prenda = prenda.get("color")
-            if not color_prenda and idx_p < len(best_colors_list):
-                color_prenda = best_colors_list[idx_p]
-            if not color_prenda:
-                color_prenda = color_detectado
-            if not color_prenda:
-                color_prenda = {"en": "", "es": "No detectado", "confianza": 0}
-
-            print(f"[INFO] Prenda {idx_p+1}: {prenda['en']} → color: {color_prenda['en']}")
-
-            if es_outfit:
-                q = _build_broad_query(prenda["en"], color_prenda["en"], genero)
-                tiendas_prenda = _buscar_serpapi_simple(q, prenda["es"])
-            else:
-                tiendas_prenda = _buscar_serpapi_doble(
-                    query_principal, query_amplia, prenda["es"], query_variante
-                )
-            patron = patrones_detectados[0] if patrones_detectados else None
-            prendas_resultado.append({
-                "tipo_es":            prenda["es"],
-                "tipo_en":            prenda["en"],
-                "color":              color_prenda["es"],
-                "color_en":           color_prenda["en"],
-                "patron":             patron["es"] if patron else None,
-                "patron_en":          patron["en"] if patron else None,
-                "estilo":             estilo_es,
-                "material_estimado":  _estimar_material(prenda["en"]),
-                "confianza":          round(prenda["confianza"], 1),
-                "cuando_usar":        CUANDO_USAR.get(estilo_es, CUANDO_USAR["Casual"]),
-                "ocasion":            OCASIONES.get(estilo_es, OCASIONES["Casual"]),
-                "tallas_disponibles": ["XS", "S", "M", "L", "XL", "XXL"],
-                "precio_min":         _rango_precio(prenda["en"])["min"],
-                "precio_max":         _rango_precio(prenda["en"])["max"],
-                "etiquetas":          etiquetas_detalle[:12],
-                "descriptores":       descriptores[:8],
-                "query_busqueda":     _build_broad_query(prenda["en"], color_prenda["en"], genero) if es_outfit else query_principal,
-                "tiendas":            tiendas_prenda,
-            })
+        prendas_resultado = _armar_prendas(deteccion, resultados_serp)
 
         # ── PASO 7: Respuesta ─────────────────────────────────────────────
         resultado = {
             "success":   True,
             "genero":    genero,
-            "es_outfit": es_outfit,
+            "es_outfit": deteccion["es_outfit"],
             "prendas":   prendas_resultado,
         }
+        if info_imagen:
+            resultado["imagen"] = info_imagen
+        if any(p.get("parcial") for p in prendas_resultado):
+            resultado["parcial"] = True
+
+        if SERPAPI_KEY:
+            _log("INFO", "Cache SerpAPI: %s", _get_serp_cache().stats())
+            if _serpapi_http is not None:
+                _log("INFO", "Conexiones SerpAPI: %s", _serpapi_http.stats)
+            if _circuito_serpapi is not None and _circuito_serpapi.stats["aperturas"]:
+                _log("INFO", "Circuito SerpAPI: %s %s", _circuito_serpapi.estado, _circuito_serpapi.stats)
 
         return _response(200, resultado)
 
+    except ImagenInvalida as e:
+        return _response(e.status, {"success": False, "error": str(e)})
     except Exception as e:
-        print(f"[ERROR] {str(e)}")
+        _log("ERROR", "%s", e)
         import traceback
         traceback.print_exc()
         return _response(500, {"success": False, "error": f"Error interno: {str(e)}"})
 
 
-# ─────────────────────────────────────────────────────────────────────────────
-# Construcción de queries
-# ─────────────────────────────────────────────────────────────────────────────
-
-def _build_smart_query(prenda_en, color_en, estilo_en, descriptores, genero):
+def _handle_analizar_lote(event, context):
     """
-    Query específica con todos los atributos detectados.
-    Ej: "oversized black striped cotton hoodie streetwear men shop"
+    POST /analizar-lote — N fotos por request para ingestión de catálogos.
+    Corre el mismo pipeline que /analizar: visión en paralelo acotado,
+    queries idénticas del lote pedidas una sola vez, resultado por imagen.
+    Con el pipeline solapado, "vision" en tiempos_ms es hasta la última
+    detección y "busqueda" el resto del pipeline.
     """
-    parts = []
-
-    # Fit/corte primero si está en descriptores (ej: oversized, slim, cropped)
-    FIT_TERMS = {"Slim", "Oversized", "Cropped", "Fitted", "Baggy", "Relaxed",
-                 "Skinny", "Wide Leg", "Tapered"}
-    for desc in descriptores:
-        if desc in FIT_TERMS:
-            parts.append(desc.lower())
+    try:
+        t0       = time.perf_counter()
+        body     = json.loads(event.get("body", "{}"))
+        genero   = body.get("genero", "").lower()
+        imagenes = body.get("imagenes")
 
-    # Color
-    if color_en:
-        parts.append(color_en.lower())
+        if not isinstance(imagenes, list) or not imagenes:
+            return _response(400, {"success": False, "error": "Falta la lista imagenes"})
+        if len(imagenes) > LOTE_MAX_IMAGENES:
+            return _response(400, {"success": False, "error": f"Máximo {LOTE_MAX_IMAGENES} imágenes por lote"})
 
-    # Patrón / material si está (ej: striped, denim, floral)
-    PATTERN_MATERIAL = {"Denim","Leather","Silk","Cotton","Wool","Linen","Velvet",
-                        "Plaid","Striped","Floral","Polka Dot","Checkered",
-                        "Graphic","Print","Tie Dye","Distressed","Ripped",
-                        "Embroidered","Lace"}
-    for desc in descriptores:
-        if desc in PATTERN_MATERIAL and desc.lower() not in " ".join(parts):
-            parts.append(desc.lower())
+        # Pipeline por imagen: preparar (decode/hash o sniff en S3), visión
+        # una vez por hash y búsqueda en cuanto la imagen tiene su detección;
+        # cada query única del lote se pide una sola vez
+        def preparar(item):
+            if not isinstance(item, dict):
+                raise ImagenInvalida(400, "Cada imagen debe ser un objeto con s3_key o imagen_base64")
+            g = (item.get("genero") or genero).lower()
+            if g not in ("hombre", "mujer"):
+                raise ImagenInvalida(400, "genero debe ser 'hombre' o 'mujer'")
+            if not item.get("imagen_base64") and not item.get("s3_key"):
+                raise ImagenInvalida(400, "Falta imagen_base64 o s3_key")
+            return _preparar_imagen(g, item.get("imagen_base64", ""), item.get("s3_key", ""))
 
-    # Prenda principal
-    if prenda_en and prenda_en != "Clothing":
-        parts.append(prenda_en.lower())
+        import asyncio
+        salida = asyncio.run(_pipeline(imagenes, preparar, _deadline_busqueda(context), buscar=bool(SERPAPI_KEY)))
+        detecciones     = salida.detecciones
+        resultados_serp = salida.resultados if SERPAPI_KEY else {}
+        t_vision   = salida.fin_vision
+        t_busqueda = time.perf_counter()
 
-    # Estilo (solo si aporta especificidad)
-    if estilo_en and estilo_en not in ("Casual", "Unknown", ""):
-        parts.append(estilo_en.lower())
+        resultados = []
+        for d in detecciones:
+            if isinstance(d, Exception):
+                status = d.status if isinstance(d, ImagenInvalida) else 500
+                _log("WARN", "Lote: imagen rechazada (%s): %s", status, d)
+                resultados.append({"success": False, "status": status, "error": str(d)})
+                continue
+            deteccion, info_imagen = d
+            item = {
+                "success":   True,
+                "genero":    deteccion["genero"],
+                "es_outfit": deteccion["es_outfit"],
+                "prendas":   _armar_prendas(deteccion, resultados_serp),
+            }
+            if info_imagen:
+                item["imagen"] = info_imagen
+            if any(p.get("parcial") for p in item["prendas"]):
+                item["parcial"] = True
+            resultados.append(item)
+        t_fin = time.perf_counter()
 
-    # Detalles extra (cuello, manga, etc.) — máx 1
-    DETAIL_TERMS = {"Long Sleeve","Short Sleeve","Sleeveless","V-Neck",
-                    "Crew Neck","Turtleneck","Hood","High Waist"}
-    for desc in descriptores:
-        if desc in DETAIL_TERMS:
-            parts.append(desc.lower())
-            break
+        # Contadas al final: incluyen las variantes que pidió el merge
+        pendientes = getattr(resultados_serp, "pendientes", ())
 
-    # Género
-    parts.append("men" if genero == "hombre" else "women")
+        return _response(200, {
+            "success":         True,
+            "total":           len(resultados),
+            "exitosas":        sum(1 for r in resultados if r["success"]),
+            "queries_totales": getattr(resultados_serp, "pedidas", 0),
+            "queries_unicas":  len(resultados_serp) + len(pendientes),
+            "tiempos_ms": {
+                "vision":   round((t_vision - t0) * 1000, 1),
+                "busqueda": round((t_busqueda - t_vision) * 1000, 1),
+                "armado":   round((t_fin - t_busqueda) * 1000, 1),
+                "total":    round((t_fin - t0) * 1000, 1),
+            },
+            "resultados":      resultados,
+        })
 
-    # Intención de compra
-    parts.append("shop")
+    except Exception as e:
+        _log("ERROR", "%s", e)
+        import traceback
+        traceback.print_exc()
+        return _response(500, {"success": False, "error": f"Error interno: {str(e)}"})
 
-    return " ".join(parts)
 
+# ─────────────────────────────────────────────────────────────────────────────
+# Pipeline de análisis — etapas compartidas por /analizar y /analizar-lote
+# ─────────────────────────────────────────────────────────────────────────────
 
-def _build_broad_query(prenda_en, color_en, genero):
+def _preparar_imagen(genero: str, imagen_base64: str = "", s3_key_subida: str = "") -> dict:
     """
-    Query más amplia como segunda búsqueda.
-    Ej: "black hoodie men online"
+    Paso 1: decodifica el base64 (o baja la subida directa) y calcula el
+    sha256 del contenido. Lanza ImagenInvalida si se rechaza.
     """
-    parts = []
-    if color_en:
-        parts.append(color_en.lower())
-    if prenda_en and prenda_en != "Clothing":
-        parts.append(prenda_en.lower())
-    parts.append("men" if genero == "hombre" else "women")
-    parts.append("online")
-    return " ".join(parts)
+    if s3_key_subida:
+        # La foto ya está en S3 (subida con URL prefirmada): se baja en un
+        # solo GET y se hashea igual que el base64, así la misma foto cae en
+        # la misma entrada del cache de visión por cualquiera de los dos
+        # caminos. El tamaño sale de los headers y el formato (el
+        # Content-Type de la subida lo elige el cliente) de los primeros
+        # bytes, antes de leer el resto.
+        if not UPLOAD_KEY_RE.match(s3_key_subida) or not s3_key_subida.startswith(f"uploads/{genero}/"):
+            raise ImagenInvalida(400, "s3_key inválida")
+        with _span("s3_get"):
+            try:
+                obj = _s3().get_object(Bucket=BUCKET_NAME, Key=s3_key_subida)
+            except Exception:
+                raise ImagenInvalida(404, "La imagen no fue subida o expiró")
+            cuerpo = obj["Body"]
+            try:
+                if obj.get("ContentLength", 0) > REKOGNITION_MAX_S3_BYTES:
+                    raise ImagenInvalida(413, "Imagen demasiado grande (máx 15 MB)")
+                cabecera = cuerpo.read(SNIFF_BYTES)
+                if _sniff_formato(cabecera) is None:
+                    raise ImagenInvalida(415, "Formato de imagen no reconocido (JPEG, PNG, WebP o HEIC)")
+                image_bytes = cabecera + cuerpo.read()
+            finally:
+                cuerpo.close()
+        return {
+            "genero":      genero,
+            "image_bytes": image_bytes,
+            "image_hash":  hashlib.sha256(image_bytes).hexdigest(),
+            "s3_key":      s3_key_subida,
+        }
 
+    if "," in imagen_base64:
+        imagen_base64 = imagen_base64.split(",", 1)[1]
+    # Rechazo temprano: el tamaño decodificado se estima sin decodificar
+    if len(imagen_base64) * 3 // 4 > MAX_IMAGE_BYTES:
+        raise ImagenInvalida(413, f"Imagen demasiado grande (máx {MAX_IMAGE_BYTES // (1024 * 1024)} MB)")
+    with _span("decode"):
+        image_bytes = base64.b64decode(imagen_base64)
+        image_hash  = hashlib.sha256(image_bytes).hexdigest()
+    return {
+        "genero":      genero,
+        "image_bytes": image_bytes,
+        "image_hash":  image_hash,
+        "s3_key":      None,   # la extensión depende del formato normalizado
+    }
 
-def _build_style_query(prenda_en, estilo_en, genero):
+
+def _obtener_vision(prep: dict):
     """
-    Query por estilo/prenda pura sin color — tercer nivel de variedad.
-    Ej: "streetwear hoodie men buy"
+    Paso 2: labels de Rekognition y colores (locales o de Rekognition), o
+    todo del cache por hash (o de una foto casi idéntica, por dHash).
+    Retorna (vision, info_imagen).
     """
-    parts = []
-    if estilo_en and estilo_en not in ("Casual", "Unknown", ""):
-        parts.append(estilo_en.lower())
-    if prenda_en and prenda_en != "Clothing":
-        parts.append(prenda_en.lower())
-    parts.append("men" if genero == "hombre" else "women")
-    parts.append("buy")
-    return " ".join(parts)
-
+    genero      = prep["genero"]
+    image_bytes = prep["image_bytes"]
+    image_hash  = prep["image_hash"]
+    s3_key      = prep["s3_key"]
+    info_imagen = None
 
-# ─────────────────────────────────────────────────────────────────────────────
-# SerpAPI — doble búsqueda
-# ─────────────────────────────────────────────────────────────────────────────
+    # Una foto ya analizada (mismo hash) reutiliza labels y colores:
+    # no se vuelve a subir ni a llamar a Rekognition.
+    vision_cache = _get_vision_cache()
+    vision       = vision_cache.get(_vision_key(image_hash))
+    if vision is not None:
+        _log("INFO", "Imagen repetida %s — se omite S3 y Rekognition", image_hash[:12])
+    else:
+        # Ingesta: formato real por magic bytes, tope de tamaño y
+        # re-codificado a JPEG acotado antes de S3 y Rekognition
+        originales = image_bytes
+        image_bytes, formato, info_imagen = _normalizar_imagen(image_bytes)
+        # Modo "bytes": Rekognition recibe la imagen directo y el archivo
+        # en S3 se escribe en paralelo, fuera del camino crítico.
+        # Rekognition solo acepta Bytes hasta 5 MB; más grande va por S3.
+        por_bytes = REKOGNITION_IMAGE_SOURCE == "bytes" and len(image_bytes) <= REKOGNITION_MAX_BYTES
+        if s3_key is not None and (por_bytes or image_bytes is originales):
+            # Subida directa: ya es el archivo, y si no hubo que re-codificarla
+            # Rekognition la lee de ahí
+            imagen_reko = ({"Bytes": image_bytes} if por_bytes
+                           else {"S3Object": {"Bucket": BUCKET_NAME, "Name": s3_key}})
+        else:
+            s3_key       = f"uploads/{genero}/{image_hash}.{IMAGEN_EXTENSIONES[formato]}"
+            content_type = f"image/{formato}"
+            if por_bytes:
+                _archivar_imagen_async(s3_key, image_bytes, content_type)
+                imagen_reko = {"Bytes": image_bytes}
+            else:
+                _archivar_imagen(s3_key, image_bytes, content_type)
+                imagen_reko = {"S3Object": {"Bucket": BUCKET_NAME, "Name": s3_key}}
+        # Casi-duplicado de una foto ya analizada: su visión, sin Rekognition
+        dhash = None
+        if _phash_activo():
+            with _span("phash"):
+                dhash = _dhash(image_bytes)
+                if dhash is not None:
+                    vision = _vision_similar(dhash, genero, vision_cache)
+        if vision is None:
+            # Colores locales en paralelo con la llamada a Rekognition
+            colores = _colores_locales_async(image_bytes, s3_key) if _colores_locales_disponibles() else None
+            reko_labels = _detect_labels(imagen_reko, solo_labels=colores is not None)
+            if colores is not None:
+                reko_labels = _combinar_colores_locales(reko_labels, colores, imagen_reko)
+            vision = _parse_rekognition(reko_labels)
+            if dhash is not None:
+                _get_indice_phash().agregar(dhash, genero, image_hash)
+        vision_cache.set(_vision_key(image_hash), vision)
 
-def _score_tienda(t: dict) -> float:
-    """Score de calidad para ordenar tiendas: imagen > precio > rating > reviews."""
-    score = 0.0
-    if t.get("imagen"):                      score += 5.0
-    if t.get("precio", 0) > 0:              score += 3.0
-    if t.get("rating"):                      score += float(t["rating"]) * 1.5
-    if t.get("reviews"):                     score += min(float(t["reviews"]) / 100, 3.0)
-    return score
+    return vision, info_imagen
 
 
-def _buscar_serpapi_doble(query_principal: str, query_amplia: str, prenda_es: str,
-                          query_variante: str = "") -> list:
+@_trazado("labels")
+def _detectar_prendas(vision: dict, genero: str) -> dict:
     """
-    Hace hasta 3 búsquedas en Google Shopping:
-    1. Query específica (siempre)
-    2. Query amplia (siempre)
-    3. Query de estilo/variante (solo si < 12 resultados únicos tras 1+2)
-    Aplica cap de 3 productos por fuente, ordena por calidad y retorna hasta 18.
+    Pasos 3-5: colores, clasificación de labels, prendas candidatas y
+    queries. Retorna el plan de búsqueda por prenda listo para la etapa 6.
     """
-    if not SERPAPI_KEY:
-        return _tiendas_fallback(prenda_es)
+    # ── PASO 3: Colores dominantes ya parseados ──────────────────────
+    labels          = vision["labels"]
+    dom_colors_list = vision["colores"]
+    fg_colors_list  = vision["colores_foreground"]
+    color_from_image = dom_colors_list[0] if dom_colors_list else None
 
-    # Siempre ejecutar ambas queries
-    resultados_principal = _fetch_serpapi(query_principal)
-    resultados_amplia    = _fetch_serpapi(query_amplia)
+    if fg_colors_list and _log_activo("DEBUG"):
+        _log("DEBUG", "Foreground colors: %s", [(c['en'], c['confianza']) for c in fg_colors_list[:4]])
 
-    # Combinar con cap de 3 por fuente y deduplicar
-    vistos        = set()
-    tiendas       = []
-    conteo_fuente = {}
+    # Preferir foreground si tiene datos, sino usar lista global
+    best_colors_list = fg_colors_list if fg_colors_list else dom_colors_list
+    color_from_image = best_colors_list[0] if best_colors_list else color_from_image
 
-    for item in resultados_principal + resultados_amplia:
-        fuente = item.get("source", "")
-        if conteo_fuente.get(fuente, 0) >= 3:
-            continue
-        conteo_fuente[fuente] = conteo_fuente.get(fuente, 0) + 1
-        key = f"{fuente}-{item.get('title','')[:40]}"
-        if key not in vistos:
-            vistos.add(key)
-            tiendas.append(_item_to_tienda(item))
+    # ── PASO 4: Procesar labels ───────────────────────────────────────
+    prendas_dict = PRENDAS_HOMBRE if genero == "hombre" else PRENDAS_MUJER
 
-    # Tercera query de variante si hay pocas opciones diversas
-    if len(tiendas) < 12 and query_variante:
-        resultados_variante = _fetch_serpapi(query_variante)
-        for item in resultados_variante:
-            fuente = item.get("source", "")
-            if conteo_fuente.get(fuente, 0) >= 3:
-                continue
-            conteo_fuente[fuente] = conteo_fuente.get(fuente, 0) + 1
-            key = f"{fuente}-{item.get('title','')[:40]}"
-            if key not in vistos:
-                vistos.add(key)
-                tiendas.append(_item_to_tienda(item))
+    prendas_por_categoria = {}   # categoria → mejor prenda en esa categoría
+    color_label           = None    # color detectado vía labels
+    estilo_detectado  = None
+    descriptores      = []
+    etiquetas_detalle = []
+    all_label_names   = []
+    patrones_detectados = []
+    patrones_vistos     = set()
 
-    if not tiendas:
-        return _tiendas_fallback(prenda_es)
+    for label in labels:
+        nombre    = label["Name"]
+        confianza = label["Confidence"]
 
-    # Ordenar por calidad y retornar los mejores 18
-    tiendas.sort(key=_score_tienda, reverse=True)
-    return tiendas[:18]
+        if nombre in LABELS_IGNORAR:
+            continue
 
+        etiquetas_detalle.append({"nombre": nombre, "confianza": round(confianza, 1)})
+        all_label_names.append(nombre)
+        hits = _clasificar_texto(nombre)   # una pasada por todos los catálogos
 
-def _buscar_serpapi_simple(query: str, prenda_es: str) -> list:
-    """Un solo fetch para outfit mode — source-capped, quality-sorted."""
-    if not SERPAPI_KEY:
-        return _tiendas_fallback(prenda_es)
-    resultados = _fetch_serpapi(query)
-    vistos, tiendas, conteo_fuente = set(), [], {}
-    for item in resultados:
-        fuente = item.get("source", "")
-        if conteo_fuente.get(fuente, 0) >= 3:
-            continue
-        conteo_fuente[fuente] = conteo_fuente.get(fuente, 0) + 1
-        key = f"{fuente}-{item.get('title','')[:40]}"
-        if key not in vistos:
-            vistos.add(key)
-            tiendas.append(_item_to_tienda(item))
-    if not tiendas:
-        return _tiendas_fallback(prenda_es)
-    tiendas.sort(key=_score_tienda, reverse=True)
-    return tiendas[:18]
+        # Prenda — track por categoría, con color específico de la instancia detectada
+        if nombre in prendas_dict:
+            cat = CATEGORIA_PRENDA.get(nombre, "other")
+            prev = prendas_por_categoria.get(cat)
+            prenda_color_hint = None
 
+            # 1. DominantColors de la instancia del label (color del objeto específico)
+            color_inst = label.get("ColorInstancia")
+            if color_inst:
+                prenda_color_hint = {"en": color_inst[0], "es": COLORES[color_inst[0]], "confianza": color_inst[1]}
 
-def _rgb_to_color_name(r: int, g: int, b: int) -> str:
-    """Clasifica valores RGB al color más cercano en nuestro catálogo."""
-    lum   = r * 0.299 + g * 0.587 + b * 0.114
-    max_c = max(r, g, b)
-    min_c = min(r, g, b)
-    delta = max_c - min_c
-    sat   = delta / max_c if max_c > 0 else 0
+            # 2. Color en el nombre del label (ej: "Blue Denim Jeans")
+            if not prenda_color_hint:
+                label_text = nombre
+                for alias in label.get("Aliases", []):
+                    label_text += " " + alias.get("Name", "")
+                colores_texto = _clasificar_texto(label_text).colores
+                if colores_texto:
+                    color_en = colores_texto[0]
+                    prenda_color_hint = {"en": color_en, "es": COLORES[color_en], "confianza": confianza}
 
-    # Acromático (poco saturado)
-    if sat < 0.12 or delta < 20:
-        if lum < 45:   return "Black"
-        if lum < 90:   return "Charcoal"
-        if lum < 175:  return "Gray"
-        return "White"
+            # 3. Color en Parents del label
+            if not prenda_color_hint:
+                for parent in label.get("Parents", []):
+                    pn = parent.get("Name", "")
+                    if pn in COLORES:
+                        prenda_color_hint = {"en": pn, "es": COLORES[pn], "confianza": confianza * 0.8}
+                        break
 
-    # Calcular tono
-    if max_c == r:
-        hue = 60 * ((g - b) / delta % 6)
-    elif max_c == g:
-        hue = 60 * ((b - r) / delta + 2)
-    else:
-        hue = 60 * ((r - g) / delta + 4)
-    hue = hue % 360
+            if prev is None or confianza > prev["confianza"]:
+                prendas_por_categoria[cat] = {
+                    "en": nombre, "es": prendas_dict[nombre],
+                    "confianza": confianza, "color": prenda_color_hint,
+                }
 
-    if hue < 20 or hue >= 340:           # Rojo
+        # Color vía label
+        if nombre in COLORES:
+            if color_label is None or confianza > color_label["confianza"]:
+                color_label = {"en": nombre, "es": COLORES[nombre], "confianza": confianza}
+        else:
+            # Buscar color dentro de nombre compuesto
+            if hits.colores and color_label is None:
+                color_en = hits.colores[0]
+                color_label = {"en": color_en, "es": COLORES[color_en], "confianza": confianza * 0.85}
+            # Color en Parents
+            if color_label is None:
+                for parent in label.get("Parents", []):
+                    pn = parent.get("Name", "")
+                    if pn in COLORES:
+                        color_label = {"en": pn, "es": COLORES[pn], "confianza": confianza * 0.8}
+                        break
+
+        # Estilo
+        if nombre in ESTILOS:
+            if estilo_detectado is None or confianza > estilo_detectado["confianza"]:
+                estilo_detectado = {"en": nombre, "es": ESTILOS[nombre], "confianza": confianza}
+        elif hits.estilos and estilo_detectado is None:
+            est_en = hits.estilos[0]
+            estilo_detectado = {"en": est_en, "es": ESTILOS[est_en], "confianza": confianza * 0.85}
+
+        # Descriptores (el match exacto aparece primero: posición 0, más largo)
+        for desc in hits.descriptores:
+            if desc not in descriptores:
+                descriptores.append(desc)
+
+        # Patrón de la prenda
+        if nombre in PATRONES and nombre not in patrones_vistos:
+            patrones_detectados.append({"en": nombre, "es": PATRONES[nombre], "confianza": confianza})
+            patrones_vistos.add(nombre)
+        else:
+            for pat_en in hits.patrones:
+                if pat_en not in patrones_vistos:
+                    patrones_detectados.append({"en": pat_en, "es": PATRONES[pat_en], "confianza": confianza * 0.85})
+                    patrones_vistos.add(pat_en)
+                    break
+
+    patrones_detectados.sort(key=lambda x: x["confianza"], reverse=True)
+
+    # Resolución de color: preferimos color real de imagen, luego label
+    color_detectado = color_from_image or color_label
+
+    # Resolver lista de prendas candidatas
+    prendas_candidatas = sorted(
+        prendas_por_categoria.values(),
+        key=lambda x: x["confianza"], reverse=True
+    )
+    prendas_candidatas = [p for p in prendas_candidatas if p["confianza"] >= 55][:3]
+
+    # Si alguna categoría "full" (vestido, traje), no dividir
+    if any(CATEGORIA_PRENDA.get(p["en"]) == "full" for p in prendas_candidatas):
+        prendas_candidatas = prendas_candidatas[:1]
+
+    # Fallback si no se detectó ninguna
+    if not prendas_candidatas:
+        prenda_fallback = None
+        rango = _RANGO_PRENDA[genero]
+        for lname in all_label_names:
+            en_dict = [p for p in _clasificar_texto(lname).prendas if p in rango]
+            if en_dict:
+                prenda_en = min(en_dict, key=rango.get)
+                prenda_fallback = {"en": prenda_en, "es": prendas_dict[prenda_en], "confianza": 55}
+                break
+        if prenda_fallback is None:
+            prenda_fallback = {"en": "Clothing", "es": "Prenda", "confianza": 0}
+        prendas_candidatas = [prenda_fallback]
+
+    es_outfit = len(prendas_candidatas) >= 2
+    prenda_detectada = prendas_candidatas[0]  # backward compat para queries
+
+    if color_detectado is None:
+        color_detectado = {"en": "", "es": "No detectado", "confianza": 0}
+    if estilo_detectado is None:
+        estilo_detectado = {"en": "Casual", "es": "Casual", "confianza": 0}
+
+    estilo_es = estilo_detectado["es"]
+
+    # ── PASO 5: Query inteligente ─────────────────────────────────────
+    query_principal = _build_smart_query(
+        prenda_en   = prenda_detectada["en"],
+        color_en    = color_detectado["en"],
+        estilo_en   = estilo_detectado["en"],
+        descriptores= descriptores,
+        genero      = genero,
+    )
+    # Query alternativa más amplia (segunda búsqueda siempre)
+    query_amplia = _build_broad_query(
+        prenda_en = prenda_detectada["en"],
+        color_en  = color_detectado["en"],
+        genero    = genero,
+    )
+    # Query de variante por estilo (tercer nivel, solo si pocas tiendas)
+    query_variante = _build_style_query(
+        prenda_en = prenda_detectada["en"],
+        estilo_en = estilo_detectado["en"],
+        genero    = genero,
+    )
+
+    _log("INFO", "Query principal : %s", query_principal)
+    _log("INFO", "Query amplia    : %s", query_amplia)
+    _log("INFO", "Query variante  : %s", query_variante)
+
+    # ── PASO 6: Búsqueda por cada prenda ─────────────────────────────
+    # 6a. Resolver color y query de cada prenda antes de buscar
+    planes = []
+    for idx_p, prenda in enumerate(prendas_candidatas):
+        # Color específico por prenda:
+        # 1. Color extraído del nombre del label (más fiable)
+        # 2. Color dominante por índice (cada prenda usa un color distinto)
+        # 3. Color global detectado (fallback)
+        color_prenda = prenda.get("color")
+        if not color_prenda and idx_p < len(best_colors_list):
+            color_prenda = best_colors_list[idx_p]
+        if not color_prenda:
+            color_prenda = color_detectado
+        if not color_prenda:
+            color_prenda = {"en": "", "es": "No detectado", "confianza": 0}
+
+        _log("INFO", "Prenda %s: %s → color: %s", idx_p+1, prenda['en'], color_prenda['en'])
+
+        if es_outfit:
+            queries = [_build_broad_query(prenda["en"], color_prenda["en"], genero)]
+        else:
+            queries = [query_principal, query_amplia]
+            if SERPAPI_VARIANTE_PARALELA:
+                queries.append(query_variante)
+        planes.append((prenda, color_prenda, queries))
+
+    return {
+        "es_outfit":       es_outfit,
+        "planes":          planes,
+        "patron":          patrones_detectados[0] if patrones_detectados else None,
+        "estilo_es":       estilo_es,
+        "etiquetas":       etiquetas_detalle[:12],
+        "descriptores":    descriptores[:8],
+        "query_principal": query_principal,
+        "query_amplia":    query_amplia,
+        "query_variante":  query_variante,
+        "genero":          genero,
+    }
+
+
+def _queries_busqueda(deteccion: dict) -> list:
+    return [q for _, _, queries in deteccion["planes"] for q in queries]
+
+
+def _prioridades(deteccion: dict) -> dict:
+    """
+    Query → prioridad de cuota. En outfit cada prenda tiene una sola query,
+    que es la principal de esa prenda. Si dos coinciden, gana la más alta.
+    """
+    if deteccion["es_outfit"]:
+        return {}
+    return {
+        deteccion["query_variante"]:  "variante",
+        deteccion["query_amplia"]:    "amplia",
+        deteccion["query_principal"]: "principal",
+    }
+
+
+def _queries_plan(deteccion: dict, plan) -> list:
+    """Todas las queries que puede consumir la prenda, incluida la variante perezosa."""
+    queries = list(plan[2])
+    if not deteccion["es_outfit"] and deteccion["query_variante"] not in queries:
+        queries.append(deteccion["query_variante"])
+    return queries
+
+
+def _buscar_tiendas(detecciones: list, deadline: float = None) -> "_ResultadosBusqueda":
+    """Paso 6a-b fuera del pipeline, para detecciones ya hechas (progresivo sin job)."""
+    import asyncio
+
+    resultados = _ResultadosBusqueda(deadline)
+    en_vuelo   = {}
+
+    async def todas():
+        await asyncio.gather(*(_buscar_deteccion(d, resultados, en_vuelo) for d in detecciones))
+
+    asyncio.run(todas())
+    return resultados
+
+
+async def _buscar_deteccion(deteccion: dict, resultados: "_ResultadosBusqueda", en_vuelo: dict):
+    """
+    Paso 6a-b de una detección: las prendas ya conocidas salen del índice
+    local, el resto de las queries va a SerpAPI en paralelo (la variante
+    cuando principal + amplia traen pocas tiendas) y lo que vuelve
+    completo se indexa en background.
+    """
+    # SQLite (y en frío la descarga del índice) fuera del event loop
+    desde_indice = await _en_upstream("indice", _planes_desde_indice, deteccion, resultados)
+    planes      = [plan for i, plan in enumerate(deteccion["planes"]) if i not in desde_indice]
+    prioridades = _prioridades(deteccion)
+    with _span("busqueda"):
+        await _buscar_queries([q for plan in planes for q in plan[2]], resultados, en_vuelo, prioridades)
+        # Variante perezosa: si hace falta se pide acá, junto con el resto
+        # del lote, y no después con un asyncio.run por prenda al armar
+        if any(_falta_variante(deteccion, plan, resultados) for plan in planes):
+            await _buscar_queries([deteccion["query_variante"]], resultados, en_vuelo, prioridades)
+    for plan in planes:
+        _indexar_plan_async(deteccion, plan, resultados)
+
+
+_SalidaPipeline = namedtuple("_SalidaPipeline", "detecciones resultados fin_vision")
+
+
+async def _pipeline(entradas: list, preparar, deadline: float = None, buscar: bool = True) -> _SalidaPipeline:
+    """
+    Pasos 1-6b como tareas por imagen: preparar → visión → detección →
+    búsqueda. Cada imagen sale a buscar apenas tiene su detección, sin
+    esperar al resto del lote; la visión se pide una vez por hash y las
+    queries repetidas comparten tarea. Lo que no terminó al vencer el
+    deadline se cancela: la búsqueda queda parcial y una visión pendiente
+    es un 504 de esa imagen.
+
+    `detecciones[i]` es (deteccion, info_imagen) o la excepción de la
+    imagen i; `fin_vision` el perf_counter de la última detección.
+    """
+    import asyncio
+
+    resultados = _ResultadosBusqueda(deadline)
+    en_vuelo   = {}
+    visiones   = {}   # image_hash → tarea
+    fin_vision = time.perf_counter()
+
+    async def imagen(entrada):
+        nonlocal fin_vision
+        prep  = await _en_upstream("vision", preparar, entrada)
+        tarea = visiones.get(prep["image_hash"])
+        if tarea is None:
+            tarea = visiones[prep["image_hash"]] = asyncio.ensure_future(
+                _en_upstream("vision", _obtener_vision, prep))
+        if deadline is not None:
+            await asyncio.wait({tarea}, timeout=max(deadline - time.monotonic(), 0))
+            if not tarea.done():
+                tarea.cancel()   # si no arrancó, no llega a Rekognition
+                raise ImagenInvalida(504, "Tiempo agotado analizando la imagen")
+            if tarea.cancelled():
+                raise ImagenInvalida(504, "Tiempo agotado analizando la imagen")
+        vision, info_imagen = await tarea
+        deteccion  = _detectar_prendas(vision, prep["genero"])
+        fin_vision = max(fin_vision, time.perf_counter())
+        if buscar:
+            await _buscar_deteccion(deteccion, resultados, en_vuelo)
+        return deteccion, info_imagen
+
+    detecciones = await asyncio.gather(*(imagen(e) for e in entradas), return_exceptions=True)
+    return _SalidaPipeline(detecciones, resultados, fin_vision)
+
+
+@_trazado("merge")
+def _armar_prendas(deteccion: dict, resultados_serp: dict) -> list:
+    """Paso 6c: merge determinista en el orden original de prendas y queries."""
+    return [
+        _prenda_resultado(deteccion, plan, _tiendas_plan(deteccion, plan, resultados_serp),
+                          _plan_parcial(deteccion, plan, resultados_serp))
+        for plan in deteccion["planes"]
+    ]
+
+
+def _plan_parcial(deteccion: dict, plan, resultados_serp: dict) -> bool:
+    """True si alguna query de la prenda venció el deadline sin respuesta."""
+    pendientes = getattr(resultados_serp, "pendientes", None)
+    if not pendientes or _items_indice(deteccion, plan, resultados_serp) is not None:
+        return False
+    queries = set(plan[2])
+    if not deteccion["es_outfit"]:
+        queries.add(deteccion["query_variante"])
+    return not queries.isdisjoint(pendientes)
+
+
+def _tiendas_plan(deteccion: dict, plan, resultados_serp: dict) -> list:
+    prenda, _, queries = plan
+    items = _items_indice(deteccion, plan, resultados_serp)
+    if items is not None:
+        return _buscar_serpapi_simple(queries[0], prenda["es"], {queries[0]: items})
+    if deteccion["es_outfit"]:
+        return _buscar_serpapi_simple(queries[0], prenda["es"], resultados_serp)
+    return _buscar_serpapi_doble(
+        deteccion["query_principal"], deteccion["query_amplia"], prenda["es"],
+        deteccion["query_variante"], resultados_serp,
+    )
+
+
+def _prenda_resultado(deteccion: dict, plan, tiendas, parcial: bool = False) -> dict:
+    """
+    Ficha de una prenda. `tiendas` es None mientras la búsqueda sigue en
+    curso; `parcial` marca que alguna query no respondió antes del deadline.
+    """
+    prenda, color_prenda, queries = plan
+    patron    = deteccion["patron"]
+    estilo_es = deteccion["estilo_es"]
+    ficha = {
+        "tipo_es":            prenda["es"],
+        "tipo_en":            prenda["en"],
+        "color":              color_prenda["es"],
+        "color_en":           color_prenda["en"],
+        "patron":             patron["es"] if patron else None,
+        "patron_en":          patron["en"] if patron else None,
+        "estilo":             estilo_es,
+        "material_estimado":  _estimar_material(prenda["en"]),
+        "confianza":          round(prenda["confianza"], 1),
+        "cuando_usar":        CUANDO_USAR.get(estilo_es, CUANDO_USAR["Casual"]),
+        "ocasion":            OCASIONES.get(estilo_es, OCASIONES["Casual"]),
+        "tallas_disponibles": ["XS", "S", "M", "L", "XL", "XXL"],
+        "precio_min":         _rango_precio(prenda["en"])["min"],
+        "precio_max":         _rango_precio(prenda["en"])["max"],
+        "etiquetas":          deteccion["etiquetas"],
+        "descriptores":       deteccion["descriptores"],
+        "query_busqueda":     queries[0],
+        "tiendas":            tiendas,
+    }
+    if parcial:
+        ficha["parcial"] = True
+    return ficha
+
+
+def _job_key(job_id: str) -> str:
+    return f"jobs/{job_id}.json"
+
+
+def _guardar_job(job_id: str, estado: str, tiendas: list, parciales: set = frozenset()):
+    """
+    `tiendas[i]` son las tiendas de la prenda i, o None si sigue pendiente;
+    `parciales` los índices cuyas búsquedas vencieron el deadline.
+    """
+    prendas = [{"tiendas": t, "parcial": True} if i in parciales else {"tiendas": t}
+               for i, t in enumerate(tiendas)]
+    _s3().put_object(
+        Bucket=BUCKET_NAME,
+        Key=_job_key(job_id),
+        Body=json.dumps({
+            "job_id":  job_id,
+            "estado":  estado,
+            "prendas": prendas,
+        }, ensure_ascii=False).encode("utf-8"),
+        ContentType="application/json",
+        CacheControl="no-store",
+    )
+
+
+def _iniciar_job_busqueda(deteccion: dict):
+    """
+    Registra el job en S3 y lanza la fase de búsqueda como invocación
+    asíncrona de este mismo Lambda. Retorna el job_id, o None si no se pudo
+    (el caller entonces busca en línea como siempre).
+    """
+    if not LAMBDA_FUNCTION_NAME:
+        return None
+    job_id = uuid.uuid4().hex
+    try:
+        _guardar_job(job_id, "buscando", [None] * len(deteccion["planes"]))
+        _cliente("lambda").invoke(
+            FunctionName=LAMBDA_FUNCTION_NAME,
+            InvocationType="Event",
+            Payload=json.dumps({"tarea": "buscar_tiendas", "job_id": job_id, "deteccion": deteccion}).encode("utf-8"),
+        )
+    except Exception as e:
+        _log("WARN", "No se pudo iniciar la búsqueda progresiva: %s", e)
+        return None
+    _log("INFO", "Job de búsqueda %s iniciado", job_id)
+    return job_id
+
+
+def _handle_job_busqueda(event, context=None):
+    """
+    Fase 2: corre las queries del job y publica en S3 las tiendas de cada
+    prenda en cuanto terminan todas sus queries, sin esperar a las demás.
+    Si el Lambda se queda sin tiempo, las prendas que faltan se publican
+    con lo que haya, marcadas como parciales.
+    """
+    job_id    = event["job_id"]
+    deteccion = event["deteccion"]
+    planes    = deteccion["planes"]
+    tiendas   = [None] * len(planes)
+    parciales = set()
+    faltan    = {i: set(q for q in queries if q) for i, (_, _, queries) in enumerate(planes)}
+    # Invocación asíncrona: el límite es el del Lambda, no el de API Gateway
+    restante_ms = context.get_remaining_time_in_millis() if context is not None else API_GATEWAY_TIMEOUT_MS
+    deadline    = time.monotonic() + max(restante_ms - BUSQUEDA_MARGEN_MS, 0) / 1000
+    resultados_serp = _ResultadosBusqueda(deadline)
+
+    import asyncio
+
+    def publicar_listas():
+        # Lista = sus queries volvieron y el merge no va a salir a buscar la
+        # variante: _tiendas_plan no puede hacer fetch dentro del loop
+        listas = [i for i, qs in faltan.items()
+                  if qs.issubset(resultados_serp) and not _falta_variante(deteccion, planes[i], resultados_serp)]
+        for i in listas:
+            del faltan[i]
+            tiendas[i] = _tiendas_plan(deteccion, planes[i], resultados_serp)
+        if listas and faltan:
+            _guardar_job(job_id, "buscando", tiendas)
+
+    async def buscar():
+        # Una tarea por prenda: cada una publica en cuanto vuelven sus
+        # queries; las compartidas entre prendas se piden una sola vez
+        en_vuelo    = {}
+        prioridades = _prioridades(deteccion)
+
+        async def prenda(i):
+            await _buscar_queries(planes[i][2], resultados_serp, en_vuelo, prioridades)
+            if _falta_variante(deteccion, planes[i], resultados_serp):
+                await _buscar_queries([deteccion["query_variante"]], resultados_serp, en_vuelo, prioridades)
+            publicar_listas()
+
+        await asyncio.gather(*(prenda(i) for i in list(faltan)))
+
+    try:
+        # Prendas ya conocidas: directo del índice, antes de salir a SerpAPI
+        desde_indice = _planes_desde_indice(deteccion, resultados_serp)
+        for i in desde_indice:
+            del faltan[i]
+            tiendas[i] = _tiendas_plan(deteccion, planes[i], resultados_serp)
+        if desde_indice and faltan:
+            _guardar_job(job_id, "buscando", tiendas)
+        asyncio.run(buscar())
+        if resultados_serp.pendientes:
+            _log("WARN", "Job %s: deadline con %s queries pendientes", job_id, len(resultados_serp.pendientes))
+        # Prendas vencidas (o sin queries) se publican con lo que haya
+        for i in faltan:
+            tiendas[i] = _tiendas_plan(deteccion, planes[i], resultados_serp)
+            if _plan_parcial(deteccion, planes[i], resultados_serp):
+                parciales.add(i)
+        _guardar_job(job_id, "listo", tiendas, parciales)
+        for i, plan in enumerate(planes):
+            if i not in desde_indice:
+                _indexar_plan_async(deteccion, plan, resultados_serp)
+    except Exception as e:
+        _log("ERROR", "Job %s: %s", job_id, e)
+        _guardar_job(job_id, "error", [t if t is not None else [] for t in tiendas], parciales)
+
+    _log("INFO", "Cache SerpAPI: %s", _get_serp_cache().stats())
+    return {"job_id": job_id}
+
+
+def _handle_resultados(event):
+    """GET /resultados/{job_id} — estado del job y tiendas ya resueltas por prenda."""
+    job_id = (event.get("pathParameters") or {}).get("job_id") \
+        or (event.get("path") or "").rstrip("/").rsplit("/", 1)[-1]
+    if not JOB_ID_RE.match(job_id or ""):
+        return _response(400, {"success": False, "error": "job_id inválido"})
+    try:
+        obj = _s3().get_object(Bucket=BUCKET_NAME, Key=_job_key(job_id))
+    except Exception:
+        return _response(404, {"success": False, "error": "Job no encontrado o expirado"})
+    try:
+        job = json.loads(obj["Body"].read())
+    except Exception as e:
+        _log("ERROR", "%s", e)
+        return _response(500, {"success": False, "error": f"Error interno: {str(e)}"})
+    return _response(200, {"success": True, **job})
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Ingesta — formato real, tamaño y normalización de la imagen
+# ─────────────────────────────────────────────────────────────────────────────
+
+class ImagenInvalida(ValueError):
+    """Imagen rechazada en la ingesta; `status` es el código HTTP a devolver."""
+
+    def __init__(self, status: int, mensaje: str):
+        super().__init__(mensaje)
+        self.status = status
+
+
+_HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1"}
+SNIFF_BYTES  = 16   # lo que _sniff_formato necesita leer
+
+
+def _sniff_formato(data: bytes):
+    """Formato real por magic bytes: jpeg, png, webp, heic o None."""
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[4:8] == b"ftyp" and data[8:12] in _HEIF_BRANDS:
+        return "heic"
+    return None
+
+
+@_trazado("normalizar")
+def _normalizar_imagen(data: bytes):
+    """
+    Valida y acota la imagen antes de S3 y Rekognition. Retorna
+    (bytes, formato, info) con los bytes antes/después en `info`.
+    JPEG/PNG chicos pasan tal cual; WebP/HEIC o imágenes grandes se reducen
+    a IMAGEN_MAX_LADO y se re-codifican a JPEG (requiere Pillow).
+    """
+    formato = _sniff_formato(data)
+    if formato is None:
+        raise ImagenInvalida(415, "Formato de imagen no reconocido (JPEG, PNG, WebP o HEIC)")
+    if len(data) > MAX_IMAGE_BYTES:
+        raise ImagenInvalida(413, f"Imagen demasiado grande (máx {MAX_IMAGE_BYTES // (1024 * 1024)} MB)")
+
+    info = {
+        "formato_original": formato,
+        "bytes_original":   len(data),
+    }
+    if formato not in IMAGEN_EXTENSIONES or len(data) > NORMALIZAR_DESDE_BYTES:
+        jpeg = _recodificar_jpeg(data)
+        if jpeg is not None and (formato not in IMAGEN_EXTENSIONES or len(jpeg) < len(data)):
+            data, formato = jpeg, "jpeg"
+        elif formato not in IMAGEN_EXTENSIONES:
+            raise ImagenInvalida(415, f"Formato {formato} no soportado: enviar JPEG o PNG")
+
+    info["formato"]     = formato
+    info["bytes_final"] = len(data)
+    _log("INFO", "Imagen %s %s B → %s %s B", info['formato_original'], info['bytes_original'], formato, len(data))
+    return data, formato, info
+
+
+def _recodificar_jpeg(data: bytes):
+    """Reduce y re-codifica a JPEG con Pillow. None si Pillow no está o falla."""
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+    try:
+        import pillow_heif   # opcional, solo para HEIC
+        pillow_heif.register_heif_opener()
+    except ImportError:
+        pass
+    try:
+        import io
+        img = _a_rgb(ImageOps.exif_transpose(Image.open(io.BytesIO(data))))
+        img.thumbnail((IMAGEN_MAX_LADO, IMAGEN_MAX_LADO))
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=IMAGEN_CALIDAD, optimize=True)
+        return out.getvalue()
+    except Exception as e:
+        _log("WARN", "No se pudo re-codificar la imagen: %s", e)
+        return None
+
+
+def _a_rgb(img):
+    """Imagen Pillow en RGB; la transparencia se aplana sobre blanco."""
+    from PIL import Image
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        fondo = Image.new("RGB", img.size, (255, 255, 255))
+        fondo.paste(img, mask=img.split()[-1])
+        return fondo
+    return img if img.mode == "RGB" else img.convert("RGB")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Colores locales — k-means sobre una copia reducida de la imagen
+# ─────────────────────────────────────────────────────────────────────────────
+
+@lru_cache(maxsize=None)
+def _modulo_disponible(nombre: str) -> bool:
+    """Instalado o no, sin importarlo: el import (caro) queda para el primer uso."""
+    import importlib.util
+    return importlib.util.find_spec(nombre) is not None
+
+
+def _colores_locales_disponibles() -> bool:
+    return COLORES_LOCALES and _modulo_disponible("numpy") and _modulo_disponible("PIL")
+
+
+def _colores_locales_async(image_bytes, s3_key: str):
+    """
+    Lanza _colores_locales en un pool propio (no el de visión: el pipeline
+    ya corre _obtener_vision dentro de ese pool).
+    """
+    return _pool("colores").submit(_colores_locales, image_bytes, s3_key)
+
+
+@_trazado("colores_locales")
+def _colores_locales(image_bytes, s3_key: str) -> dict:
+    """
+    Decodifica una copia de a lo sumo COLORES_LADO px y calcula los colores
+    dominantes de la imagen y del foreground, en el formato de
+    ImageProperties. El array queda en "pixeles" para los colores por
+    instancia, que dependen de los bounding boxes de detect_labels.
+    """
+    import io
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    if image_bytes is None:
+        image_bytes = _s3().get_object(Bucket=BUCKET_NAME, Key=s3_key)["Body"].read()
+    img = Image.open(io.BytesIO(image_bytes))
+    img.draft("RGB", (COLORES_LADO * 2, COLORES_LADO * 2))   # JPEG: decodifica ya reducida
+    img = _a_rgb(ImageOps.exif_transpose(img))   # los bounding boxes vienen con la orientación EXIF aplicada
+    img.thumbnail((COLORES_LADO, COLORES_LADO))
+    pixeles = np.asarray(img, dtype=np.float32)
+
+    return {
+        "pixeles":    pixeles,
+        "global":     _swatches(*_kmeans(pixeles.reshape(-1, 3), COLORES_K)),
+        "foreground": _swatches(*_kmeans(_pixeles_foreground(pixeles), COLORES_K)),
+    }
+
+
+def _kmeans(pix, k: int):
+    """
+    K-means determinístico sobre pix (n, 3): centros iniciales en cuantiles
+    de luminancia, así la misma foto da siempre los mismos colores.
+    Retorna (centros, cantidad de píxeles por centro).
+    """
+    import numpy as np
+    n = len(pix)
+    k = min(k, n)
+    luminancia = pix @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    orden   = np.argsort(luminancia, kind="stable")
+    centros = pix[orden[((np.arange(k) + 0.5) * n / k).astype(int)]]
+    for _ in range(COLORES_ITERACIONES):
+        asignacion = _asignar(pix, centros)
+        cuenta = np.bincount(asignacion, minlength=k)
+        sumas  = np.stack([np.bincount(asignacion, weights=pix[:, c], minlength=k) for c in range(3)], axis=1)
+        nuevos = np.where(cuenta[:, None] > 0, sumas / np.maximum(cuenta, 1)[:, None], centros)
+        convergio = np.abs(nuevos - centros).max() < 0.5
+        centros = nuevos
+        if convergio:
+            break
+    return centros, np.bincount(_asignar(pix, centros), minlength=k)
+
+
+def _asignar(pix, centros):
+    """Índice del centro más cercano (distancia RGB) de cada píxel."""
+    return ((pix[:, None, :] - centros[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+
+
+def _swatches(centros, cuenta, maximo: int = 8) -> list:
+    """
+    Centros → DominantColors al estilo Rekognition, de mayor a menor
+    PixelPercent. Un centro a menos de COLORES_FUSION de otro más poblado
+    suma sus píxeles a ese (k-means parte un color plano en matices).
+    """
+    total = int(cuenta.sum()) or 1
+    grupos = []   # [rgb, píxeles]
+    for rgb, c in sorted(zip(centros.tolist(), cuenta.tolist()), key=lambda x: -x[1]):
+        if not c:
+            continue
+        for grupo in grupos:
+            if sum((a - b) ** 2 for a, b in zip(rgb, grupo[0])) < COLORES_FUSION ** 2:
+                grupo[1] += c
+                break
+        else:
+            grupos.append([rgb, c])
+    grupos.sort(key=lambda g: -g[1])
+    return [
+        {"Red": int(round(r)), "Green": int(round(g)), "Blue": int(round(b)),
+         "PixelPercent": round(100 * c / total, 2)}
+        for (r, g, b), c in grupos[:maximo]
+    ]
+
+
+def _pixeles_foreground(pixeles):
+    """
+    Píxeles del sujeto: dentro de una elipse central y lejos (en RGB) de los
+    dos colores que dominan el borde, que se toma como fondo. Si casi nada
+    se distingue del fondo (foto recortada al ras), la elipse completa.
+    """
+    import numpy as np
+    alto, ancho = pixeles.shape[:2]
+    b = max(1, round(min(alto, ancho) * 0.08))
+    borde = np.concatenate([
+        pixeles[:b].reshape(-1, 3), pixeles[-b:].reshape(-1, 3),
+        pixeles[b:-b, :b].reshape(-1, 3), pixeles[b:-b, -b:].reshape(-1, 3),
+    ])
+    fondo, _ = _kmeans(borde, 2)
+
+    yy, xx = np.ogrid[:alto, :ancho]
+    elipse = ((yy - (alto - 1) / 2) / (alto / 2)) ** 2 + ((xx - (ancho - 1) / 2) / (ancho / 2)) ** 2 <= 0.7
+    centro = pixeles[elipse]
+    distancia = np.sqrt(((centro[:, None, :] - fondo[None, :, :]) ** 2).sum(axis=2)).min(axis=1)
+    sujeto = centro[distancia > 40]
+    return sujeto if len(sujeto) >= 0.05 * len(centro) else centro
+
+
+def _colores_instancias(reko_labels: dict, pixeles):
+    """DominantColors de cada instancia, del recorte de su bounding box."""
+    alto, ancho = pixeles.shape[:2]
+    for lbl in reko_labels.get("Labels", []):
+        for inst in lbl.get("Instances", []):
+            caja = inst.get("BoundingBox") or {}
+            x0 = max(0, int(caja.get("Left", 0) * ancho))
+            y0 = max(0, int(caja.get("Top", 0) * alto))
+            x1 = min(ancho, int(round((caja.get("Left", 0) + caja.get("Width", 0)) * ancho)))
+            y1 = min(alto, int(round((caja.get("Top", 0) + caja.get("Height", 0)) * alto)))
+            recorte = pixeles[y0:y1, x0:x1].reshape(-1, 3)
+            if len(recorte) >= 16:
+                inst["DominantColors"] = _swatches(*_kmeans(recorte, COLORES_K_INSTANCIA), maximo=3)
+
+
+def _combinar_colores_locales(reko_labels: dict, futuro, imagen_reko: dict) -> dict:
+    """
+    Completa la respuesta de un detect_labels solo de labels con los colores
+    locales, en el lugar donde IMAGE_PROPERTIES los pondría. Si el cálculo
+    local falló, repite detect_labels con IMAGE_PROPERTIES.
+    """
+    try:
+        colores = futuro.result(timeout=COLORES_TIMEOUT_S)
+    except Exception as e:
+        _log("WARN", "Colores locales fallaron (%s): se piden a Rekognition", e)
+        _contar("colores_fallback")
+        return _detect_labels(imagen_reko)
+    with _span("colores_instancias"):
+        _colores_instancias(reko_labels, colores["pixeles"])
+    return {
+        **reko_labels,
+        "ImageProperties": {
+            "DominantColors": colores["global"],
+            "Foreground":     {"DominantColors": colores["foreground"]},
+        },
+    }
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Casi-duplicados — dHash e índice por distancia de Hamming
+# ─────────────────────────────────────────────────────────────────────────────
+
+@lru_cache(maxsize=None)
+def _phash_activo() -> bool:
+    if PHASH_DISTANCIA <= 0:
+        return False
+    if not _modulo_disponible("PIL"):
+        # Una vez por contenedor: sin la layer el índice nunca se llena
+        _log("WARN", "Índice de casi-duplicados desactivado: falta Pillow (python empaquetar.py capa)")
+        return False
+    return True
+
+
+def _dhash(data: bytes):
+    """
+    dHash de 64 bits: signo del gradiente horizontal de una miniatura 9×8 en
+    grises. None si no se puede decodificar o si la imagen es casi plana
+    (pocos bits en 1 o en 0: todas las fotos lisas se parecerían).
+    """
+    try:
+        import io
+        from PIL import Image, ImageOps
+        img = Image.open(io.BytesIO(data))
+        img.draft("L", (72, 64))
+        px = ImageOps.exif_transpose(img).convert("L").resize((9, 8), Image.LANCZOS).tobytes()
+    except Exception as e:
+        _log("DEBUG", "dHash no disponible: %s", e)
+        return None
+    h = 0
+    for fila in range(0, 72, 9):
+        for x in range(fila, fila + 8):
+            h = (h << 1) | (px[x] > px[x + 1])
+    return h if 8 <= h.bit_count() <= 56 else None
+
+
+class _BKTree:
+    """
+    BK-tree sobre distancia de Hamming: cada hijo cuelga de la distancia a su
+    padre, y una búsqueda por radio r solo baja por las ramas [d - r, d + r].
+    Nodo: [hash, valor, {distancia: nodo}].
+    """
+
+    __slots__ = ("raiz", "n")
+
+    def __init__(self):
+        self.raiz = None
+        self.n    = 0
+
+    def agregar(self, h: int, valor):
+        if self.raiz is None:
+            self.raiz, self.n = [h, valor, {}], 1
+            return
+        nodo = self.raiz
+        while True:
+            d = (h ^ nodo[0]).bit_count()
+            if d == 0:
+                nodo[1] = valor   # mismo hash: queda el último
+                return
+            hijo = nodo[2].get(d)
+            if hijo is None:
+                nodo[2][d] = [h, valor, {}]
+                self.n += 1
+                return
+            nodo = hijo
+
+    def buscar(self, h: int, radio: int) -> list:
+        """[(distancia, valor)] a distancia ≤ radio, los más cercanos primero."""
+        encontrados = []
+        pila = [self.raiz] if self.raiz is not None else []
+        while pila:
+            nodo = pila.pop()
+            d = (h ^ nodo[0]).bit_count()
+            if d <= radio:
+                encontrados.append((d, nodo[1]))
+            for dist, hijo in nodo[2].items():
+                if d - radio <= dist <= d + radio:
+                    pila.append(hijo)
+        encontrados.sort(key=lambda e: e[0])
+        return encontrados
+
+
+class _IndicePHash:
+    """
+    dHash → image_hash de las imágenes ya analizadas, un BK-tree por género.
+    Con backend, el índice se relee a lo sumo cada PHASH_SYNC_S y las altas
+    se publican en background (leer, fusionar, escribir: sin
+    compare-and-swap, un alta simultánea puede perderse y solo cuesta un
+    análisis). Las entradas viven lo que el cache de visión.
+    """
+
+    CLAVE = "index.json"
+
+    def __init__(self, backend=None):
+        self.backend   = backend
+        self._entradas = {}   # image_hash → (dhash, genero, instante)
+        self._nuevas   = {}   # altas sin publicar, mismo formato
+        self._arboles  = {}   # genero → _BKTree
+        self._sync_en  = 0.0
+        self._sincronizando = False
+        self._lock     = threading.Lock()
+
+    def buscar(self, dhash: int, genero: str) -> list:
+        """[(distancia, image_hash)] del mismo género dentro de PHASH_DISTANCIA, más cercanas primero."""
+        self._sincronizar()
+        limite = time.time() - VISION_CACHE_TTL
+        with self._lock:
+            arbol = self._arboles.get(genero)
+            encontrados = arbol.buscar(dhash, PHASH_DISTANCIA) if arbol is not None else []
+        return [(d, image_hash) for d, (image_hash, instante) in encontrados if instante >= limite]
+
+    def agregar(self, dhash: int, genero: str, image_hash: str):
+        entrada = (dhash, genero, time.time())
+        with self._lock:
+            self._entradas[image_hash] = entrada
+            self._nuevas[image_hash]   = entrada
+            self._arboles.setdefault(genero, _BKTree()).agregar(dhash, (image_hash, entrada[2]))
+        self._sincronizar()
+
+    def _sincronizar(self):
+        """Publica altas y relee el índice en background (a lo sumo una sincronización a la vez)."""
+        if self.backend is None or self._sincronizando:
+            return
+        with self._lock:
+            if self._sincronizando or (not self._nuevas and time.monotonic() < self._sync_en):
+                return
+            self._sincronizando = True
+        _pool("s3").submit(self._sincronizar_ahora)
+
+    def _sincronizar_ahora(self):
+        try:
+            with self._lock:
+                nuevas, self._nuevas = self._nuevas, {}
+            try:
+                remoto = json.loads(self.backend.get(self.CLAVE) or b"{}").get("entradas", [])
+            except ValueError:
+                remoto = []
+            entradas = {image_hash: (int(h, 16), genero, instante) for h, genero, image_hash, instante in remoto}
+            entradas.update(nuevas)
+            limite   = time.time() - VISION_CACHE_TTL
+            vigentes = sorted(((k, e) for k, e in entradas.items() if e[2] >= limite),
+                              key=lambda kv: kv[1][2], reverse=True)[:PHASH_MAX_ENTRADAS]
+            if nuevas:
+                try:
+                    self.backend.put(self.CLAVE, json.dumps({"entradas": [
+                        [f"{h:016x}", genero, image_hash, round(instante, 1)]
+                        for image_hash, (h, genero, instante) in vigentes
+                    ]}, separators=(",", ":")).encode("utf-8"))
+                except Exception as e:
+                    _log("WARN", "Índice de casi-duplicados: no se pudo publicar: %s", e)
+                    with self._lock:
+                        self._nuevas = {**nuevas, **self._nuevas}   # van en la próxima
+            arboles = {}
+            for image_hash, (h, genero, instante) in reversed(vigentes):
+                arboles.setdefault(genero, _BKTree()).agregar(h, (image_hash, instante))
+            with self._lock:
+                # Las altas que llegaron mientras tanto siguen en _nuevas
+                for image_hash, (h, genero, instante) in self._nuevas.items():
+                    arboles.setdefault(genero, _BKTree()).agregar(h, (image_hash, instante))
+                self._entradas = {**dict(vigentes), **self._nuevas}
+                self._arboles  = arboles
+            self._sync_en = time.monotonic() + PHASH_SYNC_S
+        except Exception as e:
+            _log("WARN", "Índice de casi-duplicados: no se pudo sincronizar: %s", e)
+            self._sync_en = time.monotonic() + PHASH_SYNC_S
+        finally:
+            self._sincronizando = False
+
+
+_indice_phash = None
+
+
+def _get_indice_phash() -> _IndicePHash:
+    global _indice_phash
+    if _indice_phash is None:
+        backend = None
+        if PHASH_COMPARTIDO == "s3" and BUCKET_NAME:
+            backend = _S3KVBackend(BUCKET_NAME, "uploads/_phash/")
+        elif PHASH_COMPARTIDO == "memoria":
+            backend = _MemoryKVBackend()
+        _indice_phash = _IndicePHash(backend)
+    return _indice_phash
+
+
+def _vision_similar(dhash: int, genero: str, vision_cache):
+    """Visión de la foto ya analizada más parecida (mismo género) que siga en el cache, o None."""
+    for distancia, image_hash in _get_indice_phash().buscar(dhash, genero)[:3]:
+        vision = vision_cache.get(_vision_key(image_hash))
+        if vision is not None:
+            _contar("vision_casi_duplicados")
+            _log("INFO", "Casi duplicado de %s (distancia %s) — se omite Rekognition", image_hash[:12], distancia)
+            return vision
+    return None
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Rekognition — parseo de labels y colores
+# ─────────────────────────────────────────────────────────────────────────────
+
+@_trazado("parse_rekognition")
+def _parse_rekognition(reko_labels: dict) -> dict:
+    """
+    Reduce la respuesta de detect_labels a lo que usa el pipeline:
+    labels (nombre, confianza, parents, aliases, color de instancia) y las
+    listas de colores global / foreground ya mapeadas al catálogo.
+    Las tres fuentes de color se nombran en un solo batch.
+    El resultado es JSON-serializable para guardarlo por hash de imagen.
+    """
+    raw_labels = reko_labels.get("Labels", [])
+    props      = reko_labels.get("ImageProperties", {})
+
+    # Debug: mostrar colores de instancias con RGB (solo si DEBUG está activo)
+    if _log_activo("DEBUG"):
+        for lbl in raw_labels:
+            if lbl.get("Instances"):
+                info = []
+                for inst in lbl["Instances"]:
+                    for ic in inst.get("DominantColors", [])[:2]:
+                        css = ic.get("CSSColor","?")
+                        rgb = (ic.get("Red",0), ic.get("Green",0), ic.get("Blue",0))
+                        info.append(f"{css}{rgb}")
+                if info:
+                    _log("DEBUG", "%s → %s", lbl['Name'], info)
+
+    # Una sola lista plana de swatches: [0, n_global) global, luego
+    # foreground, luego las instancias de cada label (hasta 3 por instancia)
+    swatches = ColorSwatches()
+    swatches.extend(props.get("DominantColors", [])[:8])
+    fin_global = len(swatches)
+    swatches.extend(props.get("Foreground", {}).get("DominantColors", [])[:8])
+    fin_fg = len(swatches)
+    rangos_inst = []
+    for lbl in raw_labels:
+        inicio = len(swatches)
+        for inst in lbl.get("Instances", []):
+            swatches.extend(inst.get("DominantColors", [])[:3])
+        rangos_inst.append((inicio, len(swatches)))
+
+    nombres = swatches.nombres()
+
+    labels = []
+    for lbl, (inicio, fin) in zip(raw_labels, rangos_inst):
+        color_inst = None
+        for i in range(inicio, fin):
+            if nombres[i]:
+                color_inst = [nombres[i], swatches.pct[i]]
+                break
+        labels.append({
+            "Name":           lbl["Name"],
+            "Confidence":     lbl["Confidence"],
+            "Parents":        [{"Name": p.get("Name", "")} for p in lbl.get("Parents", [])],
+            "Aliases":        [{"Name": a.get("Name", "")} for a in lbl.get("Aliases", [])],
+            "Instances":      [{"BoundingBox": inst.get("BoundingBox", {})} for inst in lbl.get("Instances", [])],
+            "ColorInstancia": color_inst,
+        })
+
+    return {
+        "labels":             labels,
+        "colores":            _lista_colores(nombres, swatches.pct, 0, fin_global),
+        "colores_foreground": _lista_colores(nombres, swatches.pct, fin_global, fin_fg),
+    }
+
+
+@_trazado("detect_labels")
+def _detect_labels(imagen_reko: dict, solo_labels: bool = False) -> dict:
+    """solo_labels=True omite IMAGE_PROPERTIES (los colores se calculan localmente)."""
+    return _rekognition().detect_labels(
+        Image=imagen_reko,
+        MaxLabels=40,
+        MinConfidence=50,
+        Features=["GENERAL_LABELS"] if solo_labels else ["GENERAL_LABELS", "IMAGE_PROPERTIES"],
+    )
+
+
+@_trazado("s3_put")
+def _archivar_imagen(s3_key: str, image_bytes: bytes, content_type: str = "image/jpeg"):
+    _s3().put_object(
+        Bucket=BUCKET_NAME, Key=s3_key,
+        Body=image_bytes, ContentType=content_type,
+    )
+
+
+def _archivar_imagen_async(s3_key: str, image_bytes: bytes, content_type: str = "image/jpeg"):
+    """
+    Sube la imagen en un thread aparte y no espera el resultado. Si Lambda
+    congela el contenedor antes de terminar, el thread sigue en la próxima
+    invocación warm.
+    """
+    futuro = _pool("s3").submit(_archivar_imagen, s3_key, image_bytes, content_type)
+    futuro.add_done_callback(
+        lambda f: f.exception() and _log("WARN", "Archivo S3 falló (%s): %s", s3_key, f.exception())
+    )
+    return futuro
+
+
+_vision_cache = None
+
+
+def _vision_key(image_hash: str) -> str:
+    """La versión invalida entradas guardadas con un formato anterior de `vision`."""
+    return f"v{VISION_FORMATO}:{image_hash}"
+
+
+def _get_vision_cache():
+    """Análisis de Rekognition por sha256 de la imagen."""
+    global _vision_cache
+    if _vision_cache is None:
+        _vision_cache = _build_cache("vision", ttl=VISION_CACHE_TTL)
+    return _vision_cache
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Colores — swatches de Rekognition y nombres del catálogo
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _rgb_to_color_name(r: int, g: int, b: int) -> str:
+    """Clasifica valores RGB al color más cercano en nuestro catálogo."""
+    lum   = r * 0.299 + g * 0.587 + b * 0.114
+    max_c = max(r, g, b)
+    min_c = min(r, g, b)
+    delta = max_c - min_c
+    sat   = delta / max_c if max_c > 0 else 0
+
+    # Acromático (poco saturado)
+    if sat < 0.12 or delta < 20:
+        if lum < 45:   return "Black"
+        if lum < 90:   return "Charcoal"
+        if lum < 175:  return "Gray"
+        return "White"
+
+    # Calcular tono
+    if max_c == r:
+        hue = 60 * ((g - b) / delta % 6)
+    elif max_c == g:
+        hue = 60 * ((b - r) / delta + 2)
+    else:
+        hue = 60 * ((r - g) / delta + 4)
+    hue = hue % 360
+
+    if hue < 20 or hue >= 340:           # Rojo
         return "Maroon" if lum < 70 else ("Coral" if lum > 180 else "Red")
     elif hue < 45:                        # Naranja
         return "Orange"
@@ -800,35 +2131,739 @@ def _rgb_to_color_name(r: int, g: int, b: int) -> str:
         return "Pink" if lum > 150 else "Red"
 
 
-def _fetch_serpapi(query: str) -> list:
-    """Llama a SerpAPI Google Shopping y retorna los items crudos."""
+# Tabla RGB → color: 5 bits por canal (32 768 celdas de 1 byte), cada celda
+# clasificada en su centro con _rgb_to_color_name. Viene precompilada en el
+# módulo (empaquetar.py); si ya no corresponde al catálogo se arma una vez
+# por contenedor (~60 ms). Nombrar un swatch pasa a ser un lookup.
+_COLOR_LUT_BITS = 5
+_COLOR_NOMBRES  = tuple(COLORES)
+_color_lut      = None
+
+
+# ── Precompilado por empaquetar.py (no editar a mano) ──
+_COLOR_LUT_PRECOMPILADA_NOMBRES = ('Black', 'White', 'Red', 'Blue', 'Green', 'Gray', 'Grey', 'Brown', 'Pink', 'Yellow', 'Purple', 'Orange', 'Beige', 'Navy', 'Maroon', 'Cream', 'Tan', 'Olive', 'Burgundy', 'Teal', 'Coral', 'Ivory', 'Khaki', 'Charcoal', 'Lavender', 'Mint', 'Mustard', 'Salmon', 'Indigo')
+_COLOR_LUT_PRECOMPILADA = (
+    "eNrd2tFu4sgWheFgdiSWt8aSBVKkEu//nAcChLJrV/027s5J2hcjzawS0yPzf9TFvL29/dd63jbu"
+    "43g80l4/sd+PtQP723Pfj8H02G8HjsU024/76BnhQL5HJ0Y4MNuP8Z4dONJ+jPbqgWjPT9xns8qB"
+    "6/T5HOMD9vUcwxP1/Tjb4wOt/XrC4ADsR4MDq3bbutvWvThw6fd8bvf99t+GfaS9AUTWd6X+Z79h"
+    "/HnfUfzTfl/vv3FgWf/j8v7jfdzaf+3Avf5q/7VvFvZf7La1//DAmv7/xb4X9X99Gn23gHgDAMbm"
+    "fj6PNSD2+88/1hgAEfUd15/1G9af993Yx639j3A/wP7H5f3H+9juf/rFmOzRN2f/Qv+2sv9it639"
+    "G9wP/sW+DQ4MQ9/353PVAAcgHIBIDSCun6oQiPPXM86ByL6bDx/G2uU+73tPfWP/jX3c2v8I9wPs"
+    "f1zef7nPvxh76jvaDe4H2L+t7L/YbWv/BveDX9g3999lAJSZDwCEN4E4n1MNiPsnpgCI7E9z1hSI"
+    "+61g4sP48fER1//wYazmv7D/cVH/jX3c2v8I9wPoP3/xs738Yuz31PdL/RvcD7B/W9l/sdvW/n9f"
+    "3wYHbv3306im/TeB8AYQ13/gIRDPT0tzIGZ9pxsQH8F090HX/j+mt4JsvwMR1/3wYYT7AfY/Luq/"
+    "sY9b+x/r94PZe99T39h/vNvW/g3uB9i/rey/2G1r/z+ub+7/BkA/D2vafwWIS981IO5/4wEQ+Sf5"
+    "FIii70v/fu37XHkue/poHBAAIQBiBCCW9j8u6r+xj83+n++12Ocvfv9q/7a8/3i3rf0b3A+wf1vZ"
+    "f7H/ur4NDlzzjQG4xTrUgfj86xADkfVdAjHrfwpEubtD/y0gEgAhAEIAhACIxf2Pi/oP98l73VPf"
+    "1d3gfoD92/L+49229m9wP8D+bWX/+5/e9/L+4wKHJhC3fWjsDkA4AOEARAIgEgCRAAgBEAIgBEAs"
+    "7P/x3oJ9+l73e+r79f4N7gfYvy3vP95ta/8G9wPs37b2/819GxzI+g4TGwCIAYBwAMIBCAcgHIBI"
+    "AEQCIBIAIQBCAIQeQFxfS+V+kb22PfWN/Td229q/wf0A+7fl/ce7be3f4H6A/f+wvlf137f7xr3m"
+    "QwMIByAcgHAAwgGIBEAkACIBEMqAeA+AuK+Xt/L+/h77oOd7i/bl/dui/hu7be3f4H6A/dvy/uPd"
+    "tvZvcD/4YX0bHLjVWQdgACAGAGIAIByAcADCAYhH/13X2r2r7QmASADEY0/v16fug679B0A81hoQ"
+    "AiAEQAiAMADCAIiV/RvcD7B/W95/vNvW/g3uB9/b95L+cwD6uP8qAAMAMQAQDkA4AOEAxKPurqv7"
+    "cT8R7gmASBkQ763+Pe4/ARAJgBAAIQBCAIQACAMgDIBY27/B/QD7t+X9x7tt7f9b+zY4UPTfx313"
+    "S3fov7JXgXAA4iv/ChDP/ht7AwgHIBIAkZ5AQP8xEAmASACEAAgBEAIgBEAIgDAAYnX/BvcD7N+W"
+    "9x/vtrX/P9n30v5rAAwAxABADADEAEA4AHG/3D//C4J+u64OgAMQDkA4AJEAiARAJAAiARAJgBAA"
+    "IQBCAIQACAEQBkCs79/gfoD92/L+4/07+zY4EPQ9+ZIOAMQAQAwAxABAOO0+dJO+i33Wf1+9H4QA"
+    "OADhAIQDEAmASABEAiASAJEACAEQAiAEQAiAEAAhAOKF/g3uB9i/Le9//7f7Xtx/BYABgBgAiAGA"
+    "GACIr0+vAPCMt7aXB9r999X7QQSAAxAOQCQAIgEQCYBIAEQCIBIAIQBCAIQACAEQAiAEQLzSv8H9"
+    "APu3rf3b1t3a/fftvst9WLB3DT9aexl4tmd1hwA4AOEAhAMQDkA4AOEARAIgEgCRAIgEQCQAIgEQ"
+    "AiAEQAiAEAAhAEIAhF7p3+B+gP3/ub6X9V8C0Lf779v9lvvQ2ou+n9/hLuo72z0+EN4PIgAcgHAA"
+    "wgEIByAcgHAAIgEQCYBIAEQCIBIAkQAIARACIARACIAQACEAQnqlf4P7wZ/r2+BAlm8IwABADADE"
+    "UPsXfO1h3197BwDQ7gCEAxAOQDgA4QCEAxAOQDgAkQCIBEAkACIBEAmASACEAAgBEAIgBEAIgBAA"
+    "IQBCAMTWvl/vv2/3O9uH1h713bf7fW0vAXDaAQgHIByAcADCAQgHIByASABEAiASAJEAiARAzGdp"
+    "CkQCIBQCsavsJRACIARACIAQACEAQtrWt8GBRt+fr3kAIPI5AmDy+x7s9b77dt8Ldwcg3GlvA+EA"
+    "hAMQDkA4AOEAhAMQCYBIJRCHcq8DkQCIWfyXx8P+s0wnQEynW2y7y1Pz4TOn+l4AIQBCAIQACAEQ"
+    "AiAEQGhL//3s972r7JW++3afm/eg/27t7gCEAxAOQDgA4QCEAxAOQDgA4QBEKoE4TP1oA5EAiFn9"
+    "BRBF/Z9A7Hbl/x/5fHafz+z/f5oDsav48ABiV79f1PdG/xUgBEAIgBAAIQBikncAQOv3/bY3+r3s"
+    "zb77dp+b96D/OQBOOwDhAIQDEA5AOADhAIQDEEH+h0Ntv5/I9wRAJACiiH8GRBH/9dk9+4/6dug/"
+    "B0IAhEIgGvsMCAEQAiAEQAiAEAAxAADT3/dyb/dd7N3Kvd3v5j3ofwaAO+1tIByAcADCAQgHIIL8"
+    "7/0W+6z/vno/yIFIAEQCIL7qrwBRxn89cIr3HIhW/w79Z0C09ooPEyAEQAiAEAAhAEIAxPT3Pep/"
+    "U7+r927r3v3RPei/m+1OexMIByAcgHAAIuj/0fd8Lw+0++9r94MciARAzOOfA1HEf3lOp9Oh3LMz"
+    "p2tdfaXvhw/b+99V9ycQAiAEQAiAEAAhAGL2+/7/7/ev992t2p12AMIBCAcgHICI+n8G3kf3g0MO"
+    "gAMQDkA4AOEAxCz++4lTvmt25nTvv5/1GQIhAEIAhAAIARACIARACIAQACEAYu3v+w/7fd7cdwcH"
+    "nHbvVvffzfunvQFEmP+h3PMT+QEHIByAcADCAQgPDlzzfQCgEojTFwD9s68aEAIgBEAIgBAAIQBC"
+    "AIQACAEQAiB+++/z1r5f2Tvov4P7Afbfte8HUd/T/oO+u+X95wccgID++zD/7vR1oOj/dMv7AYTa"
+    "B84CIARACIAQACEAAvqmfSc4IABCAMQv7Lv7zr6xfzjgAIQDEEH/Ud/zA9T/oXU/wP6zAw5ARP1n"
+    "ffdx3c8DDkAIgBAAIQBCAIQACAEQr/bNu9p7rf9/oO/ub+/dmv7bB6L+i3671f0fGveDSt/xBzgA"
+    "Efd/OsT93uL/rPPwYv+zA+7Yf/OAAAgBEAIgBEAIgHi5b94V99/9+313f3vv1vQf5D/rs+ug7251"
+    "/4fG/aDSd/gB0eW+3vfp9Mw37Jf2Bf1PDzgAIQBCAIQACAEQAiAEQFDftP8PVBiQLQ=="
+)
+# ── fin precompilado ──
+
+
+def _get_color_lut() -> bytearray:
+    global _color_lut
+    if _color_lut is None:
+        _color_lut = _color_lut_precompilada() or _construir_color_lut()
+    return _color_lut
+
+
+def _construir_color_lut() -> bytearray:
+    shift  = 8 - _COLOR_LUT_BITS
+    centro = 1 << (shift - 1)
+    indice = {nombre: i for i, nombre in enumerate(_COLOR_NOMBRES)}
+    niveles = [(q << shift) + centro for q in range(1 << _COLOR_LUT_BITS)]
+    lut = bytearray(1 << (3 * _COLOR_LUT_BITS))
+    i = 0
+    for r in niveles:
+        for g in niveles:
+            for b in niveles:
+                lut[i] = indice[_rgb_to_color_name(r, g, b)]
+                i += 1
+    return lut
+
+
+def _color_lut_precompilada():
+    """
+    La tabla empaquetada, solo si sigue correspondiendo al catálogo y al
+    clasificador actuales: mismos nombres, mismo tamaño y 128 celdas de
+    muestra que coinciden con _rgb_to_color_name.
+    """
+    if not _COLOR_LUT_PRECOMPILADA or _COLOR_LUT_PRECOMPILADA_NOMBRES != _COLOR_NOMBRES:
+        return None
+    try:
+        lut = bytearray(zlib.decompress(base64.b64decode(_COLOR_LUT_PRECOMPILADA)))
+    except (ValueError, zlib.error):
+        return None
+    if len(lut) != 1 << (3 * _COLOR_LUT_BITS):
+        return None
+    bits   = _COLOR_LUT_BITS
+    mask   = (1 << bits) - 1
+    shift  = 8 - bits
+    centro = 1 << (shift - 1)
+    for i in range(0, len(lut), len(lut) // 128 + 1):
+        r = ((i >> 2 * bits) << shift) + centro
+        g = (((i >> bits) & mask) << shift) + centro
+        b = ((i & mask) << shift) + centro
+        if _COLOR_NOMBRES[lut[i]] != _rgb_to_color_name(r, g, b):
+            _log("WARN", "Tabla de colores precompilada desactualizada — se regenera")
+            return None
+    return lut
+
+
+def _rgb_to_color_names(rgbs) -> list:
+    """API batch: [(r, g, b), ...] → [color_en, ...] vía la tabla cuantizada."""
+    lut   = _get_color_lut()
+    shift = 8 - _COLOR_LUT_BITS
+    bits  = _COLOR_LUT_BITS
+    return [
+        _COLOR_NOMBRES[lut[((r >> shift) << (2 * bits)) | ((g >> shift) << bits) | (b >> shift)]]
+        for r, g, b in rgbs
+    ]
+
+
+class ColorSwatches:
+    """
+    Swatches de DominantColors en arrays paralelos compactos (CSS,
+    simplificado, RGB empaquetado y porcentaje) para nombrarlos en lote.
+    """
+
+    __slots__ = ("css", "simp", "rgb", "pct")
+
+    def __init__(self):
+        self.css  = []
+        self.simp = []
+        self.rgb  = array("I")
+        self.pct  = array("d")
+
+    def __len__(self):
+        return len(self.pct)
+
+    def extend(self, dominant_colors):
+        for dc in dominant_colors:
+            self.css.append(dc.get("CSSColor", "").lower().strip())
+            self.simp.append(dc.get("SimplifiedColor", "").lower().strip())
+            r = min(max(int(dc.get("Red", 0)), 0), 255)
+            g = min(max(int(dc.get("Green", 0)), 0), 255)
+            b = min(max(int(dc.get("Blue", 0)), 0), 255)
+            self.rgb.append((r << 16) | (g << 8) | b)
+            self.pct.append(float(dc.get("PixelPercent", 0)))
+
+    def nombres(self) -> list:
+        """Color del catálogo por swatch (None si no mapea): CSS → simplificado → RGB."""
+        out       = [None] * len(self)
+        pendientes = []
+        for i, (css, simp, rgb) in enumerate(zip(self.css, self.simp, self.rgb)):
+            mapped = COLOR_CSS_MAP.get(css) or COLOR_CSS_MAP.get(simp)
+            if mapped:
+                out[i] = mapped if mapped in COLORES else None
+            elif rgb:
+                pendientes.append(i)
+        if pendientes:
+            rgbs = [(self.rgb[i] >> 16, (self.rgb[i] >> 8) & 255, self.rgb[i] & 255) for i in pendientes]
+            for i, nombre in zip(pendientes, _rgb_to_color_names(rgbs)):
+                out[i] = nombre
+        return out
+
+
+def _lista_colores(nombres: list, pct, inicio: int, fin: int) -> list:
+    """Colores mapeados de un tramo de swatches, sin repetidos consecutivos."""
+    lista = []
+    for i in range(inicio, fin):
+        mapped = nombres[i]
+        if mapped and (not lista or lista[-1]["en"] != mapped):
+            lista.append({"en": mapped, "es": COLORES[mapped], "confianza": round(pct[i], 1)})
+    return lista
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Clasificación de labels — índice multi-patrón precompilado
+# ─────────────────────────────────────────────────────────────────────────────
+
+class _AhoCorasick:
+    """
+    Autómata de Aho–Corasick: encuentra en una sola pasada todas las
+    apariciones (incluso solapadas) de un conjunto de patrones en un texto.
+    Mantiene la semántica de substring de los `in nombre.lower()` anteriores.
+    """
+
+    def __init__(self, patrones):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out  = [()]
+        for texto, payload in patrones:
+            nodo = 0
+            for ch in texto:
+                nxt = self._goto[nodo].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                    self._goto[nodo][ch] = nxt
+                nodo = nxt
+            self._out[nodo] += ((len(texto), payload),)
+
+        # Links de fallo por BFS; cada nodo hereda las salidas de su fallo
+        cola = deque(self._goto[0].values())
+        while cola:
+            nodo = cola.popleft()
+            for ch, hijo in self._goto[nodo].items():
+                cola.append(hijo)
+                f = self._fail[nodo]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                destino = self._goto[f].get(ch, 0)
+                self._fail[hijo] = destino if destino != hijo else 0
+                self._out[hijo] += self._out[self._fail[hijo]]
+
+    def buscar(self, texto: str):
+        """Genera (inicio, largo, payload) por cada aparición."""
+        goto, fail, out = self._goto, self._fail, self._out
+        nodo = 0
+        for i, ch in enumerate(texto):
+            while nodo and ch not in goto[nodo]:
+                nodo = fail[nodo]
+            nodo = goto[nodo].get(ch, 0)
+            for largo, payload in out[nodo]:
+                yield i - largo + 1, largo, payload
+
+
+_LabelHits = namedtuple("_LabelHits", "colores estilos descriptores patrones prendas")
+
+# Orden de prioridad dentro de cada catálogo = orden de definición (como
+# los loops originales, que se quedaban con el primer match del dict)
+_CATALOGOS_LABEL = {
+    "color":      list(COLORES),
+    "estilo":     list(ESTILOS),
+    "descriptor": sorted(DESCRIPTORES_UTILES),
+    "patron":     list(PATRONES),
+    "prenda":     list(dict.fromkeys([*PRENDAS_HOMBRE, *PRENDAS_MUJER])),
+}
+_RANGO_CATALOGO = {
+    cat: {nombre: i for i, nombre in enumerate(items)} for cat, items in _CATALOGOS_LABEL.items()
+}
+_RANGO_PRENDA = {
+    "hombre": {nombre: i for i, nombre in enumerate(PRENDAS_HOMBRE)},
+    "mujer":  {nombre: i for i, nombre in enumerate(PRENDAS_MUJER)},
+}
+_matcher_labels = None
+
+
+def _get_matcher_labels() -> _AhoCorasick:
+    """El autómata se arma en la primera clasificación (~2 ms), no en el init."""
+    global _matcher_labels
+    if _matcher_labels is None:
+        _matcher_labels = _AhoCorasick(
+            (nombre.lower(), (cat, nombre))
+            for cat, items in _CATALOGOS_LABEL.items() for nombre in items
+        )
+    return _matcher_labels
+
+
+@lru_cache(maxsize=4096)
+def _clasificar_texto(texto: str) -> _LabelHits:
+    """
+    Clasifica un nombre de label contra todos los catálogos en una pasada.
+    Colores, estilos y patrones salen en orden de catálogo (el primero es el
+    que elegía el loop lineal); descriptores en orden de aparición en el
+    texto. Memoizado: los labels se repiten entre invocaciones warm.
+    """
+    encontrados = {cat: {} for cat in _CATALOGOS_LABEL}
+    for inicio, largo, (cat, nombre) in _get_matcher_labels().buscar(texto.lower()):
+        encontrados[cat].setdefault(nombre, (inicio, -largo))
+
+    def por_rango(cat):
+        return tuple(sorted(encontrados[cat], key=_RANGO_CATALOGO[cat].get))
+
+    return _LabelHits(
+        colores      = por_rango("color"),
+        estilos      = por_rango("estilo"),
+        descriptores = tuple(sorted(encontrados["descriptor"], key=encontrados["descriptor"].get)),
+        patrones     = por_rango("patron"),
+        prendas      = frozenset(encontrados["prenda"]),
+    )
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Construcción de queries
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _build_smart_query(prenda_en, color_en, estilo_en, descriptores, genero):
+    """
+    Query específica con todos los atributos detectados.
+    Ej: "oversized black striped cotton hoodie streetwear men shop"
+    """
+    parts = []
+
+    # Fit/corte primero si está en descriptores (ej: oversized, slim, cropped)
+    FIT_TERMS = {"Slim", "Oversized", "Cropped", "Fitted", "Baggy", "Relaxed",
+                 "Skinny", "Wide Leg", "Tapered"}
+    for desc in descriptores:
+        if desc in FIT_TERMS:
+            parts.append(desc.lower())
+
+    # Color
+    if color_en:
+        parts.append(color_en.lower())
+
+    # Patrón / material si está (ej: striped, denim, floral)
+    PATTERN_MATERIAL = {"Denim","Leather","Silk","Cotton","Wool","Linen","Velvet",
+                        "Plaid","Striped","Floral","Polka Dot","Checkered",
+                        "Graphic","Print","Tie Dye","Distressed","Ripped",
+                        "Embroidered","Lace"}
+    for desc in descriptores:
+        if desc in PATTERN_MATERIAL and desc.lower() not in " ".join(parts):
+            parts.append(desc.lower())
+
+    # Prenda principal
+    if prenda_en and prenda_en != "Clothing":
+        parts.append(prenda_en.lower())
+
+    # Estilo (solo si aporta especificidad)
+    if estilo_en and estilo_en not in ("Casual", "Unknown", ""):
+        parts.append(estilo_en.lower())
+
+    # Detalles extra (cuello, manga, etc.) — máx 1
+    DETAIL_TERMS = {"Long Sleeve","Short Sleeve","Sleeveless","V-Neck",
+                    "Crew Neck","Turtleneck","Hood","High Waist"}
+    for desc in descriptores:
+        if desc in DETAIL_TERMS:
+            parts.append(desc.lower())
+            break
+
+    # Género
+    parts.append("men" if genero == "hombre" else "women")
+
+    # Intención de compra
+    parts.append("shop")
+
+    return " ".join(parts)
+
+
+def _build_broad_query(prenda_en, color_en, genero):
+    """
+    Query más amplia como segunda búsqueda.
+    Ej: "black hoodie men online"
+    """
+    parts = []
+    if color_en:
+        parts.append(color_en.lower())
+    if prenda_en and prenda_en != "Clothing":
+        parts.append(prenda_en.lower())
+    parts.append("men" if genero == "hombre" else "women")
+    parts.append("online")
+    return " ".join(parts)
+
+
+def _build_style_query(prenda_en, estilo_en, genero):
+    """
+    Query por estilo/prenda pura sin color — tercer nivel de variedad.
+    Ej: "streetwear hoodie men buy"
+    """
+    parts = []
+    if estilo_en and estilo_en not in ("Casual", "Unknown", ""):
+        parts.append(estilo_en.lower())
+    if prenda_en and prenda_en != "Clothing":
+        parts.append(prenda_en.lower())
+    parts.append("men" if genero == "hombre" else "women")
+    parts.append("buy")
+    return " ".join(parts)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# SerpAPI — doble búsqueda
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _score_item(item: dict) -> float:
+    """
+    Score de calidad para ordenar tiendas: imagen > precio > rating > reviews.
+    Se calcula sobre el item crudo de SerpAPI, antes de convertirlo.
+    """
+    get    = item.get
+    score  = 5.0 if get("thumbnail") else 0.0
+    precio = get("extracted_price", 0)
+    if type(precio) is float or type(precio) is int:   # el caso normal, sin pasar por _extraer_precio
+        if round(precio, 2) > 0:                      score += 3.0
+    elif _extraer_precio(precio) > 0:                  score += 3.0
+    rating = get("rating")
+    if rating:                                         score += float(rating) * 1.5
+    reviews = get("reviews")
+    if reviews:                                        score += min(float(reviews) / 100, 3.0)
+    return score
+
+
+class _MotorRanking:
+    """
+    Merge de N streams de items crudos en un solo pase: cap por fuente y
+    dedup a medida que llegan, top-k en un heap acotado sobre el score
+    precalculado y conversión al formato del frontend solo de los ganadores.
+    A igual score gana el que llegó primero (el orden de un sort estable).
+    El scorer es enchufable: recibe el item crudo y retorna un número.
+    """
+
+    def __init__(self, k: int = 18, cap_fuente: int = 3, scorer=_score_item):
+        self.k          = k
+        self.cap_fuente = cap_fuente
+        self.scorer     = scorer
+        self.aceptados  = 0     # items que pasaron cap y dedup (entren o no al top-k)
+        self._heap      = []    # (score, -seq, item): el peor queda en la raíz
+        self._por_fuente = {}
+        self._vistos    = set()
+
+    def agregar(self, items: list) -> "_MotorRanking":
+        heap, k, scorer = self._heap, self.k, self.scorer
+        por_fuente, vistos, cap = self._por_fuente, self._vistos, self.cap_fuente
+        seq = self.aceptados
+        for item in items:
+            fuente = item.get("source", "")
+            n = por_fuente.get(fuente, 0)
+            if n >= cap:
+                continue
+            # Como antes: un duplicado también consume cupo de su fuente
+            por_fuente[fuente] = n + 1
+            clave = (fuente, item.get("title", "")[:40])
+            if clave in vistos:
+                continue
+            vistos.add(clave)
+            seq += 1
+            score = scorer(item)
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -seq, item))
+            elif score > heap[0][0]:   # a igual score gana el que ya estaba (llegó antes)
+                heapq.heapreplace(heap, (score, -seq, item))
+        self.aceptados = seq
+        return self
+
+    def resultado(self) -> list:
+        # (score, -seq) desc = score desc y, a igual score, orden de llegada
+        return [_item_to_tienda(item) for _, _, item in sorted(self._heap, reverse=True)]
+
+
+VARIANTE_MIN_TIENDAS = 12   # con menos tiendas únicas tras principal + amplia se pide la variante
+
+
+def _falta_variante(deteccion: dict, plan, resultados_serp: "_ResultadosBusqueda") -> bool:
+    """
+    True si el merge de la prenda va a pedir la variante perezosa y todavía
+    no está en `resultados_serp` (ni venció).
+    """
+    query_variante = deteccion["query_variante"]
+    if deteccion["es_outfit"] or not SERPAPI_KEY or not query_variante:
+        return False
+    if query_variante in resultados_serp or query_variante in resultados_serp.pendientes:
+        return False
+    if _items_indice(deteccion, plan, resultados_serp) is not None:
+        return False
+    motor = _MotorRanking()
+    motor.agregar(resultados_serp.get(deteccion["query_principal"], []))
+    motor.agregar(resultados_serp.get(deteccion["query_amplia"], []))
+    return motor.aceptados < VARIANTE_MIN_TIENDAS
+
+
+def _buscar_serpapi_doble(query_principal: str, query_amplia: str, prenda_es: str,
+                          query_variante: str = "", resultados: dict = None,
+                          scorer=_score_item) -> list:
+    """
+    Hace hasta 3 búsquedas en Google Shopping:
+    1. Query específica (siempre)
+    2. Query amplia (siempre)
+    3. Query de estilo/variante (solo si < 12 resultados únicos tras 1+2)
+    Aplica cap de 3 productos por fuente, ordena por calidad y retorna hasta 18.
+    `resultados` trae las queries ya resueltas por la etapa paralela.
+    """
+    if not SERPAPI_KEY:
+        return _tiendas_fallback(prenda_es)
+
+    motor = _MotorRanking(scorer=scorer)
+    motor.agregar(_resultados_query(query_principal, resultados))
+    motor.agregar(_resultados_query(query_amplia, resultados, "amplia"))
+    # Tercera query de variante si hay pocas opciones diversas
+    if motor.aceptados < VARIANTE_MIN_TIENDAS and query_variante:
+        motor.agregar(_resultados_query(query_variante, resultados, "variante"))
+    return motor.resultado() or _tiendas_fallback(prenda_es)
+
+
+def _buscar_serpapi_simple(query: str, prenda_es: str, resultados: dict = None,
+                           scorer=_score_item) -> list:
+    """Un solo fetch para outfit mode — source-capped, quality-sorted."""
+    if not SERPAPI_KEY:
+        return _tiendas_fallback(prenda_es)
+    motor = _MotorRanking(scorer=scorer).agregar(_resultados_query(query, resultados))
+    return motor.resultado() or _tiendas_fallback(prenda_es)
+
+
+def _resultados_query(query: str, resultados: dict = None, prioridad: str = "principal") -> list:
+    """
+    Items de una query: los ya pedidos en paralelo, o un fetch directo
+    (acotado por el deadline de la búsqueda si lo hay).
+    """
+    if resultados is not None and query in resultados:
+        return resultados[query]
+    if isinstance(resultados, _ResultadosBusqueda):
+        if query in resultados.pendientes:
+            return []
+        _fetch_serpapi_paralelo([query], resultados.deadline, resultados, {query: prioridad})
+        return resultados.get(query, [])
+    return _fetch_serpapi(query, prioridad=prioridad)
+
+
+class _ResultadosBusqueda(dict):
+    """
+    {query: items} de la etapa de búsqueda, más el deadline que la acota,
+    las queries que no llegaron a tiempo (sus tiendas quedan "parciales") y
+    los items que el índice sirvió por prenda. Estos van aparte: el dict es
+    compartido por el lote y otra imagen con la misma query puede no estar
+    en el índice. `pedidas` cuenta las queries que pidió cada detección,
+    con las repetidas entre detecciones.
+    """
+
+    def __init__(self, deadline: float = None):
+        super().__init__()
+        self.deadline   = deadline
+        self.pendientes = set()
+        self.indice     = {}   # _clave_indice(deteccion, plan) → items
+        self.pedidas    = 0
+
+
+def _deadline_busqueda(context) -> float:
+    """Instante (time.monotonic) en que la búsqueda debe cortar para no caer en timeout."""
+    restante_ms = API_GATEWAY_TIMEOUT_MS
+    traza = _traza
+    if traza is not None:
+        restante_ms -= (time.perf_counter() - traza.inicio) * 1000
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        restante_ms = min(restante_ms, context.get_remaining_time_in_millis())
+    return time.monotonic() + max(restante_ms - BUSQUEDA_MARGEN_MS, 0) / 1000
+
+
+_latencias_serpapi = deque(maxlen=200)   # ms de las últimas llamadas remotas exitosas
+_latencias_lock    = threading.Lock()
+
+
+def _registrar_latencia_serpapi(ms: float):
+    with _latencias_lock:
+        _latencias_serpapi.append(ms)
+
+
+def _umbral_hedge() -> float:
+    """Segundos tras los cuales una query se considera rezagada (percentil de las recientes)."""
+    with _latencias_lock:
+        muestras = sorted(_latencias_serpapi)
+    if len(muestras) < HEDGE_MIN_MUESTRAS:
+        return HEDGE_INICIAL_MS / 1000
+    return muestras[min(len(muestras) - 1, int(len(muestras) * HEDGE_PERCENTIL / 100))] / 1000
+
+
+@_trazado("busqueda")
+def _fetch_serpapi_paralelo(queries: list, deadline: float = None,
+                            resultados: _ResultadosBusqueda = None,
+                            prioridades: dict = None) -> _ResultadosBusqueda:
+    """
+    Versión síncrona de _buscar_queries, para quien no corre dentro del
+    pipeline asíncrono (la variante perezosa al armar la respuesta).
+    """
+    if resultados is None:
+        resultados = _ResultadosBusqueda(deadline)
+    unicas = [q for q in dict.fromkeys(q for q in queries if q) if q not in resultados]
+    if deadline is None and len(unicas) == 1:
+        q = unicas[0]
+        resultados.pedidas += 1
+        resultados[q] = _fetch_serpapi(q, prioridad=(prioridades or {}).get(q, "principal"))
+    elif unicas:
+        import asyncio
+        asyncio.run(_buscar_queries(unicas, resultados, prioridades=prioridades))
+    return resultados
+
+
+async def _buscar_queries(queries: list, resultados: _ResultadosBusqueda, en_vuelo: dict = None,
+                         prioridades: dict = None):
+    """
+    Lanza todas las queries a la vez (máx _LIMITES["serpapi"] simultáneas)
+    y deja sus items en `resultados`. Las repetidas se piden una sola vez,
+    también entre llamadas que comparten `en_vuelo` (las prendas de un lote).
+    El merge lo hace quien consume el dict en su propio orden, así que el
+    resultado es el mismo que en secuencial y la latencia es la de la query
+    más lenta.
+
+    Al vencer el deadline de `resultados` las tareas que faltan se cancelan
+    (las que no arrancaron no llegan a SerpAPI; las que ya corren terminan
+    en background y dejan su resultado en el cache) y sus queries quedan en
+    `pendientes`.
+
+    `prioridades` ({query: principal | amplia | variante}, principal si
+    falta) ordena las llamadas y decide cuáles gastan cuota cuando queda poca.
+    """
+    import asyncio
+
+    deadline    = resultados.deadline
+    prioridades = prioridades or {}
+    pedidas     = list(dict.fromkeys(q for q in queries if q))
+    resultados.pedidas += len(pedidas)
+    unicas = [q for q in pedidas if q not in resultados]
+    unicas.sort(key=lambda q: _PRIORIDAD_ORDEN[prioridades.get(q, "principal")])
+    if not unicas:
+        return
+    if deadline is not None and time.monotonic() >= deadline:
+        vencidas = [q for q in unicas if q not in resultados.pendientes]
+        resultados.pendientes.update(vencidas)
+        _contar("serpapi_vencidas", len(vencidas))
+        return
+
+    en_vuelo = {} if en_vuelo is None else en_vuelo
+    tareas = {}
+    for q in unicas:
+        if q not in en_vuelo:
+            en_vuelo[q] = asyncio.ensure_future(_fetch_con_hedge(q, deadline, prioridades.get(q, "principal")))
+        tareas[q] = en_vuelo[q]
+    hechas, sin_terminar = await asyncio.wait(
+        tareas.values(), timeout=None if deadline is None else max(deadline - time.monotonic(), 0),
+    )
+    for tarea in sin_terminar:
+        tarea.cancel()
+    for q, tarea in tareas.items():
+        if tarea in hechas and q not in resultados:
+            resultados[q] = tarea.result()
+
+    # Con en_vuelo compartido, otra prenda pudo haber contado ya las mismas
+    faltan = [q for q in unicas if q not in resultados and q not in resultados.pendientes]
+    if faltan:
+        resultados.pendientes.update(faltan)
+        _contar("serpapi_vencidas", len(faltan))
+        _log("WARN", "Deadline de búsqueda: %s queries sin respuesta, resultados parciales", len(faltan))
+
+
+async def _fetch_con_hedge(query: str, deadline: float = None, prioridad: str = "principal") -> list:
+    """
+    _fetch_serpapi en el pool de SerpAPI. Con deadline, si la query tarda más
+    que el umbral de hedge sale un duplicado por el pool de hedge y gana el
+    primero que vuelva. El duplicado es especulativo: gasta cuota como una
+    variante.
+    """
+    import asyncio
+
+    principal = asyncio.ensure_future(_en_upstream("serpapi", _fetch_serpapi, query, "en", "us", prioridad))
+    hedge     = None
+    try:
+        if HEDGE_PERCENTIL <= 0 or deadline is None:
+            return await principal
+        hechas, _ = await asyncio.wait({principal}, timeout=_umbral_hedge())
+        if hechas:
+            return principal.result()
+        _contar("serpapi_hedges")
+        _log("INFO", "Hedge de query rezagada: %s", query)
+        hedge = asyncio.ensure_future(_en_upstream("serpapi_hedge", _fetch_serpapi, query, "en", "us", "variante"))
+        hechas, _ = await asyncio.wait({principal, hedge}, return_when=asyncio.FIRST_COMPLETED)
+        return (principal if principal in hechas else hedge).result()
+    finally:
+        # Cancelada por el deadline, o ya hay ganador: lo que no arrancó no sale
+        principal.cancel()
+        if hedge is not None:
+            hedge.cancel()
+
+
+@_trazado("serpapi")
+def _fetch_serpapi(query: str, hl: str = "en", gl: str = "us", prioridad: str = "principal") -> list:
+    """
+    Items crudos de SerpAPI para una query, pasando primero por el cache.
+    `prioridad` (principal, amplia o variante) decide si gasta cuota cuando
+    queda poca.
+    """
+    cache = _get_serp_cache()
+    key   = _serp_cache_key(query, hl, gl)
+    cached = cache.get(key)
+    if cached is not None:
+        _log("DEBUG", "SerpAPI cache hit: %s", query)
+        return cached
+
+    # Sin cuota para esta prioridad: el caller cae al fallback
+    cuota = _get_cuota_serpapi()
+    if cuota is not None and not cuota.tomar(prioridad):
+        _contar("serpapi_descartadas")
+        _contar(f"serpapi_descartadas_{prioridad}")
+        _log("INFO", "Sin cuota SerpAPI para query %s: %s", prioridad, query)
+        return []
+
+    # Circuito abierto: sin esperar el timeout, el caller cae al fallback
+    circuito   = _get_circuito_serpapi()
+    generacion = circuito.permitir()
+    if generacion is None:
+        if cuota is not None:
+            cuota.devolver()
+        _contar("serpapi_cortocircuito")
+        return []
+
+    t0 = time.perf_counter()
+    results = _fetch_serpapi_remote(query, hl, gl)
+    ms = (time.perf_counter() - t0) * 1000
+    circuito.registrar(generacion, results is not None, ms)
+    if results is None:
+        return []   # los errores no se cachean
+    _registrar_latencia_serpapi(ms)
+    cache.set(key, results)
+    return results
+
+
+@_trazado("serpapi_remoto")
+def _fetch_serpapi_remote(query: str, hl: str = "en", gl: str = "us"):
+    """Llama a SerpAPI Google Shopping. Retorna los items crudos, o None si falló."""
+    from urllib.parse import urlencode
     try:
-        params = urllib.parse.urlencode({
+        ruta = "/search.json?" + urlencode({
             "engine":  "google_shopping",
             "q":       query,
-            "hl":      "en",
-            "gl":      "us",
+            "hl":      hl,
+            "gl":      gl,
             "num":     "20",
             "api_key": SERPAPI_KEY,
         })
-        url = f"https://serpapi.com/search.json?{params}"
-        print(f"[DEBUG] SerpAPI URL query: {query}")
+        _log("DEBUG", "SerpAPI URL query: %s", query)
 
-        req = urllib.request.Request(url, method="GET")
-        with urllib.request.urlopen(req, timeout=12) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
+        status, cuerpo = _get_serpapi_http().get(ruta)
+        data = json.loads(cuerpo.decode("utf-8"))
 
-        if "error" in data:
-            print(f"[WARN] SerpAPI error: {data['error']}")
-            return []
+        if status != 200 or "error" in data:
+            _log("WARN", "SerpAPI error (%s): %s", status, data.get("error", ""))
+            return None
 
         results = data.get("shopping_results", [])
-        print(f"[DEBUG] SerpAPI devolvió {len(results)} resultados para: {query}")
+        _log("DEBUG", "SerpAPI devolvió %s resultados para: %s", len(results), query)
         return results
 
     except Exception as e:
-        print(f"[WARN] Error SerpAPI: {e}")
-        return []
+        _log("WARN", "Error SerpAPI: %s", e)
+        return None
 
 
 def _item_to_tienda(item: dict) -> dict:
@@ -850,6 +2885,1004 @@ def _item_to_tienda(item: dict) -> dict:
     }
 
 
+# ─────────────────────────────────────────────────────────────────────────────
+# HTTP — pool de conexiones HTTPS keep-alive
+# ─────────────────────────────────────────────────────────────────────────────
+
+class _PoolHTTPS:
+    """
+    Conexiones keep-alive a un host, reutilizadas entre llamadas y entre
+    invocaciones warm: cada búsqueda se ahorra el connect + handshake TLS.
+    Guarda como máximo `max_libres` conexiones ociosas y descarta las que
+    llevan más de `idle_max` segundos sin uso (el servidor ya las cerró).
+    Una conexión reutilizada que resulta muerta se reintenta una vez en
+    una nueva; pide gzip y lo decodifica.
+    """
+
+    def __init__(self, host: str, max_libres: int, idle_max: float, timeout: float):
+        self.host       = host
+        self.max_libres = max_libres
+        self.idle_max   = idle_max
+        self.timeout    = timeout
+        self._libres    = deque()   # (conexión, último uso) — la más reciente al final
+        self._lock      = threading.Lock()
+        self._ssl_ctx   = None
+        self.stats      = {"nuevas": 0, "reusadas": 0, "vencidas": 0, "reintentos": 0}
+
+    def _nueva(self):
+        import http.client
+        import ssl
+        if self._ssl_ctx is None:
+            self._ssl_ctx = ssl.create_default_context()   # carga las CA una sola vez
+        with self._lock:
+            self.stats["nuevas"] += 1
+        return http.client.HTTPSConnection(self.host, timeout=self.timeout, context=self._ssl_ctx)
+
+    def _tomar(self):
+        ahora    = time.monotonic()
+        vencidas = []
+        conexion = None
+        with self._lock:
+            while self._libres:
+                candidata, ultimo_uso = self._libres.pop()
+                if ahora - ultimo_uso <= self.idle_max:
+                    conexion = candidata
+                    break
+                vencidas.append(candidata)
+            # Lo que queda debajo es todavía más viejo
+            while self._libres and ahora - self._libres[0][1] > self.idle_max:
+                vencidas.append(self._libres.popleft()[0])
+            self.stats["vencidas"] += len(vencidas)
+            if conexion is not None:
+                self.stats["reusadas"] += 1
+        for c in vencidas:
+            c.close()
+        return (conexion, True) if conexion is not None else (self._nueva(), False)
+
+    def _devolver(self, conexion):
+        with self._lock:
+            if len(self._libres) < self.max_libres:
+                self._libres.append((conexion, time.monotonic()))
+                return
+        conexion.close()
+
+    def get(self, ruta: str, headers: dict = None):
+        """GET idempotente. Retorna (status, cuerpo ya descomprimido)."""
+        import http.client
+        headers = {"Accept-Encoding": "gzip", "Connection": "keep-alive", **(headers or {})}
+        for intento in (1, 2):
+            conexion, reusada = self._tomar()
+            try:
+                conexion.request("GET", ruta, headers=headers)
+                resp   = conexion.getresponse()
+                cuerpo = resp.read()
+            except (http.client.HTTPException, OSError) as e:
+                conexion.close()
+                # Timeout real: no se reintenta (duplicaría la espera)
+                if reusada and intento == 1 and not isinstance(e, TimeoutError):
+                    with self._lock:
+                        self.stats["reintentos"] += 1
+                    continue
+                raise
+            except Exception:
+                conexion.close()
+                raise
+            if resp.will_close:
+                conexion.close()
+            else:
+                self._devolver(conexion)
+            if (resp.getheader("Content-Encoding") or "").lower() == "gzip":
+                import gzip
+                cuerpo = gzip.decompress(cuerpo)
+            return resp.status, cuerpo
+
+    def cerrar(self):
+        with self._lock:
+            libres, self._libres = list(self._libres), deque()
+        for c, _ in libres:
+            c.close()
+
+
+_serpapi_http = None
+
+
+def _get_serpapi_http() -> _PoolHTTPS:
+    global _serpapi_http
+    if _serpapi_http is None:
+        _serpapi_http = _PoolHTTPS(SERPAPI_HOST, SERPAPI_MAX_WORKERS, SERPAPI_CONEXION_IDLE, SERPAPI_TIMEOUT)
+    return _serpapi_http
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Circuit breaker — corta las llamadas a SerpAPI durante un incidente
+# ─────────────────────────────────────────────────────────────────────────────
+
+class _CircuitBreaker:
+    """
+    Cerrado → abierto → semiabierto, con estado por contenedor (sobrevive
+    entre invocaciones warm) y, opcionalmente, compartido vía un backend
+    key-value como el del cache.
+
+    Cerrado: todo pasa; cada llamada se anota en una ventana deslizante y,
+    si las fallas superan el umbral, se abre. Abierto: nada pasa hasta que
+    vence el plazo. Semiabierto: pasa una sola sonda; si responde bien y a
+    tiempo se cierra con la ventana limpia, si no vuelve a abrirse.
+
+    Cada cambio de estado (y cada sonda) abre una generación nueva.
+    `permitir()` retorna la generación en que admitió la llamada (None si la
+    rechaza) y `registrar()` ignora los resultados de generaciones viejas:
+    una llamada rezagada que salió antes de abrir no cierra el circuito.
+
+    El backend nunca se toca con el lock tomado ni desde el request: los
+    cambios de estado se publican y las aperturas remotas se releen en
+    background en el pool de S3, como la cuota.
+    """
+
+    CERRADO, ABIERTO, SEMIABIERTO = "cerrado", "abierto", "semiabierto"
+
+    def __init__(self, nombre: str, backend=None):
+        self.nombre        = nombre
+        self.backend       = backend
+        self.estado        = self.CERRADO
+        self.abierto_hasta = 0.0
+        self._ventana      = deque()   # (instante, falló)
+        self._sonda        = 0.0       # instante de la sonda en vuelo (0 = ninguna)
+        self._generacion   = 0
+        self._sync_en      = 0.0
+        self._sincronizando = False
+        self._lock         = threading.Lock()
+        self._lock_publicar = threading.Lock()   # serializa las escrituras al backend
+        self.stats = {"aperturas": 0, "rechazadas": 0, "sondas": 0}
+
+    def permitir(self):
+        """Generación en que se admite la llamada (a devolver a registrar), o None si no pasa."""
+        self._sincronizar()
+        with self._lock:
+            if self.estado == self.CERRADO:
+                return self._generacion
+            ahora = time.time()
+            if self.estado == self.ABIERTO and ahora >= self.abierto_hasta:
+                self.estado = self.SEMIABIERTO
+                self._sonda = 0.0
+            # Una sonda que nunca volvió (contenedor congelado a mitad) no bloquea para siempre
+            if self.estado == self.SEMIABIERTO and ahora - self._sonda > SERPAPI_TIMEOUT * 2:
+                self._sonda = ahora
+                self._generacion += 1   # si vuelve la sonda anterior, ya no cuenta
+                self.stats["sondas"] += 1
+                return self._generacion
+            self.stats["rechazadas"] += 1
+            return None
+
+    def registrar(self, generacion: int, ok: bool, ms: float):
+        fallo = not ok or ms > CIRCUITO_LENTA_MS
+        with self._lock:
+            cambio = self._registrar(generacion, fallo)
+        if cambio:
+            self._publicar()
+
+    def _registrar(self, generacion: int, fallo: bool) -> bool:
+        """Anota el resultado (con el lock tomado). True si cambió el estado."""
+        if generacion != self._generacion:
+            return False   # admitida antes del último cambio de estado
+        if self.estado == self.SEMIABIERTO:
+            # Respuesta de la sonda
+            if fallo:
+                self._abrir()
+            else:
+                self._cerrar()
+            return True
+        if self.estado != self.CERRADO:
+            return False
+        ahora = time.time()
+        self._ventana.append((ahora, fallo))
+        while self._ventana and self._ventana[0][0] < ahora - CIRCUITO_VENTANA_S:
+            self._ventana.popleft()
+        if len(self._ventana) >= CIRCUITO_MIN_LLAMADAS:
+            fallas = sum(1 for _, f in self._ventana if f)
+            if fallas / len(self._ventana) >= CIRCUITO_UMBRAL:
+                self._abrir()
+                return True
+        return False
+
+    def _abrir(self):
+        self.estado        = self.ABIERTO
+        self.abierto_hasta = time.time() + CIRCUITO_ABIERTO_S
+        self._sonda        = 0.0
+        self._generacion  += 1
+        self._ventana.clear()
+        self.stats["aperturas"] += 1
+        _log("WARN", "Circuito %s abierto por %ss", self.nombre, CIRCUITO_ABIERTO_S)
+
+    def _cerrar(self):
+        self.estado = self.CERRADO
+        self._sonda = 0.0
+        self._generacion += 1
+        self._ventana.clear()
+        _log("INFO", "Circuito %s cerrado", self.nombre)
+
+    def _publicar(self):
+        """Publica el estado en background (llamar sin el lock tomado)."""
+        if self.backend is not None:
+            _pool("s3").submit(self._publicar_ahora)
+
+    def _publicar_ahora(self):
+        # El estado se lee al escribir: si dos cambios se adelantan, gana el último
+        with self._lock_publicar:
+            with self._lock:
+                estado = {"estado": self.estado, "hasta": self.abierto_hasta}
+            try:
+                self.backend.put(self.nombre, json.dumps(estado).encode("utf-8"))
+            except Exception as e:
+                _log("WARN", "Circuito %s: no se pudo publicar el estado: %s", self.nombre, e)
+
+    def _sincronizar(self):
+        """Relee el estado compartido en background, a lo sumo cada CIRCUITO_SYNC_S."""
+        if self.backend is None or self.estado != self.CERRADO or time.monotonic() < self._sync_en:
+            return
+        with self._lock:
+            if self._sincronizando or time.monotonic() < self._sync_en:
+                return
+            self._sincronizando = True
+            self._sync_en = time.monotonic() + CIRCUITO_SYNC_S
+        _pool("s3").submit(self._sincronizar_ahora)
+
+    def _sincronizar_ahora(self):
+        """Adopta una apertura publicada por otro contenedor."""
+        try:
+            remoto = json.loads(self.backend.get(self.nombre) or b"{}")
+            with self._lock:
+                self._sincronizando = False
+                if (self.estado == self.CERRADO and remoto.get("estado") == self.ABIERTO
+                        and remoto.get("hasta", 0) > time.time()):
+                    self.estado        = self.ABIERTO
+                    self.abierto_hasta = remoto["hasta"]
+                    self._generacion  += 1
+                    _log("WARN", "Circuito %s abierto por otro contenedor", self.nombre)
+        except Exception as e:
+            self._sincronizando = False
+            _log("WARN", "Circuito %s: no se pudo leer el estado compartido: %s", self.nombre, e)
+
+
+_circuito_serpapi = None
+
+
+def _get_circuito_serpapi() -> _CircuitBreaker:
+    global _circuito_serpapi
+    if _circuito_serpapi is None:
+        backend = None
+        if CIRCUITO_COMPARTIDO == "s3" and BUCKET_NAME:
+            backend = _S3KVBackend(BUCKET_NAME, "cache/circuito/")
+        elif CIRCUITO_COMPARTIDO == "memoria":
+            backend = _MemoryKVBackend()
+        _circuito_serpapi = _CircuitBreaker("serpapi", backend)
+    return _circuito_serpapi
+
+
+class _TokenBucket:
+    """
+    Token bucket con prioridades, con balance por contenedor (sobrevive
+    entre invocaciones warm) y, opcionalmente, compartido vía un backend
+    key-value como el del cache.
+
+    Cada token es una llamada remota. Una prioridad pasa solo si, después de
+    gastar el token, queda por encima de su reserva (CUOTA_RESERVA × capacidad):
+    con el bucket bajo se descartan primero las variantes, después las
+    amplias. Con backend, cada CUOTA_SYNC_S se descuenta del balance común lo
+    gastado acá y se adopta el resultado. El backend no es atómico: dos
+    contenedores que sincronizan a la vez pueden pisarse y gastar de más, a lo
+    sumo lo de un intervalo.
+    """
+
+    def __init__(self, nombre: str, por_minuto: float, capacidad: float, backend=None):
+        self.nombre      = nombre
+        self.tasa        = por_minuto / 60
+        self.capacidad   = capacidad
+        self.backend     = backend
+        self.tokens      = capacidad
+        self.actualizado = time.time()
+        self._gastados   = 0      # tokens tomados desde la última sincronización
+        self._sync_en    = 0.0
+        self._sincronizando = False
+        self._lock       = threading.Lock()
+        self.stats = {"tomados": 0, "descartados": 0}
+
+    def tomar(self, prioridad: str = "principal") -> bool:
+        self._sincronizar()
+        with self._lock:
+            ahora = time.time()
+            self.tokens = min(self.capacidad, self.tokens + (ahora - self.actualizado) * self.tasa)
+            self.actualizado = ahora
+            permitido = self.tokens - 1 >= CUOTA_RESERVA[prioridad] * self.capacidad
+            if permitido:
+                self.tokens    -= 1
+                self._gastados += 1
+                self.stats["tomados"] += 1
+            else:
+                self.stats["descartados"] += 1
+            disponibles = self.tokens
+        _medir(f"{self.nombre}_cuota", round(max(disponibles, 0.0), 1))
+        return permitido
+
+    def devolver(self):
+        """Reintegra un token tomado para una llamada que al final no salió."""
+        with self._lock:
+            self.tokens    += 1
+            self._gastados -= 1
+            self.stats["tomados"] -= 1
+
+    def _sincronizar(self):
+        """Lanza la sincronización con el backend en background, a lo sumo cada CUOTA_SYNC_S."""
+        if self.backend is None or self._sincronizando or time.monotonic() < self._sync_en:
+            return
+        with self._lock:
+            if self._sincronizando or time.monotonic() < self._sync_en:
+                return   # otro thread la lanzó entre el chequeo y el lock
+            self._sincronizando = True
+            self._sync_en = time.monotonic() + CUOTA_SYNC_S
+        _pool("s3").submit(self._sincronizar_ahora)
+
+    def _sincronizar_ahora(self):
+        try:
+            with self._lock:
+                gastados, self._gastados = self._gastados, 0
+            try:
+                remoto = json.loads(self.backend.get(self.nombre) or b"{}")
+            except ValueError:
+                remoto = {}
+            ahora = time.time()
+            if "tokens" in remoto:
+                tokens = min(self.capacidad,
+                             remoto["tokens"] + (ahora - remoto.get("t", ahora)) * self.tasa)
+            else:
+                tokens = self.capacidad   # primer contenedor: bucket lleno
+            # Negativo = deuda de lo que otros gastaron de más; se paga recargando
+            tokens = max(tokens - gastados, -self.capacidad)
+            try:
+                self.backend.put(self.nombre, json.dumps({"tokens": tokens, "t": ahora}).encode("utf-8"))
+            except Exception as e:
+                _log("WARN", "Cuota %s: no se pudo publicar el balance: %s", self.nombre, e)
+            with self._lock:
+                # Lo tomado mientras se sincronizaba sigue en _gastados para la próxima
+                self.tokens      = tokens - self._gastados
+                self.actualizado = ahora
+        except Exception as e:
+            _log("WARN", "Cuota %s: no se pudo sincronizar: %s", self.nombre, e)
+        finally:
+            self._sincronizando = False
+
+
+_cuota_serpapi = None
+
+
+def _get_cuota_serpapi():
+    """Token bucket de SerpAPI, o None si SERPAPI_CUOTA_POR_MIN no está configurado."""
+    global _cuota_serpapi
+    if _cuota_serpapi is None and SERPAPI_CUOTA_POR_MIN > 0:
+        backend = None
+        if CUOTA_COMPARTIDA == "s3" and BUCKET_NAME:
+            backend = _S3KVBackend(BUCKET_NAME, "cache/cuota/")
+        elif CUOTA_COMPARTIDA == "memoria":
+            backend = _MemoryKVBackend()
+        _cuota_serpapi = _TokenBucket("serpapi", SERPAPI_CUOTA_POR_MIN, SERPAPI_CUOTA_RAFAGA, backend)
+    return _cuota_serpapi
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Cache por niveles (memoria → /tmp → compartido)
+# ─────────────────────────────────────────────────────────────────────────────
+
+class _MemoryTier:
+    """LRU en proceso con TTL por entrada. Sobrevive entre invocaciones warm."""
+
+    nombre = "memoria"
+    local  = True
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data   = OrderedDict()   # key → (expira, valor)
+        self._lock   = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value, ttl: int):
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+
+class _DiskTier:
+    """Un JSON por entrada en /tmp. Escritura atómica, evicción por antigüedad."""
+
+    nombre = "disco"
+    local  = True
+
+    def __init__(self, directorio: str, max_entries: int):
+        self.directorio  = directorio
+        self.max_entries = max_entries
+        self._count      = None   # se calcula perezosamente al primer set
+        self._lock       = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directorio, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key: str):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if entry.get("expira", 0) < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry.get("valor")
+
+    def set(self, key: str, value, ttl: int):
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            path = self._path(key)
+            tmp  = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"expira": time.time() + ttl, "valor": value}, f, ensure_ascii=False)
+            existed = os.path.exists(path)
+            os.replace(tmp, path)
+            with self._lock:
+                if self._count is None:
+                    self._count = sum(1 for n in os.listdir(self.directorio) if n.endswith(".json"))
+                elif not existed:
+                    self._count += 1
+                if self._count > self.max_entries:
+                    self._evict()
+        except OSError as e:
+            _log("WARN", "Cache disco: %s", e)
+
+    def _evict(self):
+        """Borra el 10% más antiguo (por mtime) al superar el máximo."""
+        entries = []
+        for d in os.scandir(self.directorio):
+            if d.name.endswith(".json"):
+                entries.append((d.stat().st_mtime, d.path))
+        entries.sort()
+        sobrantes = len(entries) - int(self.max_entries * 0.9)
+        for _, path in entries[:max(sobrantes, 0)]:
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except OSError:
+                pass
+        self._count = len(entries) - max(sobrantes, 0)
+
+
+class _MemoryKVBackend:
+    """Key-value en memoria con la misma interfaz que el backend S3 — stand-in local para tests."""
+
+    def __init__(self, max_entries: int = 10000):
+        self._inner = _MemoryTier(max_entries)
+
+    def get(self, key: str):
+        return self._inner.get(key)
+
+    def put(self, key: str, data: bytes):
+        self._inner.set(key, data, 10 ** 9)
+
+
+class _S3KVBackend:
+    """Key-value sobre S3: un objeto por clave bajo un prefijo del bucket."""
+
+    def __init__(self, bucket: str, prefix: str):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, key: str):
+        try:
+            obj = _s3().get_object(Bucket=self.bucket, Key=self.prefix + key)
+            return obj["Body"].read()
+        except Exception:
+            return None
+
+    def put(self, key: str, data: bytes):
+        _s3().put_object(
+            Bucket=self.bucket, Key=self.prefix + key,
+            Body=data, ContentType="application/json",
+        )
+
+
+class _SharedTier:
+    """Tier compartido entre contenedores sobre un backend key-value enchufable."""
+
+    nombre = "compartido"
+    local  = False   # lo que se escribe acá lo leen todos los contenedores
+
+    def __init__(self, backend, max_bytes: int):
+        self.backend   = backend
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: str):
+        raw = self.backend.get(hashlib.sha1(key.encode("utf-8")).hexdigest())
+        if raw is None:
+            self.misses += 1
+            return None
+        try:
+            entry = json.loads(raw)
+        except ValueError:
+            self.misses += 1
+            return None
+        if entry.get("expira", 0) < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry.get("valor")
+
+    def set(self, key: str, value, ttl: int):
+        data = json.dumps({"expira": time.time() + ttl, "valor": value}, ensure_ascii=False).encode("utf-8")
+        # Entradas demasiado grandes no se comparten (el tamaño total lo acota
+        # la lifecycle rule del prefijo en S3)
+        if len(data) > self.max_bytes:
+            self.evictions += 1
+            return
+        try:
+            self.backend.put(hashlib.sha1(key.encode("utf-8")).hexdigest(), data)
+        except Exception as e:
+            _log("WARN", "Cache compartido: %s", e)
+
+
+# Formato del snapshot: cabecera, tabla hash de slots (sondeo lineal, tamaño
+# potencia de 2) y blobs zlib con {"k": clave, "v": items}. Cambiar el
+# formato exige subir SNAPSHOT_FORMATO: la key en S3 lo incluye.
+SNAPSHOT_FORMATO   = 1
+SNAPSHOT_MAGIC     = b"SMPC"
+SNAPSHOT_CABECERA  = struct.Struct("<4sB3xdII")   # magic, formato, generado (epoch), entradas, slots
+SNAPSHOT_SLOT      = struct.Struct("<QII")        # hash de la clave (0 = vacío), offset, largo
+
+
+def _snapshot_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") | 1
+
+
+def _snapshot_s3_key() -> str:
+    return f"precarga/v{SNAPSHOT_FORMATO}.bin"
+
+
+class _SnapshotTier:
+    """
+    Tier de solo lectura sobre el snapshot de precarga. Se mapea en memoria
+    al primer get y solo se descomprime el blob pedido. Si hay que bajarlo
+    de S3, la descarga corre en background y mientras tanto el tier falla
+    (miss) en vez de bloquear el request.
+    """
+
+    nombre = "snapshot"
+    local  = True
+
+    def __init__(self, path: str, desde_s3: bool = False):
+        self.path     = path
+        self.desde_s3 = desde_s3
+        self._mm      = None    # None = sin abrir, False = no disponible en este contenedor
+        self._slots   = 0
+        self._generado = 0.0
+        self._bajando = False
+        self._lock    = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: str):
+        mm = self._mapa()
+        if not mm:
+            self.misses += 1
+            return None
+        h, mascara = _snapshot_hash(key), self._slots - 1
+        i = h & mascara
+        while True:
+            slot_h, offset, largo = SNAPSHOT_SLOT.unpack_from(mm, SNAPSHOT_CABECERA.size + i * SNAPSHOT_SLOT.size)
+            if slot_h == 0:
+                self.misses += 1
+                return None
+            if slot_h == h:
+                entrada = json.loads(zlib.decompress(mm[offset:offset + largo]))
+                if entrada["k"] == key:
+                    self.hits += 1
+                    return entrada["v"]
+            i = (i + 1) & mascara
+
+    def set(self, key: str, value, ttl: int):
+        pass   # lo escribe solo precargar.py
+
+    def vigencia(self) -> float:
+        """Segundos que le quedan al snapshot antes de PRECARGA_MAX_EDAD."""
+        return self._generado + PRECARGA_MAX_EDAD - time.time()
+
+    def _mapa(self):
+        if self._mm is not None:
+            return self._mm
+        with self._lock:
+            if self._mm is not None:
+                return self._mm
+            if os.path.exists(self.path):
+                self._mm = self._abrir()
+            elif self.desde_s3 and BUCKET_NAME and not self._bajando:
+                self._bajando = True
+                threading.Thread(target=self._descargar, name="precarga", daemon=True).start()
+            elif not self.desde_s3:
+                self._mm = False
+        return self._mm
+
+    def _abrir(self):
+        import mmap
+        try:
+            with open(self.path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, formato, generado, entradas, slots = SNAPSHOT_CABECERA.unpack_from(mm, 0)
+        except (OSError, ValueError, struct.error) as e:
+            _log("WARN", "Snapshot de precarga ilegible: %s", e)
+            return False
+        if magic != SNAPSHOT_MAGIC or formato != SNAPSHOT_FORMATO or slots & (slots - 1):
+            _log("WARN", "Snapshot de precarga con formato %s, se esperaba %s", formato, SNAPSHOT_FORMATO)
+            return False
+        if time.time() - generado > PRECARGA_MAX_EDAD:
+            _log("WARN", "Snapshot de precarga de hace %.1f días: se ignora", (time.time() - generado) / 86400)
+            return False
+        self._slots    = slots
+        self._generado = generado
+        _log("INFO", "Snapshot de precarga: %s queries", entradas)
+        return mm
+
+    def _descargar(self):
+        try:
+            obj = _s3().get_object(Bucket=BUCKET_NAME, Key=_snapshot_s3_key())
+            tmp = f"{self.path}.descarga"
+            with open(tmp, "wb") as f:
+                for bloque in iter(lambda: obj["Body"].read(1 << 20), b""):
+                    f.write(bloque)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            _log("WARN", "Snapshot de precarga no disponible: %s", e)
+            self._mm = False
+        finally:
+            self._bajando = False
+
+
+class _TieredCache:
+    """
+    Consulta los tiers en orden y rellena los superiores al encontrar un hit.
+    Un hit del snapshot no es un resultado nuevo: rellena solo los tiers
+    locales y con la vigencia que le queda, nunca el compartido (lo
+    republicaría como fresco para todos, con un PUT en el request).
+    """
+
+    def __init__(self, tiers: list, ttl: int):
+        self.tiers = tiers
+        self.ttl   = ttl
+
+    def get(self, key: str):
+        for i, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                if tier.nombre == "snapshot":
+                    ttl      = min(self.ttl, tier.vigencia())
+                    rellenar = [t for t in self.tiers[:i] if t.local] if ttl > 0 else []
+                else:
+                    ttl, rellenar = self.ttl, self.tiers[:i]
+                for upper in rellenar:
+                    upper.set(key, value, ttl)
+                return value
+        return None
+
+    def set(self, key: str, value, ttl: int = None):
+        for tier in self.tiers:
+            tier.set(key, value, ttl or self.ttl)
+
+    def stats(self) -> dict:
+        return {
+            t.nombre: {"hits": t.hits, "misses": t.misses, "evictions": t.evictions}
+            for t in self.tiers
+        }
+
+
+def _build_cache(subdir: str, shared_backend=None, ttl: int = None, snapshot=None) -> _TieredCache:
+    """
+    Arma la cadena de tiers. `shared_backend` permite inyectar un stand-in;
+    `snapshot` (solo lectura, local) va al final: puede tener días, y un
+    resultado más nuevo en cualquier otro tier tiene que ganarle.
+    """
+    tiers = [_MemoryTier(SERPAPI_CACHE_MAX)]
+    tiers.append(_DiskTier(os.path.join(SERPAPI_CACHE_DIR, subdir), SERPAPI_CACHE_DISK_MAX))
+    if shared_backend is None and CACHE_SHARED_BACKEND == "s3" and BUCKET_NAME:
+        shared_backend = _S3KVBackend(BUCKET_NAME, f"cache/{subdir}/")
+    elif shared_backend is None and CACHE_SHARED_BACKEND == "memoria":
+        shared_backend = _MemoryKVBackend()
+    if shared_backend is not None:
+        tiers.append(_SharedTier(shared_backend, CACHE_SHARED_MAX_BYTES))
+    if snapshot is not None:
+        tiers.append(snapshot)
+    return _TieredCache(tiers, ttl or SERPAPI_CACHE_TTL)
+
+
+_serp_cache = None
+
+
+def _get_serp_cache() -> _TieredCache:
+    global _serp_cache
+    if _serp_cache is None:
+        snapshot = None
+        if PRECARGA_S3 or os.path.exists(PRECARGA_PATH):
+            snapshot = _SnapshotTier(PRECARGA_PATH, PRECARGA_S3)
+        _serp_cache = _build_cache("serpapi", snapshot=snapshot)
+    return _serp_cache
+
+
+def _serp_cache_key(query: str, hl: str, gl: str) -> str:
+    """Clave normalizada: minúsculas, espacios colapsados, más idioma/país."""
+    return f"{' '.join(query.lower().split())}|{hl}|{gl}"
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Índice local de productos — SQLite (FTS5 si está disponible) en /tmp
+# ─────────────────────────────────────────────────────────────────────────────
+
+class _IndiceProductos:
+    """
+    Items de SerpAPI por combinación género × prenda × color, con la query
+    que trajo cada uno. Una tabla normal indexada por combinación y, si el
+    SQLite del runtime trae FTS5, un índice full-text sobre título, fuente y
+    query que ordena los items de la combinación por relevancia contra la
+    query concreta del request. Sin FTS5 se sirven en orden de llegada.
+    """
+
+    def __init__(self, path: str):
+        import sqlite3   # solo si el índice se usa
+        self.path = path
+        self._db  = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()   # una conexión compartida: request y thread de escritura
+        self.escrituras = 0
+        self._db.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS combinaciones (
+                clave TEXT PRIMARY KEY, genero TEXT, prenda TEXT, color TEXT, actualizado REAL
+            );
+            CREATE TABLE IF NOT EXISTS productos (
+                id INTEGER PRIMARY KEY, clave TEXT NOT NULL, query TEXT,
+                fuente TEXT, titulo TEXT, precio REAL, rating REAL, thumbnail TEXT, item TEXT
+            );
+            CREATE INDEX IF NOT EXISTS productos_clave ON productos(clave);
+        """)
+        try:
+            self._db.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS productos_fts USING fts5(
+                    titulo, fuente, query, content='productos', content_rowid='id'
+                );
+                CREATE TRIGGER IF NOT EXISTS productos_ai AFTER INSERT ON productos BEGIN
+                    INSERT INTO productos_fts(rowid, titulo, fuente, query)
+                    VALUES (new.id, new.titulo, new.fuente, new.query);
+                END;
+                CREATE TRIGGER IF NOT EXISTS productos_ad AFTER DELETE ON productos BEGIN
+                    INSERT INTO productos_fts(productos_fts, rowid, titulo, fuente, query)
+                    VALUES ('delete', old.id, old.titulo, old.fuente, old.query);
+                END;
+            """)
+            self.fts = True
+        except sqlite3.OperationalError as e:
+            _log("WARN", "Índice sin FTS5 (%s): orden de llegada", e)
+            self.fts = False
+
+    @staticmethod
+    def clave(genero: str, prenda_en: str, color_en: str) -> str:
+        return f"{genero}|{prenda_en.lower()}|{color_en.lower()}"
+
+    def buscar(self, clave: str, texto: str = ""):
+        """(items crudos, edad en segundos) de la combinación, o (None, None) si no está."""
+        terminos = " OR ".join(f'"{t}"' for t in dict.fromkeys(re.findall(r"\w+", texto.lower())))
+        with self._lock:
+            fila = self._db.execute(
+                "SELECT actualizado FROM combinaciones WHERE clave = ?", (clave,)).fetchone()
+            if fila is None:
+                return None, None
+            if self.fts and terminos:
+                filas = self._db.execute("""
+                    SELECT p.item FROM productos p
+                    LEFT JOIN (SELECT rowid, bm25(productos_fts) AS r FROM productos_fts
+                               WHERE productos_fts MATCH ?) m ON m.rowid = p.id
+                    WHERE p.clave = ? ORDER BY COALESCE(m.r, 0), p.id
+                """, (terminos, clave)).fetchall()
+            else:
+                filas = self._db.execute(
+                    "SELECT item FROM productos WHERE clave = ? ORDER BY id", (clave,)).fetchall()
+        return [json.loads(f[0]) for f in filas], time.time() - fila[0]
+
+    def guardar(self, clave: str, genero: str, prenda_en: str, color_en: str, items_por_query: list):
+        """Reemplaza los items de la combinación. `items_por_query`: [(query, [items])]."""
+        filas, vistos = [], set()
+        for query, items in items_por_query:
+            for item in items:
+                k = (item.get("source", ""), item.get("title", "")[:40])
+                if k in vistos:
+                    continue
+                vistos.add(k)
+                filas.append((
+                    clave, query, item.get("source", ""), item.get("title", ""),
+                    _extraer_precio(item.get("extracted_price", 0)), item.get("rating"),
+                    item.get("thumbnail", ""), json.dumps(item, ensure_ascii=False),
+                ))
+        if not filas:
+            return
+        with self._lock:
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.execute("DELETE FROM productos WHERE clave = ?", (clave,))
+                self._db.executemany(
+                    "INSERT INTO productos (clave, query, fuente, titulo, precio, rating, thumbnail, item)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", filas[:INDICE_ITEMS_MAX])
+                self._db.execute(
+                    "INSERT OR REPLACE INTO combinaciones VALUES (?, ?, ?, ?, ?)",
+                    (clave, genero, prenda_en, color_en, time.time()))
+            self.escrituras += 1
+
+    def exportar(self, destino: str):
+        """Copia consistente del índice (API de backup de SQLite) para subirla."""
+        import sqlite3
+        copia = sqlite3.connect(destino)
+        try:
+            with self._lock:
+                self._db.backup(copia)
+        finally:
+            copia.close()
+
+
+_indice       = None
+_indice_lock  = threading.Lock()
+_refrescando  = set()   # claves con refresco en curso, bajo _indice_lock
+
+
+def _get_indice():
+    """Índice de productos, o None si está desactivado o no se pudo abrir."""
+    global _indice
+    if not INDICE_PRODUCTOS:
+        return None
+    if _indice is None:
+        with _indice_lock:
+            if _indice is None:
+                try:
+                    if INDICE_S3_SYNC and BUCKET_NAME and not os.path.exists(INDICE_PATH):
+                        _descargar_indice()
+                    _indice = _IndiceProductos(INDICE_PATH)
+                except Exception as e:
+                    _log("WARN", "Índice de productos desactivado: %s", e)
+                    _indice = False
+    return _indice or None
+
+
+def _descargar_indice():
+    try:
+        obj = _s3().get_object(Bucket=BUCKET_NAME, Key=INDICE_S3_KEY)
+    except Exception as e:
+        _log("INFO", "Sin índice en S3 (%s): se arma desde cero", e)
+        return
+    tmp = f"{INDICE_PATH}.descarga"
+    with open(tmp, "wb") as f:
+        f.write(obj["Body"].read())
+    os.replace(tmp, INDICE_PATH)
+
+
+def _subir_indice(indice: _IndiceProductos):
+    """Última escritura gana: el índice es un cache, no la fuente de verdad."""
+    tmp = f"{INDICE_PATH}.subida"
+    try:
+        indice.exportar(tmp)
+        with open(tmp, "rb") as f:
+            _s3().put_object(Bucket=BUCKET_NAME, Key=INDICE_S3_KEY, Body=f.read(),
+                             ContentType="application/vnd.sqlite3")
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _en_indice_async(fn, *args):
+    """Escrituras y refrescos del índice en un solo thread: fuera del request y serializados."""
+    futuro = _pool("indice").submit(fn, *args)
+    futuro.add_done_callback(
+        lambda f: f.exception() and _log("WARN", "Índice de productos: %s", f.exception())
+    )
+    return futuro
+
+
+def _clave_plan(deteccion: dict, plan) -> str:
+    prenda, color_prenda, _ = plan
+    return _IndiceProductos.clave(deteccion["genero"], prenda["en"], color_prenda["en"])
+
+
+def _clave_indice(deteccion: dict, plan) -> tuple:
+    """Combinación de la prenda más la query que ordena sus items."""
+    return _clave_plan(deteccion, plan), plan[2][0]
+
+
+def _items_indice(deteccion: dict, plan, resultados: dict):
+    """Items que el índice sirvió para la prenda, o None si salió a SerpAPI."""
+    if "genero" not in deteccion:
+        return None
+    return getattr(resultados, "indice", {}).get(_clave_indice(deteccion, plan))
+
+
+def _planes_desde_indice(deteccion: dict, resultados: "_ResultadosBusqueda") -> set:
+    """Índices de los planes de la detección servidos por el índice (bloqueante: SQLite)."""
+    return {i for i, plan in enumerate(deteccion["planes"])
+            if _resultados_desde_indice(deteccion, plan, resultados)}
+
+
+@_trazado("indice")
+def _resultados_desde_indice(deteccion: dict, plan, resultados: "_ResultadosBusqueda") -> bool:
+    """
+    Si la combinación de la prenda está en el índice, deja sus items en
+    `resultados.indice` (no en las queries: ni las de esta prenda ni las de
+    otra imagen del lote que las comparta dejan de salir a SerpAPI) y
+    retorna True. Una entrada vieja se sirve igual y se refresca en
+    background.
+    """
+    indice = _get_indice()
+    if indice is None or "genero" not in deteccion:
+        return False
+    clave, query = _clave_indice(deteccion, plan)
+    items, edad = indice.buscar(clave, query)
+    if not items or edad > INDICE_MAX_EDAD:
+        return False
+    resultados.indice[clave, query] = items
+    _contar("indice_hits")
+    if edad > INDICE_TTL:
+        with _indice_lock:
+            refrescar = clave not in _refrescando
+            _refrescando.add(clave)
+        if refrescar:
+            _en_indice_async(_refrescar_plan, deteccion, plan)
+    return True
+
+
+def _refrescar_plan(deteccion: dict, plan):
+    try:
+        resultados = {q: _fetch_serpapi(q) for q in _queries_plan(deteccion, plan)}
+        _indexar_plan(deteccion, plan, resultados)
+    finally:
+        with _indice_lock:
+            _refrescando.discard(_clave_plan(deteccion, plan))
+
+
+def _indexar_plan_async(deteccion: dict, plan, resultados: dict):
+    """Indexa la prenda solo si todas sus queries respondieron (nada parcial ni vacío)."""
+    if _get_indice() is None or "genero" not in deteccion:
+        return
+    queries = [q for q in _queries_plan(deteccion, plan) if q in resultados]
+    pendientes = getattr(resultados, "pendientes", ())
+    if not queries or any(q in pendientes for q in _queries_plan(deteccion, plan)):
+        return
+    _en_indice_async(_indexar_plan, deteccion, plan, {q: resultados[q] for q in queries})
+
+
+def _indexar_plan(deteccion: dict, plan, resultados: dict):
+    indice = _get_indice()
+    prenda, color_prenda, _ = plan
+    items_por_query = [(q, resultados[q]) for q in _queries_plan(deteccion, plan) if resultados.get(q)]
+    if not items_por_query:
+        return   # sin resultados (error, circuito abierto): no se indexa el fallback
+    indice.guardar(_clave_plan(deteccion, plan), deteccion["genero"],
+                   prenda["en"], color_prenda["en"], items_por_query)
+    if INDICE_S3_SYNC and BUCKET_NAME and indice.escrituras % INDICE_SYNC_CADA == 0:
+        _subir_indice(indice)
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Helpers
 # ─────────────────────────────────────────────────────────────────────────────
@@ -867,7 +3900,8 @@ def _detectar_moneda(price_str: str) -> str:
 
 
 def _tiendas_fallback(prenda_es: str) -> list:
-    q = urllib.parse.quote(prenda_es)
+    from urllib.parse import quote
+    q = quote(prenda_es)
     fallback = [
         {"nombre": "Amazon",   "link": f"https://www.amazon.com/s?k={q}"},
         {"nombre": "ASOS",     "link": f"https://www.asos.com/search/?q={q}"},
@@ -935,14 +3969,160 @@ def _extraer_precio(precio_raw) -> float:
         return 0.0
 
 
+# Formato y encoding que pidió el request en curso (una invocación a la vez
+# por contenedor, como _traza): (compacto, "br" | "gzip" | None)
+_formato_respuesta = (False, None)
+
+
+def _decodificar_body(event: dict) -> bool:
+    """
+    Con binary_media_types = */* API Gateway entrega el body en base64; acá
+    se decodifica una sola vez para todos los handlers. False si no es
+    base64 válido o no es UTF-8 (el handler responde 400).
+    """
+    if event.get("isBase64Encoded") and event.get("body"):
+        try:
+            event["body"] = base64.b64decode(event["body"]).decode("utf-8")
+        except (binascii.Error, UnicodeDecodeError):
+            return False
+        event["isBase64Encoded"] = False
+    return True
+
+
+def _negociar_respuesta(event: dict):
+    """Lee los headers del request: formato compacto y encoding aceptado."""
+    global _formato_respuesta
+    headers  = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    compacto = headers.get("x-formato-respuesta", "").strip().lower() == "compacto"
+    aceptados = set()
+    for parte in headers.get("accept-encoding", "").split(","):
+        nombre, _, params = parte.strip().lower().partition(";")
+        if nombre and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            aceptados.add(nombre)
+    encoding = None
+    if "br" in aceptados and _brotli():
+        encoding = "br"
+    elif "gzip" in aceptados:
+        encoding = "gzip"
+    _formato_respuesta = (compacto, encoding)
+
+
+@lru_cache(maxsize=1)
+def _brotli():
+    """Módulo brotli si está en el paquete (opcional), o None."""
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        return None
+
+
 def _response(status_code: int, body: dict) -> dict:
-    return {
-        "statusCode": status_code,
-        "headers": {
-            "Content-Type":                "application/json; charset=utf-8",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods":"POST, OPTIONS",
-            "Access-Control-Allow-Headers":"Content-Type",
-        },
-        "body": json.dumps(body, ensure_ascii=False),
+    compacto, encoding = _formato_respuesta
+    headers = {
+        "Content-Type":                "application/json; charset=utf-8",
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Methods":"GET, POST, OPTIONS",
+        "Access-Control-Allow-Headers":"Content-Type, X-Formato-Respuesta",
+        "Vary":                        "Accept-Encoding, X-Formato-Respuesta",
     }
+    texto = _serializar(_compactar(body) if compacto else body, compacto)
+    if encoding and len(texto) >= COMPRIMIR_DESDE_BYTES:
+        headers["Content-Encoding"] = encoding
+        return {
+            "statusCode":      status_code,
+            "headers":         headers,
+            "body":            base64.b64encode(_comprimir(texto.encode("utf-8"), encoding)).decode("ascii"),
+            "isBase64Encoded": True,
+        }
+    return {"statusCode": status_code, "headers": headers, "body": texto}
+
+
+@_trazado("serializacion")
+def _serializar(body: dict, compacto: bool = False) -> str:
+    if compacto:
+        return json.dumps(body, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(body, ensure_ascii=False)
+
+
+@_trazado("compresion")
+def _comprimir(datos: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return _brotli().compress(datos, quality=5)
+    import gzip
+    return gzip.compress(datos, GZIP_NIVEL, mtime=0)
+
+
+# Formato compacto: lo que el frontend completa por su cuenta (mismos
+# valores que _prenda_resultado y _item_to_tienda) no viaja, los campos
+# iguales en todas las prendas van una vez en "comun" y los nulos se omiten.
+_PRENDA_COMUNES  = ("etiquetas", "descriptores", "estilo", "cuando_usar", "ocasion", "patron", "patron_en")
+_PRENDA_DEFAULTS = {"tallas_disponibles": ["XS", "S", "M", "L", "XL", "XXL"]}
+_TIENDA_DEFAULTS = {
+    "tipo":       "online",
+    "tallas":     ["XS", "S", "M", "L", "XL"],
+    "ubicacion":  "Envío internacional",
+    "disponible": True,
+}
+_SIN_DEFAULT = object()
+
+
+def _compactar(body: dict) -> dict:
+    """Versión compacta de una respuesta con prendas (/analizar, /resultados, cada item del lote)."""
+    compacto = dict(body, formato="compacto")
+    if isinstance(body.get("prendas"), list):
+        compacto.update(_compactar_prendas(body["prendas"]))
+    if isinstance(body.get("resultados"), list):
+        compacto["resultados"] = [
+            dict(r, **_compactar_prendas(r["prendas"])) if isinstance(r.get("prendas"), list) else r
+            for r in body["resultados"]
+        ]
+    return compacto
+
+
+def _compactar_prendas(prendas: list) -> dict:
+    comun = {}
+    if prendas:
+        primera = prendas[0]
+        comun = {k: primera[k] for k in _PRENDA_COMUNES
+                 if k in primera and all(p.get(k, _SIN_DEFAULT) == primera[k] for p in prendas)}
+    salida = []
+    for p in prendas:
+        compacta = {}
+        for k, v in p.items():
+            # tiendas = None significa "buscando": se conserva
+            if k in comun or (v is None and k != "tiendas") or _PRENDA_DEFAULTS.get(k, _SIN_DEFAULT) == v:
+                continue
+            compacta[k] = [_compactar_tienda(t) for t in v] if k == "tiendas" and v else v
+        salida.append(compacta)
+    resultado = {"prendas": salida}
+    if comun:
+        resultado["comun"] = {k: v for k, v in comun.items() if v is not None}
+    return resultado
+
+
+def _compactar_tienda(tienda: dict) -> dict:
+    return {k: v for k, v in tienda.items()
+            if v is not None and v != "" and _TIENDA_DEFAULTS.get(k, _SIN_DEFAULT) != v}
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Init
+# ─────────────────────────────────────────────────────────────────────────────
+
+if PRECALENTAR:
+    _s3()
+    _rekognition()
+    _get_color_lut()
+    _get_matcher_labels()
+    # Los imports pesados de los primeros usos quedan en sys.modules
+    import importlib
+    modulos = ["asyncio"]
+    if _colores_locales_disponibles():
+        modulos.append("numpy")
+    if _colores_locales_disponibles() or _phash_activo():
+        modulos.append("PIL.Image")
+    for modulo in modulos:
+        importlib.import_module(modulo)
+
+_INIT_MS = (time.perf_counter() - _T0_MODULO) * 1000
@@ -0,0 +1,175 @@
+"""
+StyleMatch — Precarga offline de búsquedas frecuentes
+
+Enumera el espacio de queries que el Lambda arma desde los catálogos:
+PRENDAS_HOMBRE / PRENDAS_MUJER × COLORES × género para _build_broad_query
+y × ESTILOS para _build_style_query. Las ordena por frecuencia observada en
+los logs, pide a SerpAPI las primeras dentro de un presupuesto de llamadas
+y de ritmo, y escribe un snapshot versionado que el Lambda consulta como
+tier del cache (mmap, lookup O(1), sin llamada a SerpAPI).
+
+Uso (desde backend/, con SERPAPI_KEY en el entorno):
+    python precargar.py --listar 30                     # ranking, sin llamadas
+    python precargar.py --max-queries 500 --por-segundo 2
+    python precargar.py --frecuencias logs.txt --subir   # a s3://$S3_BUCKET_NAME/precarga/v{formato}.bin
+
+Frecuencias: cualquier texto con las líneas "Query amplia : ..." y
+"Query variante : ..." que el Lambda loguea en INFO (por ejemplo un export
+de CloudWatch Logs Insights). Sin frecuencias, el orden es el de los
+catálogos. Las queries principales llevan descriptores libres y no forman
+parte del espacio enumerable: no se precargan.
+
+Los contenedores warm siguen con el snapshot que ya bajaron; el nuevo se
+toma al reciclarse.
+"""
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+import zlib
+from collections import Counter
+
+AQUI   = os.path.dirname(os.path.abspath(__file__))
+SALIDA = os.path.join(AQUI, "precarga.bin")
+
+QUERY_LOG_RE = re.compile(r"Query (?:principal|amplia|variante)\s*:\s*(.+?)\s*$")
+ERRORES_SEGUIDOS_MAX = 5   # cuota agotada o SerpAPI caído: no seguir gastando presupuesto
+
+
+def _lf():
+    sys.path.insert(0, AQUI)
+    import lambda_function
+    return lambda_function
+
+
+def enumerar_queries(lf) -> list:
+    """Queries amplias y de estilo de todo el catálogo, sin repetidas, en orden de catálogo."""
+    queries = []
+    for genero, prendas in (("hombre", lf.PRENDAS_HOMBRE), ("mujer", lf.PRENDAS_MUJER)):
+        for prenda_en in [*prendas, "Clothing"]:   # "Clothing" = prenda de fallback
+            for color_en in [*lf.COLORES, ""]:
+                queries.append(lf._build_broad_query(prenda_en, color_en, genero))
+            for estilo_en in lf.ESTILOS:
+                queries.append(lf._build_style_query(prenda_en, estilo_en, genero))
+    return list(dict.fromkeys(queries))
+
+
+def leer_frecuencias(paths: list) -> Counter:
+    conteo = Counter()
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for linea in f:
+                m = QUERY_LOG_RE.search(linea)
+                if m:
+                    conteo[" ".join(m.group(1).lower().split())] += 1
+    return conteo
+
+
+def rankear(queries: list, frecuencias: Counter) -> list:
+    """Más frecuentes primero; a igual frecuencia, el orden del catálogo."""
+    orden = {q: i for i, q in enumerate(queries)}
+    return sorted(queries, key=lambda q: (-frecuencias.get(q, 0), orden[q]))
+
+
+def precargar(lf, queries: list, max_queries: int, por_segundo: float) -> dict:
+    """{clave de cache: items} de las primeras `max_queries`, a lo sumo `por_segundo` llamadas/s."""
+    entradas, errores_seguidos = {}, 0
+    intervalo = 1 / por_segundo if por_segundo > 0 else 0
+    proxima   = time.monotonic()
+    for n, query in enumerate(queries[:max_queries], 1):
+        time.sleep(max(0.0, proxima - time.monotonic()))
+        proxima = time.monotonic() + intervalo
+        items = lf._fetch_serpapi_remote(query)
+        if items is None:
+            errores_seguidos += 1
+            if errores_seguidos >= ERRORES_SEGUIDOS_MAX:
+                print(f"{ERRORES_SEGUIDOS_MAX} errores seguidos de SerpAPI: se corta en {n}/{max_queries}")
+                break
+            continue
+        errores_seguidos = 0
+        entradas[lf._serp_cache_key(query, "en", "us")] = items
+        if n % 50 == 0:
+            print(f"  {n}/{max_queries} queries")
+    return entradas
+
+
+def escribir_snapshot(lf, entradas: dict, destino: str, generado: float = None) -> int:
+    """Escribe el snapshot en el formato que lee _SnapshotTier. Retorna el tamaño en bytes."""
+    import json
+    slots = 8
+    while slots < 2 * len(entradas):
+        slots *= 2
+    tabla = [(0, 0, 0)] * slots
+    blobs = []
+    offset = lf.SNAPSHOT_CABECERA.size + slots * lf.SNAPSHOT_SLOT.size
+    for clave, items in entradas.items():
+        blob = zlib.compress(json.dumps({"k": clave, "v": items}, ensure_ascii=False,
+                                        separators=(",", ":")).encode("utf-8"), 9)
+        h = lf._snapshot_hash(clave)
+        i = h & (slots - 1)
+        while tabla[i][0]:
+            i = (i + 1) & (slots - 1)
+        tabla[i] = (h, offset, len(blob))
+        blobs.append(blob)
+        offset += len(blob)
+
+    directorio = os.path.dirname(os.path.abspath(destino))
+    fd, tmp = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(lf.SNAPSHOT_CABECERA.pack(lf.SNAPSHOT_MAGIC, lf.SNAPSHOT_FORMATO,
+                                          generado or time.time(), len(entradas), slots))
+        for slot in tabla:
+            f.write(lf.SNAPSHOT_SLOT.pack(*slot))
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp, destino)
+    return offset
+
+
+def subir(lf, path: str, bucket: str):
+    import boto3
+    key = lf._snapshot_s3_key()
+    with open(path, "rb") as f:
+        boto3.client("s3").put_object(Bucket=bucket, Key=key, Body=f,
+                                      ContentType="application/octet-stream")
+    print(f"Subido a s3://{bucket}/{key}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Precarga offline de búsquedas de StyleMatch")
+    parser.add_argument("--frecuencias", nargs="*", default=[], help="logs con las queries observadas")
+    parser.add_argument("--max-queries", type=int, default=300, help="presupuesto de llamadas a SerpAPI")
+    parser.add_argument("--por-segundo", type=float, default=1.0, help="ritmo máximo de llamadas")
+    parser.add_argument("--salida", default=SALIDA)
+    parser.add_argument("--listar", type=int, metavar="N", help="muestra las N primeras del ranking y sale")
+    parser.add_argument("--subir", action="store_true", help="sube el snapshot al bucket del Lambda")
+    parser.add_argument("--bucket", default=os.environ.get("S3_BUCKET_NAME", ""))
+    args = parser.parse_args(argv)
+
+    lf = _lf()
+    frecuencias = leer_frecuencias(args.frecuencias)
+    ranking     = rankear(enumerar_queries(lf), frecuencias)
+    print(f"Espacio de queries: {len(ranking)} · observadas en logs: {sum(1 for q in ranking if q in frecuencias)}")
+
+    if args.listar:
+        for q in ranking[:args.listar]:
+            print(f"{frecuencias.get(q, 0):>8}  {q}")
+        return 0
+    if not lf.SERPAPI_KEY:
+        parser.error("falta SERPAPI_KEY en el entorno")
+    if args.subir and not args.bucket:
+        parser.error("--subir necesita --bucket o S3_BUCKET_NAME")
+
+    entradas = precargar(lf, ranking, args.max_queries, args.por_segundo)
+    tamano   = escribir_snapshot(lf, entradas, args.salida)
+    print(f"Snapshot v{lf.SNAPSHOT_FORMATO}: {len(entradas)} queries, {tamano / 1024:.0f} KB → {args.salida}")
+    if args.subir:
+        subir(lf, args.salida, args.bucket)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""
+Fixtures de los tests: lambda_function importado con los clientes stub de
+benchmarks/bench.py (sin red, credenciales ni boto3) y el estado de módulo
+reiniciado en cada test.
+
+Uso (desde backend/):
+    python -m pytest -q tests
+"""
+
+import copy
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+AQUI    = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.dirname(AQUI)
+sys.path.insert(0, os.path.join(BACKEND, "benchmarks"))
+
+import bench   # noqa: E402  (stubs de boto3 y fixtures grabados)
+
+os.environ["LOG_LEVEL"]           = "ERROR"
+os.environ["METRICS_SAMPLE_RATE"] = "0"
+lf_modulo = bench._importar_lambda(tempfile.mkdtemp(prefix="stylematch-tests-"))
+
+
+@pytest.fixture
+def lf(monkeypatch, tmp_path):
+    """El módulo en estado de contenedor frío: sin caches, índice, circuito ni cuota."""
+    monkeypatch.setattr(lf_modulo, "SERPAPI_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(lf_modulo, "INDICE_PRODUCTOS", False)
+    monkeypatch.setattr(lf_modulo, "_formato_respuesta", (False, None))
+    monkeypatch.setattr(lf_modulo, "_clientes", {})   # stubs nuevos: contadores de llamadas en cero
+    for nombre in ("_serp_cache", "_vision_cache", "_circuito_serpapi", "_cuota_serpapi", "_indice_phash"):
+        monkeypatch.setattr(lf_modulo, nombre, None)
+    bench._CLIENTES.clear()
+    return lf_modulo
+
+
+@pytest.fixture
+def fixture_rekognition():
+    def cargar(caso: str) -> dict:
+        return copy.deepcopy(bench._cargar_fixture(f"rekognition_{caso}.json"))
+    return cargar
+
+
+@pytest.fixture
+def shopping():
+    return bench._cargar_fixture("serpapi_shopping.json")["shopping_results"]
+
+
+@pytest.fixture
+def contexto():
+    return bench._ContextoStub()
+
+
+def ida_y_vuelta(valor):
+    """Lo que sobrevive a un payload JSON (las tuplas vuelven como listas)."""
+    return json.loads(json.dumps(valor))
@@ -0,0 +1,107 @@
+"""Etapa de búsqueda del pipeline: variante perezosa, deadline y hedge."""
+
+import asyncio
+import threading
+import time
+from collections import deque
+
+import pytest
+
+from conftest import ida_y_vuelta
+
+
+def _deteccion(lf, fixture_rekognition, caso="una_prenda"):
+    fixture = fixture_rekognition(caso)
+    vision  = lf._parse_rekognition(fixture["detect_labels"])
+    return ida_y_vuelta(lf._detectar_prendas(vision, fixture["genero"]))
+
+
+def test_variante_perezosa_se_pide_en_el_pipeline(lf, monkeypatch, fixture_rekognition, shopping):
+    monkeypatch.setattr(lf, "SERPAPI_VARIANTE_PARALELA", False)
+    pedidas = []
+    monkeypatch.setattr(lf, "_fetch_serpapi_remote",
+                        lambda query, hl="en", gl="us": pedidas.append(query) or shopping[:4])
+    una, otra = _deteccion(lf, fixture_rekognition), _deteccion(lf, fixture_rekognition)
+
+    resultados = lf._buscar_tiendas([una, otra])
+    assert una["query_variante"] in resultados
+    assert len(pedidas) == len(set(pedidas))   # la variante compartida sale una vez
+
+    monkeypatch.setattr(lf, "_fetch_serpapi_paralelo", lambda *a, **kw: pytest.fail("fetch al armar"))
+    assert lf._armar_prendas(una, resultados)[0]["tiendas"]
+
+
+def test_variante_no_se_pide_si_sobran_tiendas(lf, monkeypatch, fixture_rekognition, shopping):
+    monkeypatch.setattr(lf, "SERPAPI_VARIANTE_PARALELA", False)
+    monkeypatch.setattr(lf, "_fetch_serpapi_remote",
+                        lambda query, hl="en", gl="us": [dict(i, title=f"{query} {i['title']}") for i in shopping])
+    deteccion  = _deteccion(lf, fixture_rekognition)
+    resultados = lf._buscar_tiendas([deteccion])
+    assert deteccion["query_variante"] not in resultados
+
+
+@pytest.fixture
+def colgadas(monkeypatch, lf, shopping):
+    """
+    _fetch_serpapi_remote que cuelga las queries de `lentas` hasta el final
+    del test (o la primera llamada de cada una si `solo_primera`).
+    """
+    liberar = threading.Event()
+    estado  = {"lentas": set(), "solo_primera": False, "llamadas": []}
+
+    def remoto(query, hl="en", gl="us"):
+        primera = query not in estado["llamadas"]
+        estado["llamadas"].append(query)
+        if query in estado["lentas"] and (primera or not estado["solo_primera"]):
+            liberar.wait(5)
+            return [dict(i, title=f"lenta {i['title']}") for i in shopping]
+        return shopping[:4]
+    monkeypatch.setattr(lf, "_fetch_serpapi_remote", remoto)
+    monkeypatch.setattr(lf, "_latencias_serpapi", deque(maxlen=200))   # umbral de hedge inicial
+    yield estado
+    liberar.set()   # los threads del pool no quedan colgados para el resto
+
+
+def test_deadline_deja_resultados_parciales(lf, monkeypatch, fixture_rekognition, colgadas):
+    monkeypatch.setattr(lf, "HEDGE_PERCENTIL", 0)
+    monkeypatch.setattr(lf, "SERPAPI_VARIANTE_PARALELA", False)
+    deteccion = _deteccion(lf, fixture_rekognition)
+    colgadas["lentas"].add(deteccion["query_amplia"])
+
+    inicio     = time.monotonic()
+    resultados = lf._buscar_tiendas([deteccion], inicio + 0.3)
+    assert time.monotonic() - inicio < 2   # no espera a la query colgada
+    assert deteccion["query_principal"] in resultados
+    assert deteccion["query_amplia"] in resultados.pendientes
+    assert deteccion["query_amplia"] not in resultados
+
+    monkeypatch.setattr(lf, "_fetch_serpapi_paralelo", lambda *a, **kw: pytest.fail("fetch al armar"))
+    prenda = lf._armar_prendas(deteccion, resultados)[0]
+    assert prenda["parcial"] is True
+    assert prenda["tiendas"]   # lo que llegó a tiempo
+
+
+def test_sin_deadline_no_hay_parciales(lf, monkeypatch, fixture_rekognition, colgadas):
+    monkeypatch.setattr(lf, "SERPAPI_VARIANTE_PARALELA", False)
+    deteccion  = _deteccion(lf, fixture_rekognition)
+    resultados = lf._buscar_tiendas([deteccion])
+    assert not resultados.pendientes
+    assert "parcial" not in lf._armar_prendas(deteccion, resultados)[0]
+
+
+def test_hedge_gana_a_la_query_rezagada(lf, monkeypatch, colgadas):
+    monkeypatch.setattr(lf, "HEDGE_INICIAL_MS", 50)
+    colgadas["lentas"].add("remera negra")
+    colgadas["solo_primera"] = True
+
+    inicio = time.monotonic()
+    items  = asyncio.run(lf._fetch_con_hedge("remera negra", inicio + 5))
+    assert time.monotonic() - inicio < 2
+    assert colgadas["llamadas"] == ["remera negra", "remera negra"]
+    assert not any(i["title"].startswith("lenta") for i in items)   # ganó el duplicado
+
+
+def test_sin_deadline_no_sale_el_hedge(lf, monkeypatch, colgadas):
+    monkeypatch.setattr(lf, "HEDGE_INICIAL_MS", 0)
+    asyncio.run(lf._fetch_con_hedge("remera negra"))
+    assert colgadas["llamadas"] == ["remera negra"]
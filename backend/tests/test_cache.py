@@ -0,0 +1,48 @@
+"""Orden y relleno de los tiers del cache de SerpAPI."""
+
+import time
+
+import precargar
+import pytest
+
+
+@pytest.fixture
+def snapshot(lf, tmp_path):
+    path = str(tmp_path / "precarga.bin")
+    precargar.escribir_snapshot(lf, {"remera|en|us": [{"title": "vieja"}]}, path)
+    return lf._SnapshotTier(path)
+
+
+def test_snapshot_va_ultimo(lf, snapshot):
+    cache = lf._build_cache("serpapi", shared_backend=lf._MemoryKVBackend(), snapshot=snapshot)
+    assert [t.nombre for t in cache.tiers][-1] == "snapshot"
+
+
+def test_resultado_compartido_le_gana_al_snapshot(lf, snapshot):
+    compartido = lf._MemoryKVBackend()
+    otro_contenedor = lf._build_cache("serpapi", shared_backend=compartido)
+    otro_contenedor.tiers = otro_contenedor.tiers[-1:]   # solo el tier compartido
+    otro_contenedor.set("remera|en|us", [{"title": "nueva"}])
+
+    cache = lf._build_cache("serpapi", shared_backend=compartido, snapshot=snapshot)
+    assert cache.get("remera|en|us") == [{"title": "nueva"}]
+
+
+def test_snapshot_responde_lo_que_nadie_tiene(lf, snapshot):
+    cache = lf._build_cache("serpapi", shared_backend=lf._MemoryKVBackend(), snapshot=snapshot)
+    assert cache.get("remera|en|us") == [{"title": "vieja"}]
+    assert cache.get("pantalon|en|us") is None
+
+
+def test_hit_del_snapshot_no_se_republica(lf, tmp_path, monkeypatch):
+    path = str(tmp_path / "precarga.bin")
+    # Generado hace casi PRECARGA_MAX_EDAD: le queda una hora de vigencia
+    generado = time.time() - lf.PRECARGA_MAX_EDAD + 3600
+    precargar.escribir_snapshot(lf, {"remera|en|us": [{"title": "vieja"}]}, path, generado)
+    compartido = lf._MemoryKVBackend()
+    cache = lf._build_cache("serpapi", shared_backend=compartido, snapshot=lf._SnapshotTier(path))
+
+    assert cache.get("remera|en|us") == [{"title": "vieja"}]
+    assert compartido._inner._data == {}   # ni un PUT al tier compartido
+    expira, _ = cache.tiers[0]._data["remera|en|us"]
+    assert expira - time.time() == pytest.approx(3600, abs=5)   # no las 6 h de SERPAPI_CACHE_TTL
@@ -0,0 +1,149 @@
+"""Transiciones de _CircuitBreaker (cerrado → abierto → semiabierto)."""
+
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def circuito(lf):
+    return lf._CircuitBreaker("test")
+
+
+def _fallar(circuito, n):
+    for _ in range(n):
+        circuito.registrar(circuito.permitir(), False, 10)
+
+
+def _vencer(circuito):
+    circuito.abierto_hasta = 0.0
+
+
+def test_cerrado_deja_pasar_y_abre_al_superar_el_umbral(lf, circuito):
+    assert circuito.permitir() is not None
+    _fallar(circuito, lf.CIRCUITO_MIN_LLAMADAS - 1)
+    assert circuito.estado == circuito.CERRADO   # pocas muestras todavía
+    _fallar(circuito, 1)
+    assert circuito.estado == circuito.ABIERTO
+    assert circuito.permitir() is None
+    assert circuito.stats["aperturas"] == 1
+
+
+def test_exitos_bajo_el_umbral_no_abren(lf, circuito):
+    for i in range(lf.CIRCUITO_MIN_LLAMADAS * 2):
+        circuito.registrar(circuito.permitir(), i % 3 != 0, 10)
+    assert circuito.estado == circuito.CERRADO
+
+
+def test_llamada_lenta_cuenta_como_falla(lf, circuito):
+    for _ in range(lf.CIRCUITO_MIN_LLAMADAS):
+        circuito.registrar(circuito.permitir(), True, lf.CIRCUITO_LENTA_MS + 1)
+    assert circuito.estado == circuito.ABIERTO
+
+
+def test_exito_rezagado_no_cierra_el_circuito(lf, circuito):
+    # Salió con el circuito cerrado y vuelve después de que se abrió
+    rezagada = circuito.permitir()
+    _fallar(circuito, lf.CIRCUITO_MIN_LLAMADAS)
+    assert circuito.estado == circuito.ABIERTO
+    circuito.registrar(rezagada, True, 10)
+    assert circuito.estado == circuito.ABIERTO
+    assert circuito.permitir() is None
+
+
+def test_sonda_exitosa_cierra(lf, circuito):
+    _fallar(circuito, lf.CIRCUITO_MIN_LLAMADAS)
+    _vencer(circuito)
+    sonda = circuito.permitir()
+    assert sonda is not None
+    assert circuito.estado == circuito.SEMIABIERTO
+    assert circuito.permitir() is None   # una sola sonda a la vez
+    circuito.registrar(sonda, True, 10)
+    assert circuito.estado == circuito.CERRADO
+    assert circuito.permitir() is not None
+
+
+def test_sonda_fallida_reabre(lf, circuito):
+    _fallar(circuito, lf.CIRCUITO_MIN_LLAMADAS)
+    _vencer(circuito)
+    circuito.registrar(circuito.permitir(), False, 10)
+    assert circuito.estado == circuito.ABIERTO
+    assert circuito.stats["aperturas"] == 2
+
+
+def test_exito_rezagado_en_semiabierto_no_reemplaza_a_la_sonda(lf, circuito):
+    rezagada = circuito.permitir()
+    _fallar(circuito, lf.CIRCUITO_MIN_LLAMADAS)
+    _vencer(circuito)
+    sonda = circuito.permitir()
+    circuito.registrar(rezagada, True, 10)
+    assert circuito.estado == circuito.SEMIABIERTO
+    circuito.registrar(sonda, False, 10)
+    assert circuito.estado == circuito.ABIERTO
+
+
+def test_falla_rezagada_no_ensucia_la_ventana_nueva(lf, circuito):
+    rezagadas = [circuito.permitir() for _ in range(lf.CIRCUITO_MIN_LLAMADAS)]
+    _fallar(circuito, lf.CIRCUITO_MIN_LLAMADAS)
+    _vencer(circuito)
+    circuito.registrar(circuito.permitir(), True, 10)
+    assert circuito.estado == circuito.CERRADO
+    for generacion in rezagadas:
+        circuito.registrar(generacion, False, 10)
+    assert circuito.estado == circuito.CERRADO
+
+
+def _esperar(condicion):
+    limite = time.monotonic() + 5
+    while not condicion() and time.monotonic() < limite:
+        time.sleep(0.01)
+    assert condicion()
+
+
+def test_adopta_apertura_compartida(lf):
+    backend = lf._MemoryKVBackend()
+    uno, otro = lf._CircuitBreaker("serpapi", backend), lf._CircuitBreaker("serpapi", backend)
+    _fallar(uno, lf.CIRCUITO_MIN_LLAMADAS)
+    _esperar(lambda: backend.get("serpapi") is not None)
+    otro._sincronizar_ahora()
+    assert otro.permitir() is None
+    assert otro.estado == otro.ABIERTO
+
+
+class _BackendLento:
+    """Backend que bloquea get/put hasta `liberar` y anota si el lock del circuito estaba tomado."""
+
+    def __init__(self):
+        self.circuito = None
+        self.liberar  = threading.Event()
+        self.puts     = []
+
+    def get(self, key):
+        self.liberar.wait(5)
+        return None
+
+    def put(self, key, data):
+        self.puts.append(self.circuito._lock.locked())
+        self.liberar.wait(5)
+
+
+def test_backend_lento_no_frena_el_request(lf):
+    backend  = _BackendLento()
+    circuito = backend.circuito = lf._CircuitBreaker("serpapi", backend)
+    inicio = time.monotonic()
+    _fallar(circuito, lf.CIRCUITO_MIN_LLAMADAS)   # abre y publica
+    assert circuito.permitir() is None
+    assert time.monotonic() - inicio < 1
+    _esperar(lambda: backend.puts)
+    backend.liberar.set()
+    assert backend.puts == [False]   # put_object nunca con el lock tomado
+
+
+def test_fetch_con_circuito_abierto_no_sale_a_serpapi(lf, monkeypatch):
+    llamadas = []
+    monkeypatch.setattr(lf, "_fetch_serpapi_remote", lambda *a: llamadas.append(a))
+    circuito = lf._get_circuito_serpapi()
+    _fallar(circuito, lf.CIRCUITO_MIN_LLAMADAS)
+    assert lf._fetch_serpapi("remera negra") == []
+    assert llamadas == []
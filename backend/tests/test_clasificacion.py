@@ -0,0 +1,57 @@
+"""_clasificar_texto (Aho–Corasick) contra los loops lineales originales."""
+
+import pytest
+
+CASOS = ("una_prenda", "outfit", "muchos_labels", "sin_prenda")
+
+# Nombres compuestos como los que arma Rekognition, con matches solapados
+COMPUESTOS = ["Blue Denim Jeans", "Dark Red Plaid Shirt", "Striped Black T-Shirt", "Floral Dress Style"]
+
+
+def _primero(catalogo, texto):
+    """El loop original: primer término del dict que aparece en el texto."""
+    for nombre in catalogo:
+        if nombre.lower() in texto.lower():
+            return nombre
+    return None
+
+
+def _todos(catalogo, texto):
+    return {nombre for nombre in catalogo if nombre.lower() in texto.lower()}
+
+
+def _textos(fixture):
+    textos = list(COMPUESTOS)
+    for label in fixture["detect_labels"]["Labels"]:
+        textos.append(label["Name"])
+        # Nombre + aliases, como el hint de color de la prenda
+        textos.append(" ".join([label["Name"], *(a.get("Name", "") for a in label.get("Aliases", []))]))
+    return textos
+
+
+@pytest.mark.parametrize("caso", CASOS)
+def test_mismos_matches_que_el_loop(lf, fixture_rekognition, caso):
+    for texto in _textos(fixture_rekognition(caso)):
+        hits = lf._clasificar_texto(texto)
+        assert (hits.colores or (None,))[0] == _primero(lf.COLORES, texto), texto
+        assert (hits.estilos or (None,))[0] == _primero(lf.ESTILOS, texto), texto
+        assert (hits.patrones or (None,))[0] == _primero(lf.PATRONES, texto), texto
+        assert set(hits.colores) == _todos(lf.COLORES, texto)
+        assert set(hits.patrones) == _todos(lf.PATRONES, texto)
+        assert set(hits.descriptores) == _todos(lf.DESCRIPTORES_UTILES, texto)
+        assert hits.prendas == _todos({**lf.PRENDAS_HOMBRE, **lf.PRENDAS_MUJER}, texto)
+
+
+@pytest.mark.parametrize("caso", CASOS)
+@pytest.mark.parametrize("genero", ["hombre", "mujer"])
+def test_fallback_de_prenda_igual_al_loop(lf, fixture_rekognition, caso, genero):
+    prendas_dict = lf.PRENDAS_HOMBRE if genero == "hombre" else lf.PRENDAS_MUJER
+    rango        = lf._RANGO_PRENDA[genero]
+    for texto in _textos(fixture_rekognition(caso)):
+        en_dict = [p for p in lf._clasificar_texto(texto).prendas if p in rango]
+        assert (min(en_dict, key=rango.get) if en_dict else None) == _primero(prendas_dict, texto), texto
+
+
+def test_descriptores_en_orden_de_aparicion(lf):
+    # El loop sobre el set los devolvía en un orden que dependía del hash seed
+    assert lf._clasificar_texto("Wool Slim Denim").descriptores == ("Wool", "Slim", "Denim")
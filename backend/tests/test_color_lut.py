@@ -0,0 +1,36 @@
+"""Tabla RGB → color de 5 bits contra _rgb_to_color_name."""
+
+import itertools
+
+
+def _centros(lf):
+    shift = 8 - lf._COLOR_LUT_BITS
+    return [(q << shift) + (1 << (shift - 1)) for q in range(1 << lf._COLOR_LUT_BITS)]
+
+
+def test_precompilada_vigente_e_igual_a_la_construida(lf):
+    precompilada = lf._color_lut_precompilada()
+    assert precompilada is not None   # si falla: correr empaquetar.py
+    assert precompilada == lf._construir_color_lut()
+
+
+def test_lookup_igual_al_clasificador_en_toda_la_grilla(lf, monkeypatch):
+    monkeypatch.setattr(lf, "_color_lut", None)
+    grilla = list(itertools.product(_centros(lf), repeat=3))
+    assert lf._rgb_to_color_names(grilla) == [lf._rgb_to_color_name(*rgb) for rgb in grilla]
+
+
+def test_lookup_usa_la_celda_del_valor(lf, monkeypatch):
+    monkeypatch.setattr(lf, "_color_lut", None)
+    shift = 8 - lf._COLOR_LUT_BITS
+    # Bordes de celda: el nombre es el del centro de la celda que los contiene
+    bordes = [(0, 0, 0), (255, 255, 255), (7, 8, 255), (128, 127, 64)]
+    centros = [tuple((c >> shift << shift) + (1 << (shift - 1)) for c in rgb) for rgb in bordes]
+    assert lf._rgb_to_color_names(bordes) == [lf._rgb_to_color_name(*rgb) for rgb in centros]
+
+
+def test_precompilada_de_otro_catalogo_se_descarta(lf, monkeypatch):
+    monkeypatch.setattr(lf, "_color_lut", None)
+    monkeypatch.setattr(lf, "_COLOR_LUT_PRECOMPILADA_NOMBRES", lf._COLOR_NOMBRES[::-1])
+    assert lf._color_lut_precompilada() is None
+    assert lf._get_color_lut() == lf._construir_color_lut()
@@ -0,0 +1,94 @@
+"""Colores locales: k-means por bounding box y fallback a IMAGE_PROPERTIES."""
+
+import base64
+import concurrent.futures
+import io
+
+import bench
+import pytest
+
+ROJO, AZUL, BLANCO = (200, 30, 30), (30, 40, 190), (245, 245, 245)
+
+
+def _imagen_partida():
+    """96x96 PNG: mitad izquierda roja, mitad derecha azul, franja blanca abajo."""
+    Image = pytest.importorskip("PIL.Image")
+    img = Image.new("RGB", (96, 96), BLANCO)
+    img.paste(ROJO, (0, 0, 48, 80))
+    img.paste(AZUL, (48, 0, 96, 80))
+    salida = io.BytesIO()
+    img.save(salida, format="PNG")
+    return salida.getvalue()
+
+
+def _instancia(left, top, width, height):
+    return {"BoundingBox": {"Left": left, "Top": top, "Width": width, "Height": height}, "Confidence": 90.0}
+
+
+def _cerca(swatch, rgb, tolerancia=3):
+    return all(abs(swatch[c] - v) <= tolerancia for c, v in zip(("Red", "Green", "Blue"), rgb))
+
+
+def _detect_labels_anotado(fixture):
+    pedidos = []
+
+    def detect_labels(**kwargs):
+        pedidos.append(kwargs["Features"])
+        return fixture["detect_labels"]
+    return pedidos, detect_labels
+
+
+def test_colores_de_cada_bounding_box(lf):
+    pytest.importorskip("numpy")
+    colores = lf._colores_locales(_imagen_partida(), "uploads/hombre/x.png")
+    reko = {"Labels": [{"Name": "Shirt", "Instances": [
+        _instancia(0.05, 0.05, 0.4, 0.7),    # dentro de la mitad roja
+        _instancia(0.55, 0.05, 0.4, 0.7),    # dentro de la mitad azul
+        _instancia(0.0, 0.5, 1.0, 0.5),      # rojo, azul y la franja blanca
+    ]}]}
+    lf._colores_instancias(reko, colores["pixeles"])
+
+    roja, azul, mixta = (inst["DominantColors"] for inst in reko["Labels"][0]["Instances"])
+    assert len(roja) == 1 and _cerca(roja[0], ROJO) and roja[0]["PixelPercent"] == 100
+    assert len(azul) == 1 and _cerca(azul[0], AZUL)
+    assert len(mixta) == 3
+    assert all(any(_cerca(s, rgb) for s in mixta) for rgb in (ROJO, AZUL, BLANCO))
+    assert [s["PixelPercent"] for s in mixta if _cerca(s, BLANCO)] == [pytest.approx(100 / 3, abs=1)]
+
+
+def test_caja_demasiado_chica_queda_sin_colores(lf):
+    np = pytest.importorskip("numpy")
+    reko = {"Labels": [{"Name": "Belt", "Instances": [_instancia(0.5, 0.5, 0.01, 0.01)]}]}
+    lf._colores_instancias(reko, np.zeros((96, 96, 3), dtype=np.float32))
+    assert "DominantColors" not in reko["Labels"][0]["Instances"][0]
+
+
+def test_con_colores_locales_rekognition_solo_da_labels(lf, fixture_rekognition):
+    pytest.importorskip("numpy")
+    pytest.importorskip("PIL")
+    fixture = fixture_rekognition("una_prenda")
+    pedidos, lf._rekognition().respuestas["detect_labels"] = _detect_labels_anotado(fixture)
+    prep = lf._preparar_imagen("hombre", base64.b64encode(_imagen_partida()).decode())
+    vision, _ = lf._obtener_vision(prep)
+    assert pedidos == [["GENERAL_LABELS"]]
+    # Los colores son los de la imagen, no los ImageProperties grabados
+    assert vision["colores"] and vision["colores"] != lf._parse_rekognition(fixture["detect_labels"])["colores"]
+
+
+@pytest.mark.parametrize("falta", ["numpy", "PIL"])
+def test_sin_numpy_o_pillow_pide_image_properties(lf, monkeypatch, fixture_rekognition, falta):
+    monkeypatch.setattr(lf, "_modulo_disponible", lambda nombre: nombre != falta)
+    monkeypatch.setattr(lf, "_colores_locales_async", lambda *a: pytest.fail("colores locales sin dependencias"))
+    pedidos, lf._rekognition().respuestas["detect_labels"] = _detect_labels_anotado(fixture_rekognition("una_prenda"))
+    prep = lf._preparar_imagen("hombre", base64.b64encode(bench.IMAGEN_JPEG).decode())
+    lf._obtener_vision(prep)
+    assert pedidos == [["GENERAL_LABELS", "IMAGE_PROPERTIES"]]
+
+
+def test_calculo_local_fallido_repite_con_image_properties(lf, fixture_rekognition):
+    pedidos, lf._rekognition().respuestas["detect_labels"] = _detect_labels_anotado(fixture_rekognition("una_prenda"))
+    futuro = concurrent.futures.Future()
+    futuro.set_exception(OSError("imagen truncada"))
+    reko = lf._combinar_colores_locales({"Labels": []}, futuro, {"Bytes": bench.IMAGEN_JPEG})
+    assert pedidos == [["GENERAL_LABELS", "IMAGE_PROPERTIES"]]
+    assert "ImageProperties" in reko
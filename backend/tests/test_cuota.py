@@ -0,0 +1,83 @@
+"""_TokenBucket: reservas por prioridad, devolución y balance compartido."""
+
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def bucket(lf):
+    # Tasa casi nula: el balance solo cambia por lo que toma cada test
+    return lf._TokenBucket("test", por_minuto=1e-6, capacidad=10)
+
+
+def test_prioridades_se_descartan_en_orden(bucket):
+    tomadas = {"principal": 0, "amplia": 0, "variante": 0}
+    for _ in range(20):
+        for prioridad in ("variante", "amplia", "principal"):
+            tomadas[prioridad] += bucket.tomar(prioridad)
+    # variante deja 4 tokens de reserva, amplia 1, principal ninguno
+    assert tomadas == {"principal": 4, "amplia": 4, "variante": 2}
+    assert not bucket.tomar("principal")
+
+
+def test_devolver_reintegra(bucket):
+    for _ in range(10):
+        assert bucket.tomar()
+    assert not bucket.tomar()
+    bucket.devolver()
+    assert bucket.tomar()
+    assert bucket.stats["tomados"] == 10
+
+
+def test_recarga_con_el_tiempo(lf):
+    bucket = lf._TokenBucket("test", por_minuto=60, capacidad=2)
+    assert bucket.tomar() and bucket.tomar()
+    assert not bucket.tomar()
+    bucket.actualizado -= 1.5   # 1.5 s a 1 token/s
+    assert bucket.tomar()
+    assert not bucket.tomar()
+
+
+def test_balance_compartido_descuenta_lo_gastado(lf):
+    backend = lf._MemoryKVBackend()
+    uno, otro = (lf._TokenBucket("cuota", 1e-6, 10, backend) for _ in range(2))
+    for _ in range(6):
+        assert uno.tomar()
+    uno._sincronizar_ahora()
+    otro._sincronizar_ahora()
+    assert otro.tokens == pytest.approx(4, abs=0.01)
+
+
+def test_fetch_sin_cuota_no_sale_a_serpapi(lf, monkeypatch):
+    llamadas = []
+    monkeypatch.setattr(lf, "_fetch_serpapi_remote", lambda *a: llamadas.append(a) or [])
+    monkeypatch.setattr(lf, "_cuota_serpapi", lf._TokenBucket("serpapi", 1e-6, 10))
+    lf._cuota_serpapi.tokens = 4.5
+    assert lf._fetch_serpapi("remera", prioridad="variante") == []
+    assert llamadas == []
+    assert lf._cuota_serpapi.stats["descartados"] == 1
+    lf._fetch_serpapi("remera", prioridad="principal")
+    assert len(llamadas) == 1
+
+
+class _PoolAnotador:
+    """Pool que no corre nada: solo anota lo que se le manda."""
+
+    def __init__(self):
+        self.lanzadas = []
+
+    def submit(self, fn, *args):
+        self.lanzadas.append(fn)
+
+
+def test_una_sola_sincronizacion_a_la_vez(lf, monkeypatch):
+    pool = _PoolAnotador()
+    monkeypatch.setattr(lf, "_pool", lambda upstream: pool)
+    bucket = lf._TokenBucket("cuota", 1e-6, 10, lf._MemoryKVBackend())
+    hilos  = [threading.Thread(target=bucket.tomar) for _ in range(16)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    assert len(pool.lanzadas) == 1
@@ -0,0 +1,83 @@
+"""Índice local de productos dentro de la búsqueda de un lote."""
+
+import asyncio
+import copy
+import threading
+
+import pytest
+
+from conftest import ida_y_vuelta
+
+
+@pytest.fixture
+def indice(lf, monkeypatch, tmp_path):
+    monkeypatch.setattr(lf, "INDICE_PRODUCTOS", True)
+    monkeypatch.setattr(lf, "INDICE_S3_SYNC", False)
+    monkeypatch.setattr(lf, "INDICE_PATH", str(tmp_path / "indice.db"))
+    monkeypatch.setattr(lf, "_indice", None)
+    yield lf._get_indice()
+    lf._pool("indice").submit(lambda: None).result()   # un solo thread: esperar las escrituras
+
+
+def _deteccion(lf, fixture_rekognition):
+    fixture = fixture_rekognition("una_prenda")
+    vision  = lf._parse_rekognition(fixture["detect_labels"])
+    return ida_y_vuelta(lf._detectar_prendas(vision, fixture["genero"]))
+
+
+def _indexar(lf, indice, deteccion, items):
+    prenda, color, queries = deteccion["planes"][0]
+    indice.guardar(lf._clave_plan(deteccion, deteccion["planes"][0]), deteccion["genero"],
+                   prenda["en"], color["en"], [(queries[0], items)])
+
+
+def test_hit_del_indice_no_tapa_la_query_de_otra_imagen(lf, indice, monkeypatch, fixture_rekognition, shopping):
+    pedidas = []
+    monkeypatch.setattr(lf, "_fetch_serpapi_remote", lambda query, hl="en", gl="us": pedidas.append(query) or shopping)
+    conocida = _deteccion(lf, fixture_rekognition)
+    _indexar(lf, indice, conocida, [dict(shopping[0], title="del indice")])
+    # Mismas queries, otra combinación (no está en el índice)
+    nueva = copy.deepcopy(conocida)
+    nueva["genero"] = "otro"
+
+    resultados = lf._buscar_tiendas([conocida, nueva])
+    principal, amplia = nueva["query_principal"], nueva["query_amplia"]
+    assert {principal, amplia} <= set(pedidas)
+    assert resultados[principal] == shopping
+    assert [t["producto"] for t in lf._tiendas_plan(conocida, conocida["planes"][0], resultados)] == ["del indice"]
+    assert len(lf._tiendas_plan(nueva, nueva["planes"][0], resultados)) > 1
+
+
+def test_lectura_del_indice_fuera_del_event_loop(lf, indice, monkeypatch, fixture_rekognition, shopping):
+    monkeypatch.setattr(lf, "_fetch_serpapi_remote", lambda query, hl="en", gl="us": shopping)
+    en_loop = []
+    original = lf._planes_desde_indice
+
+    def planes_desde_indice(*args):
+        try:
+            asyncio.get_running_loop()
+            en_loop.append(True)
+        except RuntimeError:
+            en_loop.append(False)
+        return original(*args)
+    monkeypatch.setattr(lf, "_planes_desde_indice", planes_desde_indice)
+
+    lf._buscar_tiendas([_deteccion(lf, fixture_rekognition)])
+    assert en_loop == [False]
+
+
+def test_entrada_vieja_se_refresca_una_sola_vez(lf, indice, monkeypatch, fixture_rekognition, shopping):
+    deteccion = _deteccion(lf, fixture_rekognition)
+    _indexar(lf, indice, deteccion, shopping)
+    monkeypatch.setattr(lf, "INDICE_TTL", -1)   # todo vencido, pero dentro de INDICE_MAX_EDAD
+    refrescos = []
+    monkeypatch.setattr(lf, "_en_indice_async", lambda fn, *args: refrescos.append(fn))
+
+    def buscar():
+        lf._resultados_desde_indice(deteccion, deteccion["planes"][0], lf._ResultadosBusqueda())
+    hilos = [threading.Thread(target=buscar) for _ in range(16)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    assert refrescos == [lf._refrescar_plan]
@@ -0,0 +1,71 @@
+"""Paso 1: validación de la imagen, por base64 o por subida directa a S3."""
+
+import base64
+import hashlib
+import io
+
+import bench
+import pytest
+
+KEY = "uploads/hombre/directo/" + "a" * 32 + ".jpg"
+
+
+def _objeto(contenido: bytes, total: int = None):
+    """get_object de S3 para una subida: el objeto entero, con su tamaño en los headers."""
+    def get_object(**_):
+        return {
+            "Body":          io.BytesIO(contenido),
+            "ContentLength": total if total is not None else len(contenido),
+        }
+    return get_object
+
+
+def test_subida_directa_valida(lf):
+    lf._s3().respuestas["get_object"] = _objeto(bench.IMAGEN_JPEG)
+    prep = lf._preparar_imagen("hombre", s3_key_subida=KEY)
+    assert prep["image_hash"] == hashlib.sha256(bench.IMAGEN_JPEG).hexdigest()
+    assert prep["image_bytes"] == bench.IMAGEN_JPEG
+    assert prep["s3_key"] == KEY
+
+
+def test_misma_foto_por_base64_y_por_subida_comparte_cache(lf, fixture_rekognition):
+    lf._rekognition().respuestas["detect_labels"] = fixture_rekognition("una_prenda")["detect_labels"]
+    lf._s3().respuestas["get_object"] = _objeto(bench.IMAGEN_JPEG)
+    por_base64 = lf._preparar_imagen("hombre", base64.b64encode(bench.IMAGEN_JPEG).decode())
+    por_subida = lf._preparar_imagen("hombre", s3_key_subida=KEY)
+    assert por_base64["image_hash"] == por_subida["image_hash"]
+
+    vision, _ = lf._obtener_vision(por_base64)
+    llamadas  = lf._rekognition().llamadas
+    assert lf._obtener_vision(por_subida)[0] == vision
+    assert lf._rekognition().llamadas == llamadas   # del cache, sin Rekognition
+
+
+def test_subida_directa_que_no_es_imagen(lf):
+    # Content-Type de imagen en la subida, contenido cualquiera
+    lf._s3().respuestas["get_object"] = _objeto(b"<html><body>hola</body></html>")
+    with pytest.raises(lf.ImagenInvalida) as e:
+        lf._preparar_imagen("hombre", s3_key_subida=KEY)
+    assert e.value.status == 415
+
+
+def test_subida_directa_demasiado_grande(lf):
+    lf._s3().respuestas["get_object"] = _objeto(bench.IMAGEN_JPEG, total=lf.REKOGNITION_MAX_S3_BYTES + 1)
+    with pytest.raises(lf.ImagenInvalida) as e:
+        lf._preparar_imagen("hombre", s3_key_subida=KEY)
+    assert e.value.status == 413
+
+
+def test_subida_directa_inexistente(lf):
+    def get_object(**kw):
+        raise KeyError("NoSuchKey")
+    lf._s3().respuestas["get_object"] = get_object
+    with pytest.raises(lf.ImagenInvalida) as e:
+        lf._preparar_imagen("hombre", s3_key_subida=KEY)
+    assert e.value.status == 404
+
+
+def test_subida_directa_key_de_otro_genero(lf):
+    with pytest.raises(lf.ImagenInvalida) as e:
+        lf._preparar_imagen("mujer", s3_key_subida=KEY)
+    assert e.value.status == 400
@@ -0,0 +1,65 @@
+"""Fase 2 de la búsqueda progresiva (_handle_job_busqueda)."""
+
+import json
+
+from conftest import ida_y_vuelta
+
+
+def _deteccion(lf, fixture_rekognition, caso="una_prenda"):
+    fixture = fixture_rekognition(caso)
+    vision  = lf._parse_rekognition(fixture["detect_labels"])
+    return ida_y_vuelta(lf._detectar_prendas(vision, fixture["genero"]))
+
+
+def _correr_job(lf, deteccion, contexto):
+    guardados = []
+    lf._s3().respuestas["put_object"] = lambda **kw: guardados.append(json.loads(kw["Body"]))
+    lf._handle_job_busqueda({"job_id": "j1", "deteccion": deteccion}, contexto)
+    return guardados
+
+
+def test_variante_perezosa_se_pide_dentro_del_job(lf, monkeypatch, fixture_rekognition, shopping, contexto):
+    # Sin variante especulativa y con pocas tiendas, el merge necesita la
+    # variante: antes salía a buscarla con asyncio.run dentro del loop
+    monkeypatch.setattr(lf, "SERPAPI_VARIANTE_PARALELA", False)
+    pedidas = []
+
+    def serpapi(query, hl="en", gl="us"):
+        pedidas.append(query)
+        return shopping[:4]
+    monkeypatch.setattr(lf, "_fetch_serpapi_remote", serpapi)
+
+    deteccion = _deteccion(lf, fixture_rekognition)
+    assert deteccion["query_variante"] not in lf._queries_busqueda(deteccion)
+    guardados = _correr_job(lf, deteccion, contexto)
+
+    final = guardados[-1]
+    assert final["estado"] == "listo"
+    assert final["prendas"][0]["tiendas"]
+    assert deteccion["query_variante"] in pedidas
+    assert len(pedidas) == len(set(pedidas))
+
+
+def test_variante_no_se_pide_si_sobran_tiendas(lf, monkeypatch, fixture_rekognition, shopping, contexto):
+    monkeypatch.setattr(lf, "SERPAPI_VARIANTE_PARALELA", False)
+    pedidas = []
+
+    def serpapi(query, hl="en", gl="us"):
+        pedidas.append(query)
+        return [dict(item, title=f"{query} {item['title']}") for item in shopping]
+    monkeypatch.setattr(lf, "_fetch_serpapi_remote", serpapi)
+
+    deteccion = _deteccion(lf, fixture_rekognition)
+    final = _correr_job(lf, deteccion, contexto)[-1]
+    assert final["estado"] == "listo"
+    assert len(final["prendas"][0]["tiendas"]) == 18
+    assert deteccion["query_variante"] not in pedidas
+
+
+def test_outfit_publica_cada_prenda(lf, monkeypatch, fixture_rekognition, shopping, contexto):
+    monkeypatch.setattr(lf, "_fetch_serpapi_remote", lambda query, hl="en", gl="us": shopping[:5])
+    deteccion = _deteccion(lf, fixture_rekognition, "outfit")
+    final = _correr_job(lf, deteccion, contexto)[-1]
+    assert final["estado"] == "listo"
+    assert len(final["prendas"]) == len(deteccion["planes"]) > 1
+    assert all(p["tiendas"] for p in final["prendas"])
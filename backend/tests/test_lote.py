@@ -0,0 +1,38 @@
+"""POST /analizar-lote: resultado por imagen y queries compartidas."""
+
+import base64
+import json
+
+import bench
+
+
+def _lote(lf, contexto, n, genero="hombre"):
+    imagen = base64.b64encode(bench.IMAGEN_JPEG).decode()
+    evento = {"body": json.dumps({"genero": genero, "imagenes": [{"imagen_base64": imagen}] * n})}
+    respuesta = lf._handle_analizar_lote(evento, contexto)
+    assert respuesta["statusCode"] == 200
+    return json.loads(respuesta["body"])
+
+
+def test_queries_contadas_con_la_variante(lf, monkeypatch, contexto, fixture_rekognition, shopping):
+    monkeypatch.setattr(lf, "SERPAPI_VARIANTE_PARALELA", False)
+    fixture = fixture_rekognition("una_prenda")
+    lf._rekognition().respuestas["detect_labels"] = fixture["detect_labels"]
+    pedidas = []
+    monkeypatch.setattr(lf, "_fetch_serpapi_remote",
+                        lambda query, hl="en", gl="us": pedidas.append(query) or shopping[:4])
+
+    cuerpo = _lote(lf, contexto, 2, fixture["genero"])
+    assert cuerpo["exitosas"] == 2
+    # principal, amplia y variante por imagen; cada una sale una vez
+    assert cuerpo["queries_unicas"] == len(pedidas) == 3
+    assert cuerpo["queries_totales"] == 6
+
+
+def test_fetch_perezoso_cuenta_como_pedida(lf, monkeypatch, shopping):
+    monkeypatch.setattr(lf, "_fetch_serpapi_remote", lambda query, hl="en", gl="us": shopping)
+    resultados = lf._ResultadosBusqueda()
+    resultados.pedidas = 2   # lo que pidió el pipeline
+    lf._resultados_query("remera negra", resultados, "variante")
+    assert resultados.pedidas == 3
+    assert list(resultados) == ["remera negra"]
@@ -0,0 +1,124 @@
+"""Casi-duplicados: BK-tree, índice por género y reutilización de la visión."""
+
+import base64
+import io
+import random
+import threading
+import time
+
+import pytest
+
+
+def test_bktree_igual_que_fuerza_bruta(lf):
+    rng    = random.Random(7)
+    hashes = [rng.getrandbits(64) for _ in range(2000)]
+    arbol  = lf._BKTree()
+    for i, h in enumerate(hashes):
+        arbol.agregar(h, i)
+    for _ in range(50):
+        # Consultas cerca de un hash existente y al azar
+        q = rng.choice(hashes) ^ rng.getrandbits(64) & rng.getrandbits(64) & rng.getrandbits(64)
+        esperado = sorted(((h ^ q).bit_count(), i) for i, h in enumerate(hashes) if (h ^ q).bit_count() <= 8)
+        assert sorted(arbol.buscar(q, 8)) == esperado
+
+
+def test_bktree_mismo_hash_reemplaza(lf):
+    arbol = lf._BKTree()
+    arbol.agregar(0xF0F0, "viejo")
+    arbol.agregar(0xF0F0, "nuevo")
+    assert arbol.n == 1
+    assert arbol.buscar(0xF0F0, 0) == [(0, "nuevo")]
+
+
+def test_indice_filtra_por_genero_y_edad(lf, monkeypatch):
+    indice = lf._IndicePHash()
+    indice.agregar(0xFF00FF00FF00FF00, "hombre", "h1")
+    indice.agregar(0xFF00FF00FF00FF01, "mujer", "m1")
+    assert indice.buscar(0xFF00FF00FF00FF03, "hombre") == [(2, "h1")]
+    assert indice.buscar(0x00FF00FF00FF00FF, "hombre") == []
+    monkeypatch.setattr(lf, "VISION_CACHE_TTL", -1)   # todo vencido
+    assert indice.buscar(0xFF00FF00FF00FF00, "hombre") == []
+
+
+def _esperar_sincronizacion(indice):
+    limite = time.monotonic() + 5
+    while indice._sincronizando and time.monotonic() < limite:
+        time.sleep(0.01)
+
+
+def test_indice_compartido_entre_contenedores(lf):
+    backend = lf._MemoryKVBackend()
+    uno, otro = lf._IndicePHash(backend), lf._IndicePHash(backend)
+    uno.agregar(0xFF00FF00FF00FF00, "hombre", "h1")
+    _esperar_sincronizacion(uno)
+    otro._sincronizar_ahora()
+    assert otro.buscar(0xFF00FF00FF00FF00, "hombre") == [(0, "h1")]
+
+
+class _PoolAnotador:
+    """Pool que no corre nada: solo anota lo que se le manda."""
+
+    def __init__(self):
+        self.lanzadas = []
+
+    def submit(self, fn, *args):
+        self.lanzadas.append(fn)
+
+
+def test_una_sola_sincronizacion_a_la_vez(lf, monkeypatch):
+    pool = _PoolAnotador()
+    monkeypatch.setattr(lf, "_pool", lambda upstream: pool)
+    indice = lf._IndicePHash(lf._MemoryKVBackend())
+    hilos  = [threading.Thread(target=indice.agregar, args=(0xFF00FF00FF00FF00 + i, "hombre", f"h{i}"))
+              for i in range(16)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    assert len(pool.lanzadas) == 1
+
+
+@pytest.fixture
+def con_pillow(lf):
+    pytest.importorskip("PIL")
+    lf._phash_activo.cache_clear()
+    yield
+    lf._phash_activo.cache_clear()
+
+
+def _foto(calidad: int, lado: int = 800):
+    from PIL import Image, ImageDraw
+    img = Image.new("RGB", (800, 1000), (245, 245, 245))
+    d = ImageDraw.Draw(img)
+    d.rectangle([200, 150, 600, 600], fill=(200, 20, 30))
+    d.ellipse([250, 600, 550, 950], fill=(20, 30, 120))
+    if lado != 800:
+        img = img.resize((lado, lado * 5 // 4))
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=calidad)
+    return base64.b64encode(out.getvalue()).decode()
+
+
+def test_casi_duplicado_omite_rekognition(lf, con_pillow, fixture_rekognition, monkeypatch):
+    monkeypatch.setattr(lf, "_colores_locales_disponibles", lambda: False)
+    labels = fixture_rekognition("una_prenda")["detect_labels"]
+    lf._rekognition().respuestas["detect_labels"] = lambda **_: labels
+    lf._s3().respuestas["put_object"] = {}
+
+    original, _ = lf._obtener_vision(lf._preparar_imagen("hombre", _foto(92)))
+    recomprimida, _ = lf._obtener_vision(lf._preparar_imagen("hombre", _foto(55, lado=600)))
+    assert lf._rekognition().llamadas == 1
+    assert recomprimida == original
+
+    # Mismo contenido, otro género: se analiza de nuevo
+    lf._obtener_vision(lf._preparar_imagen("mujer", _foto(70)))
+    assert lf._rekognition().llamadas == 2
+
+
+def test_sin_pillow_queda_desactivado(lf, monkeypatch):
+    lf._phash_activo.cache_clear()
+    monkeypatch.setattr(lf, "_modulo_disponible", lambda nombre: False)
+    try:
+        assert not lf._phash_activo()
+    finally:
+        lf._phash_activo.cache_clear()
@@ -0,0 +1,94 @@
+"""_PoolHTTPS: reintento de conexiones reusadas muertas y cuerpos gzip."""
+
+import gzip
+import http.client
+import time
+
+import pytest
+
+
+class _Respuesta:
+    def __init__(self, cuerpo, encoding=None, will_close=False):
+        self.status, self.will_close = 200, will_close
+        self._cuerpo, self._encoding = cuerpo, encoding
+
+    def read(self):
+        return self._cuerpo
+
+    def getheader(self, nombre):
+        return self._encoding if nombre == "Content-Encoding" else None
+
+
+class _Conexion:
+    """Conexión falsa: responde `respuesta` o levanta `error` en getresponse."""
+
+    def __init__(self, respuesta=None, error=None):
+        self.respuesta, self.error = respuesta, error
+        self.pedidos, self.cerrada = [], False
+
+    def request(self, metodo, ruta, headers=None):
+        self.pedidos.append((metodo, ruta, headers))
+
+    def getresponse(self):
+        if self.error is not None:
+            raise self.error
+        return self.respuesta
+
+    def close(self):
+        self.cerrada = True
+
+
+@pytest.fixture
+def pool(lf):
+    return lf._PoolHTTPS("serpapi.test", max_libres=2, idle_max=60, timeout=5)
+
+
+def _con_nuevas(monkeypatch, pool, *conexiones):
+    pendientes = list(conexiones)
+
+    def nueva():
+        pool.stats["nuevas"] += 1
+        return pendientes.pop(0)
+    monkeypatch.setattr(pool, "_nueva", nueva)
+
+
+def _ociosa(pool, conexion):
+    pool._libres.append((conexion, time.monotonic()))
+
+
+def test_reusada_muerta_se_reintenta_en_una_nueva(pool, monkeypatch):
+    muerta = _Conexion(error=http.client.RemoteDisconnected("cerrada por el servidor"))
+    nueva  = _Conexion(_Respuesta(b'{"ok": true}'))
+    _ociosa(pool, muerta)
+    _con_nuevas(monkeypatch, pool, nueva)
+
+    assert pool.get("/search.json?q=remera") == (200, b'{"ok": true}')
+    assert muerta.cerrada and len(nueva.pedidos) == 1
+    assert pool.stats["reusadas"] == pool.stats["nuevas"] == pool.stats["reintentos"] == 1
+    assert [c for c, _ in pool._libres] == [nueva]   # la nueva queda para la próxima
+
+
+def test_timeout_en_reusada_no_se_reintenta(pool, monkeypatch):
+    lenta = _Conexion(error=TimeoutError("timed out"))
+    _ociosa(pool, lenta)
+    _con_nuevas(monkeypatch, pool)   # pedir una nueva haría fallar el pop
+
+    with pytest.raises(TimeoutError):
+        pool.get("/search.json")
+    assert lenta.cerrada and pool.stats["reintentos"] == 0
+
+
+def test_falla_en_conexion_nueva_no_se_reintenta(pool, monkeypatch):
+    _con_nuevas(monkeypatch, pool, _Conexion(error=ConnectionResetError()))
+    with pytest.raises(ConnectionResetError):
+        pool.get("/search.json")
+    assert pool.stats["nuevas"] == 1 and pool.stats["reintentos"] == 0
+
+
+def test_cuerpo_gzip_se_descomprime(pool, monkeypatch):
+    conexion = _Conexion(_Respuesta(gzip.compress(b'{"shopping_results": []}'), encoding="gzip", will_close=True))
+    _con_nuevas(monkeypatch, pool, conexion)
+
+    assert pool.get("/search.json") == (200, b'{"shopping_results": []}')
+    assert conexion.pedidos[0][2]["Accept-Encoding"] == "gzip"
+    assert conexion.cerrada and not pool._libres   # will_close: no vuelve al pool
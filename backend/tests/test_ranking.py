@@ -0,0 +1,76 @@
+"""_MotorRanking contra el merge original (listas + sort estable)."""
+
+import random
+
+import pytest
+
+
+def _score_tienda(t: dict) -> float:
+    """El score original, sobre la tienda ya convertida."""
+    score = 0.0
+    if t.get("imagen"):          score += 5.0
+    if t.get("precio", 0) > 0:   score += 3.0
+    if t.get("rating"):          score += float(t["rating"]) * 1.5
+    if t.get("reviews"):         score += min(float(t["reviews"]) / 100, 3.0)
+    return score
+
+
+def _merge_original(lf, streams: list, k: int = 18) -> list:
+    vistos, tiendas, conteo_fuente = set(), [], {}
+    for items in streams:
+        for item in items:
+            fuente = item.get("source", "")
+            if conteo_fuente.get(fuente, 0) >= 3:
+                continue
+            conteo_fuente[fuente] = conteo_fuente.get(fuente, 0) + 1
+            key = f"{fuente}-{item.get('title', '')[:40]}"
+            if key not in vistos:
+                vistos.add(key)
+                tiendas.append(lf._item_to_tienda(item))
+    tiendas.sort(key=_score_tienda, reverse=True)
+    return tiendas[:k]
+
+
+def _items(rng, n: int) -> list:
+    # Pocos valores posibles por campo: muchos empates de score y duplicados
+    return [{
+        "source":          rng.choice("ABCDEFGH"),
+        "title":           f"producto {rng.randrange(12)}",
+        "thumbnail":       rng.choice(["", "t.jpg"]),
+        "extracted_price": rng.choice([0, 19.9, 35]),
+        "price":           "$19.90",
+        "rating":          rng.choice([None, 4.0, 4.5]),
+        "reviews":         rng.choice([None, 50, 1200]),
+        "product_link":    f"https://ejemplo/{i}",
+    } for i in range(n)]
+
+
+@pytest.mark.parametrize("semilla", range(40))
+def test_mismo_resultado_que_el_sort_estable(lf, semilla):
+    rng     = random.Random(semilla)
+    streams = [_items(rng, rng.randrange(0, 40)) for _ in range(rng.randrange(1, 4))]
+    motor   = lf._MotorRanking()
+    for items in streams:
+        motor.agregar(items)
+    assert motor.resultado() == _merge_original(lf, streams)
+
+
+def test_empate_gana_el_que_llego_primero(lf):
+    items = [{"source": f"S{i}", "title": f"t{i}", "thumbnail": "x", "extracted_price": 10,
+              "product_link": f"l{i}"} for i in range(30)]
+    resultado = lf._MotorRanking(k=5).agregar(items[:15]).agregar(items[15:]).resultado()
+    assert [t["link"] for t in resultado] == ["l0", "l1", "l2", "l3", "l4"]
+
+
+def test_duplicado_consume_cupo_de_su_fuente(lf):
+    item = {"source": "A", "title": "igual", "product_link": "l"}
+    otro = {"source": "A", "title": "distinto", "product_link": "m"}
+    motor = lf._MotorRanking().agregar([item, item, item, otro])
+    assert motor.aceptados == 1
+    assert [t["producto"] for t in motor.resultado()] == ["igual"]
+
+
+def test_scorer_enchufable(lf):
+    items = [{"source": f"S{i}", "title": f"t{i}", "product_link": f"l{i}", "reviews": i} for i in range(5)]
+    resultado = lf._MotorRanking(scorer=lambda item: -item["reviews"]).agregar(items).resultado()
+    assert [t["link"] for t in resultado] == ["l0", "l1", "l2", "l3", "l4"]
@@ -0,0 +1,68 @@
+"""Entrada y salida HTTP: body en base64, formato compacto y compresión."""
+
+import base64
+import gzip
+import json
+
+import bench
+import pytest
+
+
+def _evento(body, ruta="/analizar", headers=None, en_base64=True):
+    return {
+        "resource":        ruta,
+        "headers":         headers or {},
+        "body":            body,
+        "isBase64Encoded": en_base64,
+    }
+
+
+def _json(respuesta):
+    body = respuesta["body"]
+    if respuesta.get("isBase64Encoded"):
+        body = gzip.decompress(base64.b64decode(body)).decode("utf-8")
+    return json.loads(body)
+
+
+@pytest.mark.parametrize("body", ["no es base64!", base64.b64encode(b"\xff\xfe\x00 binario").decode()])
+def test_body_mal_formado_es_400(lf, contexto, body):
+    respuesta = lf.lambda_handler(_evento(body), contexto)
+    assert respuesta["statusCode"] == 400
+    assert _json(respuesta)["success"] is False
+
+
+def test_body_en_base64_llega_decodificado(lf, contexto):
+    body = base64.b64encode(json.dumps({"genero": "otro"}).encode()).decode()
+    respuesta = lf.lambda_handler(_evento(body, "/subir"), contexto)
+    assert respuesta["statusCode"] == 400
+    assert "genero" in _json(respuesta)["error"].lower()
+
+
+def test_analizar_compacto_y_gzip(lf, monkeypatch, contexto, fixture_rekognition, shopping):
+    fixture = fixture_rekognition("outfit")
+    lf._rekognition().respuestas["detect_labels"] = fixture["detect_labels"]
+    monkeypatch.setattr(lf, "_fetch_serpapi_remote", lambda query, hl="en", gl="us": shopping)
+    evento = _evento(json.dumps({
+        "imagen_base64": base64.b64encode(bench.IMAGEN_JPEG).decode(),
+        "genero":        fixture["genero"],
+    }), en_base64=False, headers={"X-Formato-Respuesta": "compacto", "Accept-Encoding": "gzip"})
+
+    respuesta = lf.lambda_handler(evento, contexto)
+    assert respuesta["statusCode"] == 200
+    assert respuesta["headers"]["Content-Encoding"] == "gzip"
+    cuerpo = _json(respuesta)
+    assert cuerpo["formato"] == "compacto"
+    assert len(cuerpo["prendas"]) > 1
+    assert "etiquetas" in cuerpo["comun"]
+    for prenda in cuerpo["prendas"]:
+        assert "etiquetas" not in prenda and "tallas_disponibles" not in prenda
+        for tienda in prenda["tiendas"]:
+            assert all(tienda.get(k, lf._SIN_DEFAULT) != v for k, v in lf._TIENDA_DEFAULTS.items())
+
+
+def test_compactar_conserva_prendas_buscando(lf):
+    prendas = [{"tipo_es": "Polo", "tiendas": None, "patron": None, "etiquetas": ["a"]},
+               {"tipo_es": "Jean", "tiendas": None, "patron": None, "etiquetas": ["a"]}]
+    compacto = lf._compactar({"success": True, "prendas": prendas})
+    assert compacto["prendas"] == [{"tipo_es": "Polo", "tiendas": None}, {"tipo_es": "Jean", "tiendas": None}]
+    assert compacto["comun"] == {"etiquetas": ["a"]}
@@ -1,7 +1,31 @@
 import { useState, useEffect, useRef } from "react";
 import './styles.css';
 
-const API_URL = "https://mub2c1l8gb.execute-api.us-east-1.amazonaws.com/prod/analizar";
+const API_BASE   = "https://mub2c1l8gb.execute-api.us-east-1.amazonaws.com/prod";
+const API_URL    = `${API_BASE}/analizar`;
+const UPLOAD_URL = `${API_BASE}/subir`;
+const JOBS_URL   = `${API_BASE}/resultados`;
+
+// Formato compacto: el backend omite lo constante y lo repetido entre
+// prendas (y el navegador descomprime gzip/br solo); acá se reconstruye
+const HEADER_COMPACTO = { "X-Formato-Respuesta": "compacto" };
+const PRENDA_DEFAULTS = { tallas_disponibles: ["XS", "S", "M", "L", "XL", "XXL"], patron: null, patron_en: null };
+const TIENDA_DEFAULTS = {
+  tipo: "online", tallas: ["XS", "S", "M", "L", "XL"], ubicacion: "Envío internacional",
+  disponible: true, imagen: "", precio_original: "", rating: null, reviews: null,
+};
+
+function expandirRespuesta(data) {
+  if (data.formato !== "compacto" || !data.prendas) return data;
+  const { comun = {}, formato, ...resto } = data;
+  return {
+    ...resto,
+    prendas: data.prendas.map(p => ({
+      ...PRENDA_DEFAULTS, ...comun, ...p,
+      tiendas: p.tiendas ? p.tiendas.map(t => ({ ...TIENDA_DEFAULTS, ...t })) : p.tiendas ?? null,
+    })),
+  };
+}
 
 const SOCIALS = {
   andres: { ig: "https://www.instagram.com/andresrodas.exe/", linkedin: "https://www.linkedin.com/in/andres-rodas-802309272/", github: "https://github.com/AndresRJ18" },
@@ -54,6 +78,69 @@ function formatPrecio(precio, moneda) {
   return `${sym}${precio.toFixed(2)}`;
 }
 
+// Preprocesado antes de subir: reduce al lado máximo, aplica la orientación EXIF
+// y re-codifica (el canvas no conserva metadatos). Rekognition solo acepta
+// JPEG/PNG, por eso el formato por defecto es JPEG y no WebP.
+const IMAGEN_MAX_LADO = 1600;
+const IMAGEN_CALIDAD  = 0.85;
+const IMAGEN_FORMATO  = "image/jpeg";
+
+async function prepararImagen(archivo, { maxLado = IMAGEN_MAX_LADO, calidad = IMAGEN_CALIDAD, formato = IMAGEN_FORMATO } = {}) {
+  if (typeof createImageBitmap !== "function") return archivo;
+  let bitmap;
+  try {
+    bitmap = await createImageBitmap(archivo, { imageOrientation: "from-image" });
+  } catch {
+    return archivo; // el navegador no decodifica el formato (ej. HEIC): el Lambda lo normaliza
+  }
+  const escala = Math.min(1, maxLado / Math.max(bitmap.width, bitmap.height));
+  const w = Math.max(1, Math.round(bitmap.width * escala));
+  const h = Math.max(1, Math.round(bitmap.height * escala));
+  const dibujar = ctx => {
+    ctx.fillStyle = "#FFFFFF"; // PNG con transparencia → fondo blanco en JPEG
+    ctx.fillRect(0, 0, w, h);
+    ctx.drawImage(bitmap, 0, 0, w, h);
+  };
+  let blob;
+  if (typeof OffscreenCanvas !== "undefined") {
+    const canvas = new OffscreenCanvas(w, h);
+    dibujar(canvas.getContext("2d"));
+    blob = await canvas.convertToBlob({ type: formato, quality: calidad });
+  } else {
+    const canvas = document.createElement("canvas");
+    canvas.width = w; canvas.height = h;
+    dibujar(canvas.getContext("2d"));
+    blob = await new Promise(res => canvas.toBlob(res, formato, calidad));
+  }
+  bitmap.close?.();
+  return blob || archivo;
+}
+
+// Sube la foto directo a S3 con una URL prefirmada y retorna la key para /analizar
+async function subirImagen(archivo, genero) {
+  const contentType = archivo.type === "image/png" ? "image/png" : "image/jpeg";
+  const res  = await fetch(UPLOAD_URL, { method: "POST", headers: { "Content-Type": "application/json" }, body: JSON.stringify({ genero, content_type: contentType }) });
+  const data = await res.json();
+  if (!data.success) throw new Error(data.error || "No se pudo preparar la subida");
+  const put = await fetch(data.upload_url, { method: "PUT", headers: data.headers, body: archivo });
+  if (!put.ok) throw new Error("Fallo al subir la imagen");
+  return data.s3_key;
+}
+
+// Consulta el job de búsqueda hasta que termina; `onParcial` recibe por
+// prenda { tiendas, parcial } a medida que van llegando (tiendas null = aún buscando)
+async function esperarTiendas(jobId, onParcial, activo, { intervalo = 700, maxMs = 30000 } = {}) {
+  const limite = Date.now() + maxMs;
+  while (activo() && Date.now() < limite) {
+    await new Promise(res => setTimeout(res, intervalo));
+    const res  = await fetch(`${JOBS_URL}/${jobId}`, { headers: HEADER_COMPACTO });
+    const data = expandirRespuesta(await res.json());
+    if (!data.success || !activo()) return;
+    onParcial(data.prendas);
+    if (data.estado !== "buscando") return;
+  }
+}
+
 function StarRating({ rating }) {
   if (!rating) return null;
   const stars = Math.round(rating);
@@ -313,13 +400,15 @@ function ProductCard({ t, isM, cBg, cBorder, r, aBg, accent }) {
 // ─── Página principal ─────────────────────────────────────────────────────────
 function MainPage({ genero, onSwitch, onHome }) {
   const [preview,     setPreview]     = useState(null);
-  const [base64,      setBase64]      = useState(null);
+  const [archivo,     setArchivo]     = useState(null);
   const [loading,     setLoading]     = useState(false);
   const [result,      setResult]      = useState(null);
   const [dragOver,    setDragOver]    = useState(false);
   const [showContact, setShowContact] = useState(false);
   const fileRef   = useRef(null);
   const resultRef = useRef(null);
+  const preparada = useRef(null); // promesa de la imagen ya reducida/re-codificada
+  const jobActivo = useRef(null); // job de búsqueda progresiva en curso
 
   const isM    = genero === "mujer";
   const bg     = isM ? "#FAF8F4"                    : "#1C1410";
@@ -335,25 +424,51 @@ function MainPage({ genero, onSwitch, onHome }) {
 
   const handleFile = f => {
     if (!f || !f.type.startsWith("image/")) return;
-    const rd = new FileReader();
-    rd.onload = e => { setPreview(e.target.result); setBase64(e.target.result.split(",")[1]); setResult(null); };
-    rd.readAsDataURL(f);
+    if (preview) URL.revokeObjectURL(preview);
+    setPreview(URL.createObjectURL(f)); setArchivo(f); setResult(null);
+    // Se prepara mientras el usuario mira la preview
+    preparada.current = prepararImagen(f);
   };
 
   const scan = async () => {
-    if (!base64) return;
+    if (!archivo) return;
     setLoading(true);
     try {
-      const res  = await fetch(API_URL, { method: "POST", headers: { "Content-Type": "application/json" }, body: JSON.stringify({ imagen_base64: base64, genero }) });
-      const data = await res.json();
-      if (data.success) { setResult(data); setTimeout(() => resultRef.current?.scrollIntoView({ behavior: "smooth" }), 300); }
+      const imagen = (await preparada.current) || archivo;
+      const s3Key  = await subirImagen(imagen, genero);
+      const res  = await fetch(API_URL, { method: "POST", headers: { "Content-Type": "application/json", ...HEADER_COMPACTO }, body: JSON.stringify({ s3_key: s3Key, genero, progresivo: true }) });
+      const data = expandirRespuesta(await res.json());
+      if (data.success) {
+        // Las prendas se muestran ya; las tiendas llegan después por prenda
+        setResult(data); setLoading(false);
+        setTimeout(() => resultRef.current?.scrollIntoView({ behavior: "smooth" }), 300);
+        if (data.job_id && data.estado === "buscando") {
+          const jobId = data.job_id;
+          jobActivo.current = jobId;
+          const completar = parciales => setResult(prev => prev && prev.job_id === jobId ? {
+            ...prev,
+            prendas: prev.prendas.map((p, i) => ({
+              ...p,
+              tiendas: parciales[i]?.tiendas ?? p.tiendas,
+              parcial: parciales[i]?.parcial || p.parcial,
+            })),
+          } : prev);
+          await esperarTiendas(jobId, completar, () => jobActivo.current === jobId).catch(() => {});
+          // Si el job no terminó a tiempo, las prendas pendientes quedan sin tiendas
+          setResult(prev => prev && prev.job_id === jobId ? {
+            ...prev,
+            prendas: prev.prendas.map(p => ({ ...p, tiendas: p.tiendas ?? [] })),
+          } : prev);
+        }
+      }
       else alert("Error: " + (data.error || "Fallo al procesar imagen"));
-    } catch { alert("Error de conexión con AWS"); }
+    } catch (e) { alert(e.message ? "Error: " + e.message : "Error de conexión con AWS"); }
     setLoading(false);
   };
 
   const reset = () => {
-    setPreview(null); setBase64(null); setResult(null);
+    if (preview) URL.revokeObjectURL(preview);
+    setPreview(null); setArchivo(null); setResult(null); preparada.current = null; jobActivo.current = null;
     if (fileRef.current) fileRef.current.value = "";
     window.scrollTo({ top: 0, behavior: "smooth" });
   };
@@ -643,6 +758,17 @@ function MainPage({ genero, onSwitch, onHome }) {
                     {es_outfit ? `Dónde comprar — ${p.tipo_es}` : "Dónde comprarlo"}
                   </h3>
                   <p style={{ fontFamily: "'Space Mono'", fontSize: "0.6rem", opacity: 0.4, marginBottom: "1.5rem" }}>Tiendas online · Envío internacional</p>
+                  {p.parcial && (
+                    <p style={{ fontFamily: "'Space Mono'", fontSize: "0.6rem", color: accent, marginTop: "-1rem", marginBottom: "1.5rem" }}>
+                      Resultados parciales: algunas tiendas no respondieron a tiempo
+                    </p>
+                  )}
+                  {p.tiendas === null && (
+                    <div style={{ display: "flex", alignItems: "center", gap: "0.7rem", marginBottom: "3rem" }}>
+                      <span style={{ width: 14, height: 14, border: `2px solid ${aBo}`, borderTopColor: accent, borderRadius: "50%", animation: "spin 0.9s linear infinite" }}/>
+                      <span style={{ fontFamily: "'Space Mono'", fontSize: "0.7rem", color: accent }}>Buscando en tiendas globales...</span>
+                    </div>
+                  )}
                   <div style={{ display: "grid", gridTemplateColumns: "repeat(auto-fill, minmax(295px, 1fr))", gap: "1.6rem", marginBottom: "3rem" }}>
                     {(p.tiendas || []).map((t, i) => (
                       <ProductCard key={`${t.nombre}-${i}`} t={t} isM={isM} cBg={cBg} cBorder={cBorder} r={r} aBg={aBg} accent={accent}/>
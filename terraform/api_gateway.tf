@@ -9,6 +9,11 @@ resource "aws_api_gateway_rest_api" "stylematch" {
   endpoint_configuration {
     types = ["REGIONAL"] # Más barato que EDGE para una app en Lima
   }
+
+  # El Lambda responde comprimido (gzip/br, isBase64Encoded) si el cliente
+  # manda Accept-Encoding. Con */* API Gateway decodifica esas respuestas y
+  # entrega los bodies de request en base64 (el handler los decodifica).
+  binary_media_types = ["*/*"]
 }
 
 # ─── Recurso /analizar ───
@@ -50,6 +55,9 @@ resource "aws_api_gateway_integration" "options_integration" {
   http_method = aws_api_gateway_method.options_analizar.http_method
   type        = "MOCK"
 
+  # Con binary_media_types = */* el template del MOCK necesita el body como texto
+  content_handling = "CONVERT_TO_TEXT"
+
   request_templates = {
     "application/json" = jsonencode({ statusCode = 200 })
   }
@@ -79,7 +87,7 @@ resource "aws_api_gateway_integration_response" "options_response" {
   status_code = aws_api_gateway_method_response.options_200.status_code
 
   response_parameters = {
-    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type'"
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,X-Formato-Respuesta'"
     "method.response.header.Access-Control-Allow-Methods" = "'POST,OPTIONS'"
     "method.response.header.Access-Control-Allow-Origin"  = "'*'"
   }
@@ -87,6 +95,241 @@ resource "aws_api_gateway_integration_response" "options_response" {
   depends_on = [aws_api_gateway_integration.options_integration]
 }
 
+# ─── Recurso /subir — URL prefirmada para subir la foto directo a S3 ───
+resource "aws_api_gateway_resource" "subir" {
+  rest_api_id = aws_api_gateway_rest_api.stylematch.id
+  parent_id   = aws_api_gateway_rest_api.stylematch.root_resource_id
+  path_part   = "subir"
+}
+
+resource "aws_api_gateway_method" "post_subir" {
+  rest_api_id   = aws_api_gateway_rest_api.stylematch.id
+  resource_id   = aws_api_gateway_resource.subir.id
+  http_method   = "POST"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_integration" "subir_lambda_integration" {
+  rest_api_id             = aws_api_gateway_rest_api.stylematch.id
+  resource_id             = aws_api_gateway_resource.subir.id
+  http_method             = aws_api_gateway_method.post_subir.http_method
+  type                    = "AWS_PROXY"
+  integration_http_method = "POST"
+  uri                     = aws_lambda_function.stylematch.invoke_arn
+}
+
+resource "aws_api_gateway_method" "options_subir" {
+  rest_api_id   = aws_api_gateway_rest_api.stylematch.id
+  resource_id   = aws_api_gateway_resource.subir.id
+  http_method   = "OPTIONS"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_integration" "options_subir_integration" {
+  rest_api_id = aws_api_gateway_rest_api.stylematch.id
+  resource_id = aws_api_gateway_resource.subir.id
+  http_method = aws_api_gateway_method.options_subir.http_method
+  type        = "MOCK"
+
+  content_handling = "CONVERT_TO_TEXT"
+
+  request_templates = {
+    "application/json" = jsonencode({ statusCode = 200 })
+  }
+}
+
+resource "aws_api_gateway_method_response" "options_subir_200" {
+  rest_api_id = aws_api_gateway_rest_api.stylematch.id
+  resource_id = aws_api_gateway_resource.subir.id
+  http_method = aws_api_gateway_method.options_subir.http_method
+  status_code = "200"
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = true
+    "method.response.header.Access-Control-Allow-Methods" = true
+    "method.response.header.Access-Control-Allow-Origin"  = true
+  }
+
+  response_models = {
+    "application/json" = "Empty"
+  }
+}
+
+resource "aws_api_gateway_integration_response" "options_subir_response" {
+  rest_api_id = aws_api_gateway_rest_api.stylematch.id
+  resource_id = aws_api_gateway_resource.subir.id
+  http_method = aws_api_gateway_method.options_subir.http_method
+  status_code = aws_api_gateway_method_response.options_subir_200.status_code
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,X-Formato-Respuesta'"
+    "method.response.header.Access-Control-Allow-Methods" = "'POST,OPTIONS'"
+    "method.response.header.Access-Control-Allow-Origin"  = "'*'"
+  }
+
+  depends_on = [aws_api_gateway_integration.options_subir_integration]
+}
+
+# ─── Recurso /analizar-lote — varias fotos por request (catálogos) ───
+resource "aws_api_gateway_resource" "analizar_lote" {
+  rest_api_id = aws_api_gateway_rest_api.stylematch.id
+  parent_id   = aws_api_gateway_rest_api.stylematch.root_resource_id
+  path_part   = "analizar-lote"
+}
+
+resource "aws_api_gateway_method" "post_lote" {
+  rest_api_id   = aws_api_gateway_rest_api.stylematch.id
+  resource_id   = aws_api_gateway_resource.analizar_lote.id
+  http_method   = "POST"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_integration" "lote_lambda_integration" {
+  rest_api_id             = aws_api_gateway_rest_api.stylematch.id
+  resource_id             = aws_api_gateway_resource.analizar_lote.id
+  http_method             = aws_api_gateway_method.post_lote.http_method
+  type                    = "AWS_PROXY"
+  integration_http_method = "POST"
+  uri                     = aws_lambda_function.stylematch.invoke_arn
+}
+
+resource "aws_api_gateway_method" "options_lote" {
+  rest_api_id   = aws_api_gateway_rest_api.stylematch.id
+  resource_id   = aws_api_gateway_resource.analizar_lote.id
+  http_method   = "OPTIONS"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_integration" "options_lote_integration" {
+  rest_api_id = aws_api_gateway_rest_api.stylematch.id
+  resource_id = aws_api_gateway_resource.analizar_lote.id
+  http_method = aws_api_gateway_method.options_lote.http_method
+  type        = "MOCK"
+
+  content_handling = "CONVERT_TO_TEXT"
+
+  request_templates = {
+    "application/json" = jsonencode({ statusCode = 200 })
+  }
+}
+
+resource "aws_api_gateway_method_response" "options_lote_200" {
+  rest_api_id = aws_api_gateway_rest_api.stylematch.id
+  resource_id = aws_api_gateway_resource.analizar_lote.id
+  http_method = aws_api_gateway_method.options_lote.http_method
+  status_code = "200"
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = true
+    "method.response.header.Access-Control-Allow-Methods" = true
+    "method.response.header.Access-Control-Allow-Origin"  = true
+  }
+
+  response_models = {
+    "application/json" = "Empty"
+  }
+}
+
+resource "aws_api_gateway_integration_response" "options_lote_response" {
+  rest_api_id = aws_api_gateway_rest_api.stylematch.id
+  resource_id = aws_api_gateway_resource.analizar_lote.id
+  http_method = aws_api_gateway_method.options_lote.http_method
+  status_code = aws_api_gateway_method_response.options_lote_200.status_code
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,X-Formato-Respuesta'"
+    "method.response.header.Access-Control-Allow-Methods" = "'POST,OPTIONS'"
+    "method.response.header.Access-Control-Allow-Origin"  = "'*'"
+  }
+
+  depends_on = [aws_api_gateway_integration.options_lote_integration]
+}
+
+# ─── Recurso /resultados/{job_id} — tiendas de una búsqueda progresiva ───
+resource "aws_api_gateway_resource" "resultados" {
+  rest_api_id = aws_api_gateway_rest_api.stylematch.id
+  parent_id   = aws_api_gateway_rest_api.stylematch.root_resource_id
+  path_part   = "resultados"
+}
+
+resource "aws_api_gateway_resource" "resultado_job" {
+  rest_api_id = aws_api_gateway_rest_api.stylematch.id
+  parent_id   = aws_api_gateway_resource.resultados.id
+  path_part   = "{job_id}"
+}
+
+resource "aws_api_gateway_method" "get_resultado" {
+  rest_api_id   = aws_api_gateway_rest_api.stylematch.id
+  resource_id   = aws_api_gateway_resource.resultado_job.id
+  http_method   = "GET"
+  authorization = "NONE"
+
+  request_parameters = {
+    "method.request.path.job_id" = true
+  }
+}
+
+resource "aws_api_gateway_integration" "resultado_lambda_integration" {
+  rest_api_id             = aws_api_gateway_rest_api.stylematch.id
+  resource_id             = aws_api_gateway_resource.resultado_job.id
+  http_method             = aws_api_gateway_method.get_resultado.http_method
+  type                    = "AWS_PROXY"
+  integration_http_method = "POST"
+  uri                     = aws_lambda_function.stylematch.invoke_arn
+}
+
+resource "aws_api_gateway_method" "options_resultado" {
+  rest_api_id   = aws_api_gateway_rest_api.stylematch.id
+  resource_id   = aws_api_gateway_resource.resultado_job.id
+  http_method   = "OPTIONS"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_integration" "options_resultado_integration" {
+  rest_api_id = aws_api_gateway_rest_api.stylematch.id
+  resource_id = aws_api_gateway_resource.resultado_job.id
+  http_method = aws_api_gateway_method.options_resultado.http_method
+  type        = "MOCK"
+
+  content_handling = "CONVERT_TO_TEXT"
+
+  request_templates = {
+    "application/json" = jsonencode({ statusCode = 200 })
+  }
+}
+
+resource "aws_api_gateway_method_response" "options_resultado_200" {
+  rest_api_id = aws_api_gateway_rest_api.stylematch.id
+  resource_id = aws_api_gateway_resource.resultado_job.id
+  http_method = aws_api_gateway_method.options_resultado.http_method
+  status_code = "200"
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = true
+    "method.response.header.Access-Control-Allow-Methods" = true
+    "method.response.header.Access-Control-Allow-Origin"  = true
+  }
+
+  response_models = {
+    "application/json" = "Empty"
+  }
+}
+
+resource "aws_api_gateway_integration_response" "options_resultado_response" {
+  rest_api_id = aws_api_gateway_rest_api.stylematch.id
+  resource_id = aws_api_gateway_resource.resultado_job.id
+  http_method = aws_api_gateway_method.options_resultado.http_method
+  status_code = aws_api_gateway_method_response.options_resultado_200.status_code
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,X-Formato-Respuesta'"
+    "method.response.header.Access-Control-Allow-Methods" = "'GET,OPTIONS'"
+    "method.response.header.Access-Control-Allow-Origin"  = "'*'"
+  }
+
+  depends_on = [aws_api_gateway_integration.options_resultado_integration]
+}
+
 # ─── Deploy y Stage ───
 resource "aws_api_gateway_deployment" "prod" {
   rest_api_id = aws_api_gateway_rest_api.stylematch.id
@@ -99,6 +342,26 @@ resource "aws_api_gateway_deployment" "prod" {
       aws_api_gateway_integration.lambda_integration.id,
       aws_api_gateway_method.options_analizar.id,
       aws_api_gateway_integration.options_integration.id,
+      aws_api_gateway_resource.subir.id,
+      aws_api_gateway_method.post_subir.id,
+      aws_api_gateway_integration.subir_lambda_integration.id,
+      aws_api_gateway_method.options_subir.id,
+      aws_api_gateway_integration.options_subir_integration.id,
+      aws_api_gateway_resource.analizar_lote.id,
+      aws_api_gateway_method.post_lote.id,
+      aws_api_gateway_integration.lote_lambda_integration.id,
+      aws_api_gateway_method.options_lote.id,
+      aws_api_gateway_integration.options_lote_integration.id,
+      aws_api_gateway_resource.resultado_job.id,
+      aws_api_gateway_method.get_resultado.id,
+      aws_api_gateway_integration.resultado_lambda_integration.id,
+      aws_api_gateway_method.options_resultado.id,
+      aws_api_gateway_integration.options_resultado_integration.id,
+      aws_api_gateway_integration_response.options_response.response_parameters,
+      aws_api_gateway_integration_response.options_subir_response.response_parameters,
+      aws_api_gateway_integration_response.options_lote_response.response_parameters,
+      aws_api_gateway_integration_response.options_resultado_response.response_parameters,
+      aws_api_gateway_rest_api.stylematch.binary_media_types,
     ]))
   }
 
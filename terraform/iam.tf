@@ -23,7 +23,7 @@ resource "aws_iam_role" "lambda" {
 # Política con permisos mínimos necesarios
 data "aws_iam_policy_document" "lambda_permissions" {
 
-  # S3: solo leer y escribir en NUESTRO bucket, solo en uploads/
+  # S3: solo leer y escribir en NUESTRO bucket, solo en uploads/, cache/, jobs/, indice/ y precarga/
   statement {
     sid     = "S3Access"
     actions = [
@@ -31,7 +31,22 @@ data "aws_iam_policy_document" "lambda_permissions" {
       "s3:GetObject"
     ]
     resources = [
-      "${aws_s3_bucket.images.arn}/uploads/*"
+      "${aws_s3_bucket.images.arn}/uploads/*",
+      "${aws_s3_bucket.images.arn}/cache/*",
+      "${aws_s3_bucket.images.arn}/jobs/*",
+      "${aws_s3_bucket.images.arn}/indice/*",
+      "${aws_s3_bucket.images.arn}/precarga/*"
+    ]
+  }
+
+  # Lambda: invocarse a sí mismo en asíncrono (fase de búsqueda progresiva)
+  statement {
+    sid     = "SelfInvoke"
+    actions = [
+      "lambda:InvokeFunction"
+    ]
+    resources = [
+      "arn:aws:lambda:${var.aws_region}:*:function:${var.project_name}-analyzer-*"
     ]
   }
 
@@ -4,12 +4,43 @@
 
 # Empaqueta lambda_function.py en zip automáticamente.
 # Se regenera si el archivo fuente cambia (source_content_filename hash).
+# Con lambda_precompilado = true sube backend/dist/ (fuente + bytecode,
+# armado con `python empaquetar.py`) y el cold start no compila el módulo.
 data "archive_file" "lambda_zip" {
   type        = "zip"
-  source_file = "${path.module}/../backend/lambda_function.py"
+  source_file = var.lambda_precompilado ? null : "${path.module}/../backend/lambda_function.py"
+  source_dir  = var.lambda_precompilado ? "${path.module}/../backend/dist" : null
   output_path = "${path.module}/../backend/lambda_function.zip"
 }
 
+# Layer con las dependencias opcionales (backend/capa/, armada con
+# `python empaquetar.py capa`): sin ella, HEIC/WebP se rechazan, las
+# imágenes grandes no se normalizan y los colores se piden a Rekognition.
+# capa_dependencias = false despliega sin layer.
+data "archive_file" "capa_zip" {
+  count       = var.capa_dependencias ? 1 : 0
+  type        = "zip"
+  source_dir  = "${path.module}/../backend/capa"
+  output_path = "${path.module}/../backend/capa.zip"
+
+  lifecycle {
+    precondition {
+      condition     = fileexists("${path.module}/../backend/capa/paquetes.txt")
+      error_message = "Falta backend/capa/: correr `python empaquetar.py capa` desde backend/ (o aplicar con -var capa_dependencias=false)."
+    }
+  }
+}
+
+resource "aws_lambda_layer_version" "dependencias" {
+  count               = var.capa_dependencias ? 1 : 0
+  layer_name          = "${var.project_name}-dependencias-${random_id.suffix.hex}"
+  description         = "Dependencias opcionales del analizador (ver backend/capa/paquetes.txt)"
+  filename            = data.archive_file.capa_zip[0].output_path
+  source_code_hash    = data.archive_file.capa_zip[0].output_base64sha256
+  compatible_runtimes = ["python3.11"]
+  compatible_architectures = ["x86_64"]
+}
+
 resource "aws_lambda_function" "stylematch" {
   function_name = "${var.project_name}-analyzer-${random_id.suffix.hex}"
   description   = "Analiza fotos de ropa con Rekognition y busca tiendas en Lima"
@@ -18,6 +49,8 @@ resource "aws_lambda_function" "stylematch" {
   source_code_hash = data.archive_file.lambda_zip.output_base64sha256
   handler          = "lambda_function.lambda_handler"
   runtime          = "python3.11"
+  architectures    = ["x86_64"] # los wheels de la layer son manylinux2014_x86_64
+  layers           = aws_lambda_layer_version.dependencias[*].arn
 
   role    = aws_iam_role.lambda.arn
   timeout = 30
@@ -28,6 +61,16 @@ resource "aws_lambda_function" "stylematch" {
       S3_BUCKET_NAME  = aws_s3_bucket.images.id
       SERPAPI_KEY      = var.serpapi_key
       AWS_REGION_NAME  = var.aws_region
+      CACHE_SHARED_BACKEND = "s3"
+      CIRCUITO_COMPARTIDO  = "s3"
+      SERPAPI_CUOTA_POR_MIN = tostring(var.serpapi_cuota_por_min)
+      CUOTA_COMPARTIDA     = "s3"
+      PHASH_COMPARTIDO     = "s3"
+      VISION_CACHE_TTL     = tostring(var.vision_cache_ttl)
+      INDICE_S3_SYNC       = "1"
+      PRECARGA_S3          = "1"
+      REKOGNITION_IMAGE_SOURCE = "bytes"
+      LOG_LEVEL = "INFO"
     }
   }
 
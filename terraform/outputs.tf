@@ -7,6 +7,11 @@ output "api_url" {
   value       = "${aws_api_gateway_stage.prod.invoke_url}/analizar"
 }
 
+output "upload_url" {
+  description = "URL completa del endpoint POST /subir (URL prefirmada de S3)"
+  value       = "${aws_api_gateway_stage.prod.invoke_url}/subir"
+}
+
 output "bucket_name" {
   description = "Nombre del bucket S3 para imágenes"
   value       = aws_s3_bucket.images.id
@@ -23,6 +23,18 @@ resource "aws_s3_bucket_public_access_block" "images" {
   restrict_public_buckets = true
 }
 
+# CORS: el frontend sube la foto directo al bucket con la URL prefirmada de /subir
+resource "aws_s3_bucket_cors_configuration" "images" {
+  bucket = aws_s3_bucket.images.id
+
+  cors_rule {
+    allowed_methods = ["PUT"]
+    allowed_origins = ["*"]
+    allowed_headers = ["Content-Type"]
+    max_age_seconds = 3000
+  }
+}
+
 # Lifecycle: eliminar imágenes después de 7 días
 # Las fotos son temporales — solo necesitamos que Rekognition las procese
 resource "aws_s3_bucket_lifecycle_configuration" "images" {
@@ -40,6 +52,36 @@ resource "aws_s3_bucket_lifecycle_configuration" "images" {
       days = 7
     }
   }
+
+  # Cache compartido (SerpAPI, visión, circuito, cuota) — el TTL real lo
+  # controla el Lambda, esta regla solo acota el tamaño del prefijo. Tiene
+  # que durar más que el TTL más largo (visión) o las entradas no llegan a él.
+  rule {
+    id     = "expire-cache"
+    status = "Enabled"
+
+    filter {
+      prefix = "cache/"
+    }
+
+    expiration {
+      days = ceil(var.vision_cache_ttl / 86400) + 1
+    }
+  }
+
+  # Estado de las búsquedas progresivas — el cliente lo lee en segundos
+  rule {
+    id     = "expire-jobs"
+    status = "Enabled"
+
+    filter {
+      prefix = "jobs/"
+    }
+
+    expiration {
+      days = 1
+    }
+  }
 }
 
 # Carpetas lógicas (objetos vacíos que crean la estructura de prefijos)
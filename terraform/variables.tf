@@ -25,3 +25,32 @@ variable "environment" {
   type        = string
   default     = "production"
 }
+
+variable "lambda_precompilado" {
+  description = "Sube backend/dist/ (con bytecode de empaquetar.py) en vez de lambda_function.py suelto"
+  type        = bool
+  default     = false
+}
+
+variable "capa_dependencias" {
+  description = "Sube backend/capa/ (python empaquetar.py capa) como layer del Lambda"
+  type        = bool
+  default     = true
+}
+
+variable "serpapi_cuota_por_min" {
+  description = "Llamadas por minuto a SerpAPI que admite el limitador (0 = sin límite)"
+  type        = number
+  default     = 0
+}
+
+variable "vision_cache_ttl" {
+  description = "Segundos que se reutiliza el análisis de una foto (VISION_CACHE_TTL); la lifecycle de cache/ se alinea con este valor"
+  type        = number
+  default     = 259200 # 3 días
+
+  validation {
+    condition     = var.vision_cache_ttl > 0 && var.vision_cache_ttl < 7 * 86400
+    error_message = "vision_cache_ttl tiene que ser menor que la lifecycle de uploads/ (7 días)."
+  }
+}